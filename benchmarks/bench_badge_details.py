@@ -0,0 +1,97 @@
+"""Badge details latency for a badge held by 10k users, single and batched.
+
+Run from the repository root:
+
+    python benchmarks/bench_badge_details.py [--holders 10000] [--requests 100]
+
+The dataset from bench_store is rewritten so the first badge is awarded once
+to each of the first --holders users. Responses are fetched with the response
+cache bypassed (a fresh query string per request) so the numbers measure the
+holder lookup and serialisation, not cache hits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+def give_badge_to(target, badge, users):
+    path = os.path.join(target, 'src', 'data', 'awards.json')
+    with open(path) as f:
+        awards = [award for award in json.load(f) if award['badge_id'] != badge['id']]
+    for i, user in enumerate(users):
+        awards.append({
+            'id': str(uuid.UUID(int=i + 1)),
+            'user_id': user['id'],
+            'badge_id': badge['id'],
+            'awarded_at': f'2025-01-01T00:00:{i % 60:02d}+00:00',
+            'awarded_by': users[0]['id']
+        })
+    with open(path, 'w') as f:
+        json.dump(awards, f)
+
+
+async def timed(client, paths):
+    timings = []
+    for path in paths:
+        t0 = time.perf_counter()
+        resp = await client.get(path)
+        await resp.read()
+        assert resp.status == 200, resp.status
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings.sort()
+    print(f'{label:<28} p50 {statistics.median(timings):8.2f} ms'
+          f'   p95 {timings[int(len(timings) * 0.95) - 1]:8.2f} ms')
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, args.holders + 1, 50, args.awards)
+        give_badge_to(target, badges[0], users[:args.holders])
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            app = await main.init_app()
+            async with TestClient(TestServer(app)) as client:
+                n = args.requests
+                ids = ','.join(badge['id'] for badge in badges)
+                print(f'{args.holders} holders of one badge, {args.awards} other awards')
+                report('details, first page', await timed(
+                    client, [f'/badge-details-api/{badges[0]["id"]}?n={i}' for i in range(n)]))
+                report('details, all holders', await timed(
+                    client, [f'/badge-details-api/{badges[0]["id"]}?limit=1000&n={i}' for i in range(n // 10)]))
+                # One timing per round of len(badges) requests
+                timings = await timed(client, [f'/badge-details-api/{badge["id"]}?limit=10&n={i}'
+                                               for i in range(n // 10) for badge in badges])
+                report(f'{len(badges)} badges, one by one', [
+                    sum(timings[i:i + len(badges)]) for i in range(0, len(timings), len(badges))])
+                report(f'{len(badges)} badges, batched', await timed(
+                    client, [f'/badge-details-api?ids={ids}&limit=10&n={i}' for i in range(n // 10)]))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--holders', type=int, default=10000)
+    parser.add_argument('--awards', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
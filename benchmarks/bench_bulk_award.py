@@ -0,0 +1,86 @@
+"""Awarding one badge to N users: N single POSTs against one bulk POST.
+
+Run from the repository root:
+
+    python benchmarks/bench_bulk_award.py [--recipients 200]
+
+Both runs go through the HTTP API as the admin, against the same dataset,
+and a WebSocket client subscribed to the feed counts the messages each run
+produces. The single-award run does one journal write and one broadcast per
+award; the bulk run should do one of each in total.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+from passlib.hash import pbkdf2_sha256
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+async def drain(ws, timeout=0.5):
+    count = 0
+    try:
+        while True:
+            await asyncio.wait_for(ws.receive(), timeout)
+            count += 1
+    except asyncio.TimeoutError:
+        return count
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, args.recipients + 1, 10, args.awards,
+                                      password_hash=pbkdf2_sha256.hash('secret'))
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            # The single awards all come from one user, faster than its rate limit
+            os.environ.setdefault('BADGE_ADMISSION', 'off')
+            app = await main.init_app()
+            async with TestClient(TestServer(app)) as client:
+                resp = await client.post('/login', json={'username': 'user0', 'password': 'secret'})
+                headers = {'Authorization': f'Bearer {(await resp.json())["token"]}'}
+                recipients = [user['id'] for user in users[1:]]
+                ws = await client.ws_connect('/ws')
+                await ws.send_json({'type': 'subscribe', 'topics': ['feed']})
+                await drain(ws)
+
+                t0 = time.perf_counter()
+                for user_id in recipients:
+                    resp = await client.post('/badges/award', headers=headers,
+                                             json={'user_id': user_id, 'badge_id': badges[0]['id']})
+                    assert resp.status == 200, resp.status
+                single_ms = (time.perf_counter() - t0) * 1000
+                single_messages = await drain(ws)
+
+                t0 = time.perf_counter()
+                resp = await client.post('/badges/award/bulk', headers=headers,
+                                         json={'badge_id': badges[1]['id'], 'user_ids': recipients})
+                result = await resp.json()
+                assert resp.status == 200 and result['awarded'] == len(recipients), result
+                bulk_ms = (time.perf_counter() - t0) * 1000
+                bulk_messages = await drain(ws)
+                await ws.close()
+
+                print(f'{len(recipients)} recipients, {args.awards} existing awards')
+                print(f'{"single awards":<16} {single_ms:9.1f} ms  {single_messages:>4} ws messages')
+                print(f'{"bulk award":<16} {bulk_ms:9.1f} ms  {bulk_messages:>4} ws messages')
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=200)
+    parser.add_argument('--awards', type=int, default=50000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""Parse and dump throughput of the JSON codec on a 100k-award file.
+
+Run from the repository root:
+
+    python benchmarks/bench_codec.py [--awards 100000] [--rounds 5]
+
+Times the awards snapshot written the way JsonStorage writes it (compact,
+and indented as with BADGE_PRETTY_JSON=1) and read back, once with the
+standard library and once with orjson if it is installed. Each figure is
+the best of --rounds runs.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from bench_store import build_dataset
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_dumps(obj, pretty):
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(obj, pretty):
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+
+def best_ms(fn, rounds):
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - t0) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        build_dataset(target, 1000, 50, args.awards)
+        with open(os.path.join(target, 'src', 'data', 'awards.json'), 'rb') as f:
+            awards = json.loads(f.read())
+
+    backends = [('json', stdlib_dumps, json.loads)]
+    if orjson is not None:
+        backends.append(('orjson', orjson_dumps, orjson.loads))
+    else:
+        print('orjson is not installed; timing the standard library only')
+
+    print(f'{len(awards)} awards')
+    for name, dumps, loads in backends:
+        for pretty in (False, True):
+            body = dumps(awards, pretty)
+            dump_ms = best_ms(lambda: dumps(awards, pretty), args.rounds)
+            parse_ms = best_ms(lambda: loads(body), args.rounds)
+            mb = len(body) / 1e6
+            label = f'{name}, {"indented" if pretty else "compact"}'
+            print(f'{label:<18} {mb:6.1f} MB   dump {dump_ms:7.1f} ms ({mb / dump_ms * 1000:6.0f} MB/s)'
+                  f'   parse {parse_ms:7.1f} ms ({mb / parse_ms * 1000:6.0f} MB/s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--awards', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=5)
+    run(parser.parse_args())
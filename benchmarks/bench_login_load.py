@@ -0,0 +1,104 @@
+"""p99 latency of GET /badges while 50 logins run concurrently.
+
+Run from the repository root:
+
+    python benchmarks/bench_login_load.py [--logins 50] [--admission]
+
+Every generated user gets the same real pbkdf2 hash, so each login does a
+full verification. /badges is polled back to back for as long as the logins
+are in flight; with hashing on the event loop those polls queue behind every
+verification, with hashing on the process pool they should not.
+
+Admission limits are off unless --admission is given. With them on, a storm
+such as --logins 2000 should mostly get 429s, and /badges latency should
+stay close to idle.
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+import sys
+import tempfile
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+from passlib.hash import pbkdf2_sha256
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+def report(label, timings):
+    print(f'{label:<28} n={len(timings):<5} p50 {percentile(timings, 50):8.2f} ms  '
+          f'p99 {percentile(timings, 99):8.2f} ms  max {max(timings):8.2f} ms')
+
+
+async def poll(client, path, stop):
+    timings = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        resp = await client.get(path)
+        await resp.read()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+async def login(client, username):
+    resp = await client.post('/login', json={'username': username, 'password': 'secret'})
+    await resp.read()
+    return resp.status
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, _ = build_dataset(target, args.users, 50, args.awards,
+                                 password_hash=pbkdf2_sha256.hash('secret'))
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            if not args.admission:
+                os.environ.setdefault('BADGE_ADMISSION', 'off')
+            app = await main.init_app()
+            async with TestClient(TestServer(app)) as client:
+                # Warm up, including any worker processes
+                await login(client, users[1]['username'])
+
+                idle = []
+                for _ in range(200):
+                    t0 = time.perf_counter()
+                    resp = await client.get('/badges')
+                    await resp.read()
+                    idle.append((time.perf_counter() - t0) * 1000)
+                report('/badges idle', idle)
+
+                stop = asyncio.Event()
+                poller = asyncio.create_task(poll(client, '/badges', stop))
+                t0 = time.perf_counter()
+                statuses = await asyncio.gather(*(
+                    login(client, users[i % len(users)]['username']) for i in range(args.logins)
+                ))
+                elapsed = time.perf_counter() - t0
+                stop.set()
+                report(f'/badges during {args.logins} logins', await poller)
+                print(f'{args.logins} logins finished in {elapsed:.2f} s, '
+                      f'statuses {dict(sorted(Counter(statuses).items()))}')
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--awards', type=int, default=5000)
+    parser.add_argument('--admission', action='store_true', help='apply the default admission limits')
+    asyncio.run(run(parser.parse_args()))
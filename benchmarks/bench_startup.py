@@ -0,0 +1,76 @@
+"""Startup time and resident memory against the length of award history.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py [--months 6 24 48] [--per-month 10000]
+
+For each history length, generates --per-month awards for every month up to
+now, then times DataManager.load() and measures the memory it allocates
+(tracemalloc). The first load also seals past months into segments, so the
+second, steady-state load is the one to compare across history lengths.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+def spread_over(target, months):
+    # Spread the generated awards evenly over the last `months` months
+    path = os.path.join(target, 'src', 'data', 'awards.json')
+    with open(path) as f:
+        awards = json.load(f)
+    now = datetime.now(timezone.utc)
+    span = timedelta(days=months * 30.4)
+    for i, award in enumerate(awards):
+        award['awarded_at'] = (now - span + span * i / len(awards)).isoformat()
+    with open(path, 'w') as f:
+        json.dump(awards, f)
+
+
+async def timed_load():
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    data_manager = main.DataManager(main.create_storage('src/data'), None)
+    await data_manager.load()
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    resident_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    await data_manager.close()
+    return elapsed_ms, resident_mb
+
+
+async def run(args):
+    print(f'{"months":>6} {"awards":>8}   {"first load":>10}   {"load":>9}   {"resident":>9}')
+    for months in args.months:
+        with tempfile.TemporaryDirectory() as target:
+            build_dataset(target, 2000, 50, months * args.per_month)
+            spread_over(target, months)
+            cwd = os.getcwd()
+            os.chdir(target)
+            try:
+                first_ms, _ = await timed_load()
+                load_ms, resident_mb = await timed_load()
+            finally:
+                os.chdir(cwd)
+            print(f'{months:>6} {months * args.per_month:>8}   {first_ms:7.0f} ms   {load_ms:6.0f} ms'
+                  f'   {resident_mb:6.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--months', type=int, nargs='+', default=[6, 24, 48])
+    parser.add_argument('--per-month', type=int, default=10000)
+    asyncio.run(run(parser.parse_args()))
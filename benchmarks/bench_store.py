@@ -0,0 +1,119 @@
+"""Request latency of the read endpoints against a 50k-award dataset.
+
+Run from the repository root:
+
+    python benchmarks/bench_store.py [--awards 50000] [--requests 200]
+
+The app resolves its data, template and static paths relative to the working
+directory, so the benchmark builds a scratch tree (generated data plus links to
+the real templates and static files) and runs the app from there. That keeps
+the script usable against older revisions of main.py for before/after numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+import main  # noqa: E402
+
+
+def build_dataset(target, n_users, n_badges, n_awards, seed=1, password_hash='x'):
+    rng = random.Random(seed)
+    users = [{
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'username': f'user{i}',
+        # Only verified by benchmarks that log in and pass a real hash
+        'password': password_hash,
+        'email': f'user{i}@example.com',
+        'display_name': f'User {i}',
+        'role': 'admin' if i == 0 else 'user'
+    } for i in range(n_users)]
+    badges = [{
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'name': f'Badge {i}',
+        'description': f'Description of badge {i}',
+        'icon': 'chip.svg'
+    } for i in range(n_badges)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    awards = []
+    for i in range(n_awards):
+        giver, receiver = rng.sample(users, 2)
+        awards.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'user_id': receiver['id'],
+            # Skew towards the first few badges, as real award data is
+            'badge_id': badges[min(int(rng.expovariate(0.15)), n_badges - 1)]['id'],
+            'awarded_at': (start + timedelta(seconds=i * 60)).isoformat(),
+            'awarded_by': giver['id']
+        })
+
+    data_dir = os.path.join(target, 'src', 'data')
+    os.makedirs(data_dir)
+    for name, rows in (('users', users), ('badges', badges), ('awards', awards)):
+        with open(os.path.join(data_dir, f'{name}.json'), 'w') as f:
+            json.dump(rows, f)
+    for name in ('static', 'templates'):
+        os.symlink(os.path.join(ROOT, 'src', name), os.path.join(target, 'src', name))
+    return users, badges
+
+
+async def measure(client, path, n):
+    timings = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        resp = await client.get(path)
+        await resp.read()
+        timings.append((time.perf_counter() - t0) * 1000)
+        assert resp.status == 200, (path, resp.status)
+    timings.sort()
+    return {
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, args.users, args.badges, args.awards)
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            app = await main.init_app()
+            async with TestClient(TestServer(app)) as client:
+                paths = [
+                    '/badges',
+                    '/users',
+                    '/activity-feed',
+                    f'/users/{users[1]["id"]}/badges',
+                    f'/badge-details-api/{badges[0]["id"]}',
+                ]
+                print(f'{args.users} users, {args.badges} badges, {args.awards} awards, '
+                      f'{args.requests} requests per route')
+                for path in paths:
+                    result = await measure(client, path, args.requests)
+                    print(f'{path:<60} mean {result["mean_ms"]:8.2f} ms  '
+                          f'p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms')
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--badges', type=int, default=50)
+    parser.add_argument('--awards', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,115 @@
+"""Broadcast latency of award events to 5,000 connected /ws clients.
+
+Run from the repository root:
+
+    python benchmarks/bench_ws_fanout.py [--clients 5000] [--events 20]
+
+Each client subscribes to the 'feed' topic. Each event is a real
+POST /badges/award; latency runs from sending the POST to each socket
+receiving the badge_awarded message. Clients and server share
+one process, so the open-file limit must allow two descriptors per client.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+from passlib.hash import pbkdf2_sha256
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+async def listen(ws, received, expected, subscribed):
+    # Record when each award (by award_id) reached this client
+    async for msg in ws:
+        data = json.loads(msg.data)
+        if data.get('type') == 'subscriptions':
+            subscribed.release()
+        elif data.get('type') == 'badge_awarded':
+            received.setdefault(data['badge']['award_id'], []).append(time.perf_counter())
+            if len(received[data['badge']['award_id']]) == expected:
+                received['_done'].set()
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, 100, 10, 1000,
+                                      password_hash=pbkdf2_sha256.hash('secret'))
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            app = await main.init_app()
+            server = TestServer(app)
+            await server.start_server()
+            connector = aiohttp.TCPConnector(limit=0)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                resp = await session.post(server.make_url('/login'), json={
+                    'username': users[0]['username'], 'password': 'secret'})
+                token = (await resp.json())['token']
+
+                t0 = time.perf_counter()
+                sockets = []
+                for start in range(0, args.clients, 500):
+                    sockets.extend(await asyncio.gather(*(
+                        session.ws_connect(server.make_url('/ws'))
+                        for _ in range(start, min(start + 500, args.clients))
+                    )))
+                print(f'Connected {len(sockets)} clients in {time.perf_counter() - t0:.1f} s')
+
+                received = {}
+                subscribed = asyncio.Semaphore(0)
+                listeners = [asyncio.create_task(listen(ws, received, len(sockets), subscribed))
+                             for ws in sockets]
+                await asyncio.gather(*(ws.send_json({'type': 'subscribe', 'topics': ['feed']})
+                                       for ws in sockets))
+                for _ in sockets:
+                    await subscribed.acquire()
+                per_client = []
+                complete = []
+                for i in range(args.events):
+                    received['_done'] = asyncio.Event()
+                    sent = time.perf_counter()
+                    resp = await session.post(server.make_url('/badges/award'), json={
+                        'user_id': users[1 + i % (len(users) - 1)]['id'],
+                        'badge_id': badges[0]['id'],
+                    }, headers={'Authorization': f'Bearer {token}'})
+                    award_id = (await resp.json())['award']['id']
+                    await asyncio.wait_for(received['_done'].wait(), 60)
+                    arrivals = [(t - sent) * 1000 for t in received.pop(award_id)]
+                    per_client.extend(arrivals)
+                    complete.append(max(arrivals))
+
+                print(f'{args.events} events to {len(sockets)} clients')
+                print(f'per client     p50 {percentile(per_client, 50):8.2f} ms  '
+                      f'p99 {percentile(per_client, 99):8.2f} ms')
+                print(f'whole fan-out  p50 {percentile(complete, 50):8.2f} ms  '
+                      f'max {max(complete):8.2f} ms')
+
+                for task in listeners:
+                    task.cancel()
+                await asyncio.gather(*(ws.close() for ws in sockets))
+            await server.close()
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
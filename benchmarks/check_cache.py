@@ -0,0 +1,121 @@
+"""Check that writes only invalidate the cached responses they change.
+
+Run from the repository root:
+
+    python benchmarks/check_cache.py
+
+Warms the response cache for a few users' badge lists and badges' details,
+then makes one write at a time and reads them all again. Each read is
+counted as a hit or a miss from /admin/cache-stats. Entries the write
+changed must miss and show the change; the rest must still hit.
+
+Exits non-zero on the first failed check.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+from passlib.hash import pbkdf2_sha256
+
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import main  # noqa: E402
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f'FAILED: {message}')
+    print(f'ok  {message}')
+
+
+class Reader:
+    def __init__(self, client, headers):
+        self.client = client
+        self.headers = headers
+
+    async def hits(self):
+        resp = await self.client.get('/admin/cache-stats', headers=self.headers)
+        return (await resp.json())['hits']
+
+    async def get(self, path):
+        # Returns (served from the cache, body)
+        before = await self.hits()
+        resp = await self.client.get(path)
+        assert resp.status == 200, (path, resp.status)
+        body = await resp.json()
+        return await self.hits() > before, body
+
+    async def expect(self, paths, hit, after):
+        for path in paths:
+            was_hit, _ = await self.get(path)
+            check(was_hit == hit, f'{path} {"still cached" if hit else "rebuilt"} after {after}')
+
+
+async def run():
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, 10, 4, 0, password_hash=pbkdf2_sha256.hash('secret'))
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            os.environ.setdefault('BADGE_ADMISSION', 'off')
+            app = await main.init_app()
+            async with TestClient(TestServer(app)) as client:
+                resp = await client.post('/login', json={'username': users[0]['username'], 'password': 'secret'})
+                headers = {'Authorization': f'Bearer {(await resp.json())["token"]}'}
+                reader = Reader(client, headers)
+
+                async def award(user, badge):
+                    resp = await client.post('/badges/award', headers=headers,
+                                             json={'user_id': user['id'], 'badge_id': badge['id']})
+                    check(resp.status == 200, f'awarded {badge["name"]} to {user["username"]}')
+
+                await award(users[1], badges[0])
+                await award(users[2], badges[1])
+
+                user_list = {i: f'/users/{users[i]["id"]}/badges' for i in (1, 2, 3)}
+                details = {i: f'/badge-details-api/{badges[i]["id"]}' for i in (0, 1)}
+                batch = f'/badge-details-api?ids={badges[1]["id"]},{badges[2]["id"]}'
+                every = [*user_list.values(), *details.values(), batch]
+                for path in every:
+                    await reader.get(path)
+                await reader.expect(every, True, 'warming up')
+
+                # An award changes the recipient's list, the badge's details
+                # and the holder counts in the lists of the badge's holders
+                await award(users[3], badges[0])
+                _, page = await reader.get(user_list[3])
+                check([item['id'] for item in page['items']] == [badges[0]['id']], 'new award in the recipient\'s list')
+                _, page = await reader.get(details[0])
+                check(page['unique_user_count'] == 2, 'new holder in the badge details')
+                await reader.expect([user_list[1]], False, 'an award to another holder of its badge')
+                await reader.expect([user_list[2], details[1], batch], True, 'an award of another badge')
+
+                resp = await client.put(f'/badges/{badges[1]["id"]}', headers=headers,
+                                        json={'name': 'Renamed badge'})
+                check(resp.status == 200, 'renamed a badge')
+                _, page = await reader.get(user_list[2])
+                check(page['items'][0]['name'] == 'Renamed badge', 'new name in its holder\'s list')
+                await reader.expect([details[1], batch], False, 'a change to the badge')
+                await reader.expect([user_list[1], user_list[3], details[0]], True, 'a change to another badge')
+
+                resp = await client.post('/register', json={'username': 'newcomer', 'password': 'secret'})
+                check(resp.status == 200, 'registered a user')
+                await reader.expect(every, True, 'a registration')
+
+                resp = await client.post('/badges/remove', headers=headers,
+                                         json={'user_id': users[1]['id'], 'badge_id': badges[0]['id']})
+                check(resp.status == 200, 'revoked an award')
+                await reader.expect([user_list[1], user_list[3], details[0]], False, 'a revoke of its badge')
+                await reader.expect([user_list[2], details[1], batch], True, 'a revoke of another badge')
+                print('All checks passed')
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
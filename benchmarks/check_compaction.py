@@ -0,0 +1,91 @@
+"""Check that a failed journal compaction loses no events.
+
+Run from the repository root:
+
+    python benchmarks/check_compaction.py [--failures 2] [--records 300]
+
+Writes users through JsonStorage with a small compaction threshold, makes
+the first --failures snapshot writes fail, and keeps writing until a
+compaction succeeds. Then it stops the storage without a final compaction
+and loads the data directory again, expecting every record written. Runs
+once where the data stops straight after the failures, with the events only
+in the journals, and once where a later compaction folds them in.
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from storage import JsonStorage  # noqa: E402
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f'FAILED: {message}')
+    print(f'ok  {message}')
+
+
+class FailingStorage(JsonStorage):
+    # Fails the first `failures` snapshot writes of the users collection
+    def __init__(self, data_dir, failures, **kwargs):
+        super().__init__(data_dir, **kwargs)
+        self.failures = failures
+
+    async def write_json(self, file_path, data):
+        if file_path == self.files['users'] and self.failures:
+            self.failures -= 1
+            raise OSError('simulated snapshot write failure')
+        return await super().write_json(file_path, data)
+
+
+async def write_users(storage, start, count):
+    users = storage.collections['users']
+    for i in range(start, start + count):
+        user = {'id': f'user-{i}', 'username': f'user{i}', 'padding': 'x' * 200}
+        users[user['id']] = user
+        await storage.put('users', user)
+        # Let a compaction started by this write run before the next one
+        while storage.compactions:
+            await asyncio.gather(*storage.compactions.values())
+
+
+async def run_case(args, label, settle):
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = FailingStorage(data_dir, args.failures, compact_threshold=4096, commit_window=0)
+        await storage.load()
+        journal = storage.journals['users']
+        written = 0
+        while storage.failures:
+            await write_users(storage, written, 10)
+            written += 10
+        check(os.path.exists(journal.rotated_path), f'{label}: {args.failures} compactions failed')
+        if settle:
+            await write_users(storage, written, args.records)
+            written += args.records
+            check(not os.path.exists(journal.rotated_path), f'{label}: a later compaction folded them in')
+        await storage.close()
+
+        reloaded = JsonStorage(data_dir)
+        users = (await reloaded.load())['users']
+        await reloaded.close()
+        missing = [f'user-{i}' for i in range(written) if f'user-{i}' not in users]
+        check(not missing, f'{label}: all {written} users present after a restart')
+
+
+async def run(args):
+    await run_case(args, 'stopped after the failures', settle=False)
+    await run_case(args, 'compacted later', settle=True)
+    print('All checks passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--failures', type=int, default=2)
+    parser.add_argument('--records', type=int, default=300)
+    asyncio.run(run(parser.parse_args()))
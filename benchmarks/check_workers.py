@@ -0,0 +1,162 @@
+"""Integration check of --workers mode: four workers on one machine.
+
+Run from the repository root, with port 8080 free:
+
+    python benchmarks/check_workers.py [--workers 4] [--clients 32] [--awards 20]
+
+Starts `main.py --workers N` on a generated dataset whose history spans
+sealed months, then, with every request on a fresh connection so that
+SO_REUSEPORT spreads them over the workers:
+
+- awards badges and checks that every /ws client, whichever worker it is
+  connected to, receives each badge_awarded event with the same sequence;
+- reads the feed straight after each award and expects the award on top;
+- pages the whole feed back through the sealed months;
+- revokes an award and checks the badge's details are the same everywhere;
+- stops the server with SIGTERM and expects every process to exit.
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from passlib.hash import pbkdf2_sha256
+
+from bench_startup import spread_over
+from bench_store import build_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE = 'http://127.0.0.1:8080'
+
+
+async def request(method, path, token=None, **kwargs):
+    # A session per request, so each one opens a new connection
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, BASE + path, headers=headers, **kwargs) as resp:
+            return resp.status, await resp.json()
+
+
+async def wait_until_serving(process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'Server exited with {process.returncode} during startup')
+        try:
+            status, _ = await request('GET', '/activity-feed')
+            if status == 200:
+                return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    sys.exit('Server did not start serving')
+
+
+async def listen(ws, received):
+    async for msg in ws:
+        data = json.loads(msg.data)
+        if data.get('type') == 'badge_awarded':
+            received.append((data['seq'], data['badge']['award_id']))
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit(f'FAILED: {message}')
+    print(f'ok  {message}')
+
+
+async def run_checks(args, users, badges, history):
+    status, body = await request('POST', '/login', json={'username': users[0]['username'], 'password': 'secret'})
+    check(status == 200, 'logged in')
+    token = body['token']
+
+    sessions = [aiohttp.ClientSession() for _ in range(args.clients)]
+    try:
+        sockets = [await session.ws_connect(BASE + '/ws') for session in sessions]
+        for ws in sockets:
+            await ws.send_json({'type': 'subscribe', 'topics': ['feed']})
+            await ws.receive()
+        received = [[] for _ in sockets]
+        listeners = [asyncio.create_task(listen(ws, got)) for ws, got in zip(sockets, received)]
+
+        awarded = []
+        for i in range(args.awards):
+            status, body = await request('POST', '/badges/award', token, json={
+                'user_id': users[1 + i % (len(users) - 1)]['id'], 'badge_id': badges[i % len(badges)]['id']})
+            check(status == 200 and body['success'], f'award {i + 1} accepted')
+            awarded.append(body['award']['id'])
+            status, feed = await request('GET', '/activity-feed?limit=1')
+            check(feed[0]['award_id'] == awarded[-1], f'award {i + 1} on top of the feed straight away')
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and any(len(got) < len(awarded) for got in received):
+            await asyncio.sleep(0.05)
+        check(all([award_id for _, award_id in got] == awarded for got in received),
+              f'all {len(sockets)} sockets received the {len(awarded)} awards in order')
+        check(len({tuple(got) for got in received}) == 1, 'event sequence numbers agree across workers')
+        for task in listeners:
+            task.cancel()
+        for ws in sockets:
+            await ws.close()
+    finally:
+        for session in sessions:
+            await session.close()
+
+    seen, before = 0, None
+    while True:
+        status, page = await request('GET', '/activity-feed?limit=100' + (f'&before={before}' if before else ''))
+        if not page:
+            break
+        seen += len(page)
+        before = page[-1]['cursor']
+    check(seen == history + len(awarded), f'feed pages back through all {seen} awards')
+
+    badge_id = badges[0]['id']
+    status, details = await request('GET', f'/badge-details-api/{badge_id}')
+    holders = details['unique_user_count']
+    status, body = await request('POST', '/badges/remove', token, json={'user_id': users[1]['id'], 'badge_id': badge_id})
+    check(status == 200 and body['success'], 'revoke accepted')
+    seen_details = set()
+    for _ in range(args.clients):
+        status, details = await request('GET', f'/badge-details-api/{badge_id}?limit=100')
+        seen_details.add(json.dumps(details, sort_keys=True))
+    check(len(seen_details) == 1, 'badge details agree across workers')
+    check(json.loads(seen_details.pop())['unique_user_count'] == holders - 1, 'holder count updated')
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as target:
+        users, badges = build_dataset(target, 50, 5, 3000, password_hash=pbkdf2_sha256.hash('secret'))
+        spread_over(target, 6)
+        env = dict(os.environ, BADGE_WRITER_SOCKET=os.path.join(target, 'writer.sock'))
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'src', 'main.py'),
+                                    '--workers', str(args.workers)], cwd=target, env=env)
+        try:
+            await wait_until_serving(process)
+            await run_checks(args, users, badges, 3000)
+        finally:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                sys.exit('FAILED: server did not stop on SIGTERM')
+        check(process.returncode == 0, 'server stopped cleanly')
+        print('All checks passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--awards', type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
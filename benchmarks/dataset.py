@@ -0,0 +1,144 @@
+"""Synthetic users, badges and awards at configurable scale.
+
+Run from the repository root:
+
+    python benchmarks/dataset.py --scale 10k --out /tmp/badges
+    python benchmarks/dataset.py --users 50000 --awards 2000000 --out /tmp/badges
+
+Writes a tree the app can run from (`src/data`, a copy of the static files
+and a link to the templates): `cd /tmp/badges && python <repo>/src/main.py`.
+Every generated password is 'secret' unless --password-hash says otherwise.
+
+The data is skewed the way real award data is:
+
+- badge popularity follows a Zipf law, so a few badges make up most awards;
+- a minority of users receive most awards, and most users receive a few;
+- awards are given by a small pool of awarders (admins and leads);
+- awards span --months months up to now, getting more frequent over time.
+
+Awards are streamed to disk, so millions of them need little memory.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# users, badges, awards
+SCALES = {
+    '1k': (1000, 50, 20000),
+    '10k': (10000, 200, 200000),
+    '100k': (100000, 1000, 2000000),
+}
+
+
+def zipf_weights(n, exponent):
+    # Cumulative weights of ranks 1..n under a Zipf law, for random.choices
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def generate(target, n_users=1000, n_badges=50, n_awards=20000, months=12, seed=1,
+             password_hash='x', now=None):
+    # Returns (users, badges); the awards are only written to disk
+    rng = random.Random(seed)
+    new_id = lambda: str(uuid.UUID(int=rng.getrandbits(128)))  # noqa: E731
+    users = [{
+        'id': new_id(),
+        'username': f'user{i}',
+        'password': password_hash,
+        'email': f'user{i}@example.com',
+        'display_name': f'User {i}',
+        # One admin per thousand users, at least one
+        'role': 'admin' if i % 1000 == 0 else 'user'
+    } for i in range(n_users)]
+    badges = [{
+        'id': new_id(),
+        'name': f'Badge {i}',
+        'description': f'Description of badge {i}',
+        'icon': rng.choice(['chip.svg', 'star.svg'])
+    } for i in range(n_badges)]
+
+    # Popularity ranks are shuffled so user0 and Badge 0 are not special
+    receivers = rng.sample(users, len(users))
+    receiver_weights = zipf_weights(len(receivers), 0.8)
+    badge_ranks = rng.sample(badges, len(badges))
+    badge_weights = zipf_weights(len(badge_ranks), 1.1)
+    awarders = [user for user in users if user['role'] == 'admin']
+    awarders += rng.sample(users, max(len(users) // 50, 1))
+    awarder_weights = zipf_weights(len(awarders), 1.0)
+
+    end = now or datetime.now(timezone.utc)
+    span = timedelta(days=months * 30.4)
+    start = end - span
+
+    data_dir = os.path.join(target, 'src', 'data')
+    os.makedirs(data_dir)
+    for name, rows in (('users', users), ('badges', badges)):
+        with open(os.path.join(data_dir, f'{name}.json'), 'w') as f:
+            json.dump(rows, f)
+    with open(os.path.join(data_dir, 'awards.json'), 'w') as f:
+        f.write('[')
+        chunk = 10000
+        for offset in range(0, n_awards, chunk):
+            size = min(chunk, n_awards - offset)
+            batch = zip(rng.choices(receivers, cum_weights=receiver_weights, k=size),
+                        rng.choices(badge_ranks, cum_weights=badge_weights, k=size),
+                        rng.choices(awarders, cum_weights=awarder_weights, k=size))
+            rows = []
+            for i, (receiver, badge, awarder) in enumerate(batch, offset):
+                # In order, with the award rate rising steadily to twice
+                # its starting rate (inverse of the ramp's cumulative share)
+                awarded_at = start + span * (math.sqrt(1 + 3 * (i + 0.5) / n_awards) - 1)
+                rows.append(json.dumps({
+                    'id': new_id(),
+                    'user_id': receiver['id'],
+                    'badge_id': badge['id'],
+                    'awarded_at': awarded_at.isoformat(),
+                    'awarded_by': awarder['id']
+                }))
+            f.write((',' if offset else '') + ','.join(rows))
+        f.write(']')
+
+    # static is copied, so uploaded badge images stay out of the repository
+    shutil.copytree(os.path.join(ROOT, 'src', 'static'), os.path.join(target, 'src', 'static'))
+    os.symlink(os.path.join(ROOT, 'src', 'templates'), os.path.join(target, 'src', 'templates'))
+    return users, badges
+
+
+def scale_args(parser):
+    # Dataset size options shared with the benchmark runner
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k',
+                        help='preset sizes: ' + ', '.join(f'{name} = {u} users, {b} badges, {a} awards'
+                                                          for name, (u, b, a) in SCALES.items()))
+    parser.add_argument('--users', type=int, help='override the preset number of users')
+    parser.add_argument('--badges', type=int, help='override the preset number of badges')
+    parser.add_argument('--awards', type=int, help='override the preset number of awards')
+    parser.add_argument('--months', type=int, default=12, help='months of award history')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def scale_of(args):
+    users, badges, awards = SCALES[args.scale]
+    return args.users or users, args.badges or badges, args.awards or awards
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    scale_args(parser)
+    parser.add_argument('--out', required=True, help='directory to create')
+    parser.add_argument('--password-hash', help="stored password hash (default: pbkdf2 of 'secret')")
+    args = parser.parse_args()
+    password_hash = args.password_hash
+    if password_hash is None:
+        from passlib.hash import pbkdf2_sha256
+        password_hash = pbkdf2_sha256.hash('secret')
+    n_users, n_badges, n_awards = scale_of(args)
+    generate(args.out, n_users, n_badges, n_awards, args.months, args.seed, password_hash)
+    print(f'Wrote {n_users} users, {n_badges} badges and {n_awards} awards over {args.months} months '
+          f'to {os.path.join(args.out, "src", "data")}')
@@ -0,0 +1,382 @@
+"""Throughput and latency of every route, plus /ws fan-out, on generated data.
+
+Run from the repository root:
+
+    python benchmarks/run_suite.py [--scale 10k] [--requests 200] [--concurrency 8]
+                                   [--only awards] [--json results.json] [--compare baseline.json]
+
+Generates a dataset with benchmarks/dataset.py (same --scale, --users,
+--badges, --awards and --months options), starts the app on it through
+aiohttp's test client, and drives each route in init_app with --requests
+requests from --concurrency concurrent callers. Password routes (login,
+register, reset-password) get a tenth as many requests, since each one is
+a pbkdf2 hash. Reads carry a unique query parameter, so they measure the
+handler rather than the response cache; /activity-feed (cached) measures
+a cache hit. Then --ws-clients sockets subscribed to the feed each receive
+--ws-events awards.
+
+Each scenario reports requests per second and p50/p95/p99 latency in ms.
+Routes of the app that no scenario covers are listed, so the suite keeps up
+with new routes. --json writes the results with the commit they were taken
+at; --compare prints the change against such a file from another commit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+from passlib.hash import pbkdf2_sha256
+
+from dataset import generate, scale_args, scale_of
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import codec  # noqa: E402
+import main  # noqa: E402
+
+# One-pixel PNG, made unique per upload by trailing bytes
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+def percentile(timings, pct):
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+def summarize(timings, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': round(len(timings) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+    }
+
+
+class Suite:
+    # Scenario state: ids of the generated data and of records the write
+    # scenarios create, so later scenarios (update, delete, revoke) have
+    # something to act on
+    def __init__(self, client, users, badges, token):
+        self.client = client
+        self.users = users
+        self.badges = badges
+        self.auth = {'Authorization': f'Bearer {token}'}
+        self.admin_id = users[0]['id']
+        self.receivers = [user for user in users if user['role'] != 'admin']
+        self.cursors = []  # activity feed cursors, to page from
+        self.registered = []  # user ids created by /register
+        self.created_badges = []  # badge ids created by POST /badges
+        self.awarded = []  # (user_id, badge_id) pairs awarded
+        self.epoch = None
+        self.seq = 0
+
+    def user(self, i):
+        return self.receivers[i * 7919 % len(self.receivers)]['id']
+
+    def badge(self, i):
+        return self.badges[i * 31 % len(self.badges)]['id']
+
+    async def prepare(self):
+        resp = await self.client.get('/activity-feed?limit=100')
+        self.cursors = [item['cursor'] for item in await resp.json()]
+        resp = await self.client.get('/events')
+        body = await resp.json()
+        self.epoch, self.seq = body['epoch'], body['seq']
+
+    def scenarios(self):
+        # (name, route, weight, request factory). The route is the method and
+        # resource as registered, for the coverage report. Factories return
+        # (method, path, request kwargs) for the i-th request
+        get = lambda path, **kwargs: ('GET', path, kwargs)  # noqa: E731
+        admin = self.auth
+        return [
+            ('page /', 'GET /', 1, lambda i: get(f'/?_={i}')),
+            ('page /badge-management', 'GET /badge-management', 1, lambda i: get(f'/badge-management?_={i}')),
+            ('page /user-management', 'GET /user-management', 1, lambda i: get(f'/user-management?_={i}')),
+            ('page /badge-details/{id}', 'GET /badge-details/{badge_id}', 1,
+             lambda i: get(f'/badge-details/{self.badge(i)}')),
+            ('static asset', 'GET /static/{path}', 1, lambda i: get(f'/static/images/chip.svg?_={i}')),
+            ('/users', 'GET /users', 1, lambda i: get(f'/users?limit=100&_={i}')),
+            ('/admin/users', 'GET /admin/users', 1, lambda i: get(f'/admin/users?limit=100&_={i}', headers=admin)),
+            ('/users/{id}/badges', 'GET /users/{user_id}/badges', 1,
+             lambda i: get(f'/users/{self.user(i)}/badges?_={i}')),
+            ('/badges', 'GET /badges', 1, lambda i: get(f'/badges?limit=100&_={i}')),
+            ('/badge-details-api/{id}', 'GET /badge-details-api/{badge_id}', 1,
+             lambda i: get(f'/badge-details-api/{self.badge(i)}?_={i}')),
+            ('/badge-details-api?ids= (10)', 'GET /badge-details-api', 1,
+             lambda i: get(f'/badge-details-api?ids={",".join(self.badge(i + k) for k in range(10))}&_={i}')),
+            ('/activity-feed', 'GET /activity-feed', 1, lambda i: get(f'/activity-feed?_={i}')),
+            ('/activity-feed (cached)', 'GET /activity-feed', 1, lambda i: get('/activity-feed')),
+            ('/activity-feed?before=', 'GET /activity-feed', 1,
+             lambda i: get(f'/activity-feed?before={self.cursors[i % len(self.cursors)]}&_={i}')),
+            ('/search', 'GET /search', 1, lambda i: get(f'/search?q=user{i % 97}&_={i}')),
+            ('/events?since=', 'GET /events', 1, lambda i: get(f'/events?since={self.seq}&epoch={self.epoch}&_={i}')),
+            ('/admin/storage-stats', 'GET /admin/storage-stats', 1,
+             lambda i: get(f'/admin/storage-stats?_={i}', headers=admin)),
+            ('/admin/hasher-stats', 'GET /admin/hasher-stats', 1,
+             lambda i: get(f'/admin/hasher-stats?_={i}', headers=admin)),
+            ('/admin/cache-stats', 'GET /admin/cache-stats', 1,
+             lambda i: get(f'/admin/cache-stats?_={i}', headers=admin)),
+            ('/admin/ws-stats', 'GET /admin/ws-stats', 1, lambda i: get(f'/admin/ws-stats?_={i}', headers=admin)),
+            ('/admin/admission-stats', 'GET /admin/admission-stats', 1,
+             lambda i: get(f'/admin/admission-stats?_={i}', headers=admin)),
+            ('/admin/slow-requests', 'GET /admin/slow-requests', 1,
+             lambda i: get(f'/admin/slow-requests?_={i}', headers=admin)),
+            ('/metrics', 'GET /metrics', 1, lambda i: get(f'/metrics?_={i}')),
+            ('/admin/consistency-check', 'GET /admin/consistency-check', 0.1,
+             lambda i: get(f'/admin/consistency-check?_={i}', headers=admin)),
+            ('POST /login', 'POST /login', 0.1,
+             lambda i: ('POST', '/login', {'json': {'username': self.users[0]['username'], 'password': 'secret'}})),
+            ('POST /auth/refresh', 'POST /auth/refresh', 1, lambda i: ('POST', '/auth/refresh', {'headers': admin})),
+            ('POST /register', 'POST /register', 0.1, self.register),
+            ('POST /admin/users/{id}/reset-password', 'POST /admin/users/{user_id}/reset-password', 0.1,
+             lambda i: ('POST', f'/admin/users/{self.user(i)}/reset-password',
+                        {'headers': admin, 'json': {'password': 'secret'}})),
+            ('POST /upload/badge-image', 'POST /upload/badge-image', 1, self.upload),
+            ('POST /badges', 'POST /badges', 1, self.create_badge),
+            ('PUT /badges/{id}', 'PUT /badges/{badge_id}', 1,
+             lambda i: ('PUT', f'/badges/{self.created_badges[i % len(self.created_badges)]}',
+                        {'headers': admin, 'json': {'description': f'Updated {i}'}})),
+            ('POST /badges/award', 'POST /badges/award', 1, self.award),
+            ('POST /badges/award/bulk (10)', 'POST /badges/award/bulk', 1,
+             lambda i: ('POST', '/badges/award/bulk', {'headers': admin, 'json': {
+                 'items': [{'user_id': self.user(i * 10 + k), 'badge_id': self.badge(i)} for k in range(10)]}})),
+            ('POST /badges/remove/bulk (10)', 'POST /badges/remove/bulk', 1,
+             lambda i: ('POST', '/badges/remove/bulk', {'headers': admin, 'json': {
+                 'items': [{'user_id': self.user(i * 10 + k), 'badge_id': self.badge(i)} for k in range(10)]}})),
+            ('POST /badges/remove', 'POST /badges/remove', 1, self.remove),
+            ('DELETE /badges/{id}', 'DELETE /badges/{badge_id}', 1, self.delete_badge),
+            ('DELETE /admin/users/{id}', 'DELETE /admin/users/{user_id}', 0.1, self.delete_user),
+        ]
+
+    def register(self, i):
+        return 'POST', '/register', {'json': {'username': f'bench-{time.time_ns()}-{i}', 'password': 'secret'}}
+
+    def upload(self, i):
+        form = aiohttp.FormData()
+        form.add_field('image', PNG + i.to_bytes(4, 'big'), filename='badge.png', content_type='image/png')
+        return 'POST', '/upload/badge-image', {'data': form}
+
+    def create_badge(self, i):
+        return 'POST', '/badges', {'headers': self.auth, 'json': {
+            'name': f'Bench badge {i}', 'description': 'Created by the benchmark', 'icon': 'chip.svg'}}
+
+    def award(self, i):
+        pair = (self.user(i), self.badge(i))
+        self.awarded.append(pair)
+        return 'POST', '/badges/award', {'headers': self.auth, 'json': {'user_id': pair[0], 'badge_id': pair[1]}}
+
+    def remove(self, i):
+        user_id, badge_id = self.awarded.pop() if self.awarded else (self.user(i), self.badge(i))
+        return 'POST', '/badges/remove', {'headers': self.auth, 'json': {'user_id': user_id, 'badge_id': badge_id}}
+
+    def delete_badge(self, i):
+        badge_id = self.created_badges.pop() if self.created_badges else 'missing'
+        return 'DELETE', f'/badges/{badge_id}', {'headers': self.auth}
+
+    def delete_user(self, i):
+        user_id = self.registered.pop() if self.registered else 'missing'
+        return 'DELETE', f'/admin/users/{user_id}', {'headers': self.auth}
+
+    def collect(self, name, body):
+        # Keep the ids that write scenarios create for the ones after them
+        if name == 'POST /register' and body.get('success'):
+            self.registered.append(body['user_id'])
+        elif name == 'POST /badges' and 'id' in body:
+            self.created_badges.append(body['id'])
+
+
+async def run_scenario(suite, name, factory, n, concurrency):
+    timings = []
+    errors = 0
+    counter = iter(range(n))
+
+    async def caller():
+        nonlocal errors
+        for i in counter:
+            method, path, kwargs = factory(i)
+            t0 = time.perf_counter()
+            async with suite.client.request(method, path, **kwargs) as resp:
+                body = await resp.read()
+            timings.append((time.perf_counter() - t0) * 1000)
+            if resp.status >= 400:
+                errors += 1
+            elif resp.content_type == 'application/json':
+                suite.collect(name, json.loads(body))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return summarize(timings, errors, time.perf_counter() - t0)
+
+
+async def run_fanout(suite, server, clients, events):
+    # Latency from POST /badges/award to each subscribed socket receiving it
+    received = {}
+    done = asyncio.Event()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        sockets = []
+        for start in range(0, clients, 500):
+            sockets.extend(await asyncio.gather(*(
+                session.ws_connect(server.make_url('/ws')) for _ in range(start, min(start + 500, clients)))))
+
+        async def listen(ws):
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get('type') == 'badge_awarded':
+                    arrivals = received.setdefault(data['badge']['award_id'], [])
+                    arrivals.append(time.perf_counter())
+                    if len(arrivals) == len(sockets):
+                        done.set()
+
+        await asyncio.gather(*(ws.send_json({'type': 'subscribe', 'topics': ['feed']}) for ws in sockets))
+        await asyncio.gather(*(ws.receive() for ws in sockets))
+        listeners = [asyncio.create_task(listen(ws)) for ws in sockets]
+        timings = []
+        t_start = time.perf_counter()
+        for i in range(events):
+            done.clear()
+            method, path, kwargs = suite.award(i)
+            t0 = time.perf_counter()
+            async with suite.client.request(method, path, **kwargs) as resp:
+                award_id = (await resp.json())['award']['id']
+            await asyncio.wait_for(done.wait(), 30)
+            timings.extend((t - t0) * 1000 for t in received.pop(award_id))
+        elapsed = time.perf_counter() - t_start
+        for task in listeners:
+            task.cancel()
+        await asyncio.gather(*(ws.close() for ws in sockets))
+    return summarize(timings, 0, elapsed)
+
+
+def uncovered_routes(app, scenarios):
+    covered = {route for _, route, _, _ in scenarios} | {'GET /ws'}
+    routes = set()
+    for route in app.router.routes():
+        if route.method == 'HEAD':
+            continue
+        canonical = route.resource.canonical
+        if canonical.startswith('/static/'):
+            canonical = '/static/{path}'
+        routes.add(f'{route.method} {canonical}')
+    return sorted(routes - covered)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f'{"scenario":<42} {"req":>6} {"err":>4} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for name, r in results.items():
+        print(f'{name:<42} {r["requests"]:>6} {r["errors"]:>4} {r["rps"] or 0:>9.1f}'
+              f' {r["p50_ms"]:>9.2f} {r["p95_ms"]:>9.2f} {r["p99_ms"]:>9.2f}')
+
+
+def print_comparison(results, baseline):
+    # Positive latency change is slower, positive req/s change is faster
+    print(f'\nAgainst {baseline["meta"].get("commit")} ({baseline["meta"].get("date")}):')
+    print(f'{"scenario":<42} {"req/s":>9} {"p50":>8} {"p95":>8} {"p99":>8}')
+    change = lambda new, old: f'{(new - old) / old * 100:+7.1f}%' if old else '      -'  # noqa: E731
+    for name, r in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f'{name:<42} (new)')
+            continue
+        print(f'{name:<42} {change(r["rps"] or 0, old["rps"] or 0):>9} {change(r["p50_ms"], old["p50_ms"])}'
+              f' {change(r["p95_ms"], old["p95_ms"])} {change(r["p99_ms"], old["p99_ms"])}')
+
+
+async def run(args):
+    n_users, n_badges, n_awards = scale_of(args)
+    with tempfile.TemporaryDirectory() as target:
+        t0 = time.perf_counter()
+        users, badges = generate(target, n_users, n_badges, n_awards, args.months, args.seed,
+                                 password_hash=pbkdf2_sha256.hash('secret'))
+        print(f'Generated {n_users} users, {n_badges} badges, {n_awards} awards '
+              f'in {time.perf_counter() - t0:.1f} s')
+        cwd = os.getcwd()
+        os.chdir(target)
+        try:
+            # Every request comes from one client, so rate limits would
+            # turn most of them away
+            os.environ.setdefault('BADGE_ADMISSION', 'off')
+            t0 = time.perf_counter()
+            app = await main.init_app()
+            startup_s = time.perf_counter() - t0
+            print(f'Started the app in {startup_s:.1f} s')
+            async with TestClient(TestServer(app)) as client:
+                resp = await client.post('/login', json={'username': users[0]['username'], 'password': 'secret'})
+                suite = Suite(client, users, badges, (await resp.json())['token'])
+                await suite.prepare()
+                scenarios = suite.scenarios()
+                results = {}
+                for name, route, weight, factory in scenarios:
+                    if args.only and not any(part in name for part in args.only):
+                        continue
+                    n = max(int(args.requests * weight), args.concurrency)
+                    results[name] = await run_scenario(suite, name, factory, n, args.concurrency)
+                if args.ws_clients and (not args.only or any(part in '/ws fan-out' for part in args.only)):
+                    results[f'/ws fan-out ({args.ws_clients} clients)'] = await run_fanout(
+                        suite, client.server, args.ws_clients, args.ws_events)
+                uncovered = uncovered_routes(app, scenarios)
+        finally:
+            os.chdir(cwd)
+
+    print_results(results)
+    if uncovered:
+        print(f'\nRoutes without a scenario: {", ".join(uncovered)}')
+    # A scenario whose every request failed timed only its error path;
+    # its numbers must not be saved or compared as the route's
+    failed = [name for name, r in results.items() if r['requests'] and r['errors'] == r['requests']]
+    if failed:
+        sys.exit(f'\nFAILED: every request failed in {", ".join(failed)}')
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'codec': codec.BACKEND,
+            'users': n_users, 'badges': n_badges, 'awards': n_awards, 'months': args.months,
+            'requests': args.requests, 'concurrency': args.concurrency,
+            'startup_s': round(startup_s, 2),
+        },
+        'results': results,
+        'uncovered': uncovered,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nWrote {args.json}')
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    scale_args(parser)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent callers per scenario')
+    parser.add_argument('--ws-clients', type=int, default=1000, help='sockets for the fan-out scenario (0 to skip)')
+    parser.add_argument('--ws-events', type=int, default=20, help='awards broadcast in the fan-out scenario')
+    parser.add_argument('--only', nargs='+', help='run only scenarios whose name contains one of these')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare against results written by --json')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from aiohttp import web
+from codec import json_response
+
+
+# Refills at `rate` tokens a second up to `burst`
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        # Returns 0 if a token was taken, otherwise seconds until one is due
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# Admission limits shared by a group of routes: a global token bucket, a
+# token bucket per client, and at most `concurrency` requests running with
+# at most `queue` more waiting up to queue_timeout seconds for a slot. Any
+# limit left as None is not applied
+class AdmissionGroup:
+    def __init__(self, name, routes, rate=None, burst=None, client_rate=None, client_burst=None,
+                 concurrency=None, queue=0, queue_timeout=1.0, max_clients=10000):
+        self.name = name
+        self.routes = routes
+        now = time.monotonic()
+        self.bucket = TokenBucket(rate, burst or max(rate, 1), now) if rate else None
+        self.client_rate = client_rate
+        self.client_burst = client_burst or max(client_rate or 0, 1)
+        self.clients = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self.max_clients = max_clients
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()  # futures of queued requests, oldest first
+        self.average_seconds = 0.0  # moving average of request time, for Retry-After
+        self.admitted = 0
+        self.rejected = {'client_rate': 0, 'rate': 0, 'busy': 0}
+
+    def take_tokens(self, client):
+        # Returns 0 if the request is within the rate limits, otherwise
+        # seconds until it would be
+        now = time.monotonic()
+        client_bucket = None
+        if self.client_rate:
+            client_bucket = self.clients.get(client)
+            if client_bucket is None:
+                client_bucket = self.clients[client] = TokenBucket(self.client_rate, self.client_burst, now)
+                if len(self.clients) > self.max_clients:
+                    self.clients.popitem(last=False)
+            else:
+                self.clients.move_to_end(client)
+            wait = client_bucket.take(now)
+            if wait:
+                self.rejected['client_rate'] += 1
+                return wait
+        if self.bucket is not None:
+            wait = self.bucket.take(now)
+            if wait:
+                if client_bucket is not None:
+                    client_bucket.tokens += 1  # not the client's fault
+                self.rejected['rate'] += 1
+                return wait
+        return 0
+
+    async def acquire(self):
+        # Returns True once the request holds a slot, False if the queue is
+        # full or the wait times out
+        if self.concurrency is None:
+            return True
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue:
+            self.rejected['busy'] += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            # release() hands its slot straight to the future
+            await asyncio.wait_for(future, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected['busy'] += 1
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot arrived as the request went away
+            raise
+        finally:
+            if future.cancelled() and future in self.waiters:
+                self.waiters.remove(future)
+
+    def release(self):
+        if self.concurrency is None:
+            return
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, seconds):
+        self.average_seconds += (seconds - self.average_seconds) * 0.1
+
+    def busy_retry_after(self):
+        # Time for the queue ahead to drain at the current pace
+        return self.average_seconds * (len(self.waiters) + 1) / (self.concurrency or 1)
+
+    def stats(self):
+        return {
+            'routes': self.routes,
+            'active': self.active,
+            'waiting': len(self.waiters),
+            'clients': len(self.clients),
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'average_ms': round(self.average_seconds * 1000, 3),
+        }
+
+
+# Routes to their AdmissionGroup, from a {group name: settings} mapping
+# whose settings are AdmissionGroup's arguments. A group set to None is
+# turned off
+class Admission:
+    def __init__(self, groups):
+        self.groups = {}
+        self.routes = {}  # 'METHOD /pattern' -> AdmissionGroup
+        for name, settings in groups.items():
+            if settings is None:
+                continue
+            group = self.groups[name] = AdmissionGroup(name, **settings)
+            for route in group.routes:
+                self.routes[route] = group
+
+    def stats(self):
+        return {name: group.stats() for name, group in self.groups.items()}
+
+
+def too_many_requests(seconds):
+    return json_response({'success': False, 'message': 'Too many requests, try again later'}, status=429,
+                         headers={'Retry-After': str(max(math.ceil(seconds), 1))})
+
+
+def admission_middleware(admission):
+    # Runs after auth_middleware: signed-in clients are limited by user,
+    # others by address. Requests turned away get 429 with Retry-After
+    # before any of their work starts
+    @web.middleware
+    async def middleware(request, handler):
+        resource = request.match_info.route.resource
+        if resource is None:
+            return await handler(request)
+        group = admission.routes.get(f'{request.method} {resource.canonical}')
+        if group is None:
+            return await handler(request)
+
+        claims = request.get('auth')
+        wait = group.take_tokens(claims['sub'] if claims else request.remote)
+        if wait:
+            return too_many_requests(wait)
+        if not await group.acquire():
+            return too_many_requests(group.busy_retry_after())
+        group.admitted += 1
+        start = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            group.observe(time.perf_counter() - start)
+            group.release()
+    return middleware
@@ -0,0 +1,153 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip alone is served without it
+    brotli = None
+
+
+# Types worth compressing; JPEG/PNG and other images are compressed already
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# Fingerprinted names look like styles.3f2a9c0e1b7d.css
+FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+STATIC_URL = re.compile(r'(?P<attr>(?:src|href)=")/static/(?P<path>[^"?#]+)"')
+# The app's own stylesheets and scripts, held in memory. Everything else,
+# including every uploaded badge image, is sent from disk, so memory does
+# not grow with the number of uploads
+PRELOADED = ('.css', '.js')
+# Uploaded badge images are named by their content hash
+CONTENT_HASHED = re.compile(r'^images/[0-9a-f]{32}\.[a-z]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.blake2b(body, digest_size=6).hexdigest()
+        self.etag = f'"{self.digest}"'
+        self.variants = {}  # content-encoding -> compressed body
+        if content_type.startswith(COMPRESSIBLE) and len(body) > 256:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body)
+
+    def response(self, request, cache_control):
+        headers = {'ETag': self.etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if request.headers.get('If-None-Match') == self.etag:
+            return web.Response(status=304, headers=headers)
+
+        body = self.body
+        accepted = request.headers.get('Accept-Encoding', '')
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                body = self.variants[encoding]
+                headers['Content-Encoding'] = encoding
+                break
+        return web.Response(body=body, content_type=self.content_type, headers=headers)
+
+
+def read_asset(path):
+    with open(path, 'rb') as f:
+        body = f.read()
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return Asset(body, content_type)
+
+
+# Stylesheets, scripts and HTML pages held in memory, loaded once at startup
+# off the event loop. Those assets are also reachable under content-hash
+# fingerprinted names, which are cached forever; plain names revalidate with
+# their ETag. Other static files are streamed from disk, and uploads, whose
+# names are content hashes already, are cached forever too.
+# With dev=True files are re-read on every request so edits show up at once
+class StaticAssets:
+    def __init__(self, root, templates, dev=False):
+        self.root = os.path.abspath(root)
+        self.templates = os.path.abspath(templates)
+        self.dev = dev
+        self.assets = {}  # path relative to root -> Asset
+        self.pages = {}  # template name -> Asset
+
+    async def load(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._load_all)
+
+    def _load_all(self):
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(PRELOADED):
+                    path = os.path.join(directory, filename)
+                    self.assets[os.path.relpath(path, self.root).replace(os.sep, '/')] = read_asset(path)
+        for filename in os.listdir(self.templates):
+            if filename.endswith('.html'):
+                self.pages[filename] = self._read_page(filename)
+
+    def _read_page(self, name):
+        with open(os.path.join(self.templates, name), encoding='utf-8') as f:
+            html = f.read()
+        return Asset(STATIC_URL.sub(self._fingerprint_url, html).encode('utf-8'), 'text/html')
+
+    def _fingerprint_url(self, match):
+        asset = self.assets.get(match.group('path'))
+        if asset is None:
+            return match.group(0)
+        stem, ext = os.path.splitext(match.group('path'))
+        return f'{match.group("attr")}/static/{stem}.{asset.digest}{ext}"'
+
+    def url(self, path):
+        # Fingerprinted URL for a static path, or the plain one if unknown
+        asset = self.assets.get(path)
+        if asset is None:
+            return f'/static/{path}'
+        stem, ext = os.path.splitext(path)
+        return f'/static/{stem}.{asset.digest}{ext}'
+
+    def _file_path(self, path):
+        # Absolute path of a file under root, or None
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    def _read_file(self, path):
+        full_path = self._file_path(path)
+        return read_asset(full_path) if full_path is not None else None
+
+    async def _get(self, path):
+        # A preloaded asset, or None for paths that are not preloaded
+        if not path.endswith(PRELOADED):
+            return None
+        if self.dev:
+            return await asyncio.get_running_loop().run_in_executor(None, self._read_file, path)
+        return self.assets.get(path)
+
+    async def handle_static(self, request):
+        path = request.match_info['path']
+        asset = await self._get(path)
+        if asset is not None:
+            return asset.response(request, 'no-cache')
+
+        match = FINGERPRINT.match(path)
+        if match:
+            asset = await self._get(match.group('stem') + match.group('ext'))
+            if asset is not None and asset.digest == match.group('digest'):
+                return asset.response(request, IMMUTABLE)
+
+        full_path = await asyncio.get_running_loop().run_in_executor(None, self._file_path, path)
+        if full_path is None:
+            raise web.HTTPNotFound()
+        cache_control = IMMUTABLE if CONTENT_HASHED.match(path) else 'no-cache'
+        return web.FileResponse(full_path, headers={'Cache-Control': cache_control})
+
+    def page(self, name):
+        # Handler serving one HTML page from memory
+        async def handler(request):
+            if self.dev:
+                await asyncio.get_running_loop().run_in_executor(None, self._load_all)
+            return self.pages[name].response(request, 'no-cache')
+        return handler
@@ -0,0 +1,94 @@
+import secrets
+import time
+from collections import OrderedDict
+from aiohttp import web
+from jose import JWTError, jwt
+from codec import json_response
+
+
+# Signed, expiring session tokens. Decoded claims are kept in a small LRU so
+# authenticated requests skip signature checks as well as password hashing
+class TokenManager:
+    algorithm = 'HS256'
+
+    def __init__(self, secret=None, ttl=3600, cache_size=1024):
+        if not secret:
+            print("BADGE_SECRET_KEY not set, using a random key; sessions end on restart")
+            secret = secrets.token_urlsafe(32)
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # token -> claims
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def issue(self, user):
+        now = int(time.time())
+        claims = {
+            'sub': user['id'],
+            'role': user.get('role', 'user'),
+            'iat': now,
+            'exp': now + self.ttl,
+        }
+        return jwt.encode(claims, self.secret, algorithm=self.algorithm)
+
+    def decode(self, token):
+        # Returns the claims of a valid, unexpired token, otherwise None
+        claims = self.cache.get(token)
+        if claims is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(token)
+        else:
+            self.cache_misses += 1
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+            except JWTError:
+                return None
+            self.cache[token] = claims
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        if claims['exp'] <= time.time():
+            self.cache.pop(token, None)
+            return None
+        return claims
+
+    def stats(self):
+        return {
+            'ttl': self.ttl,
+            'cache_size': len(self.cache),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def auth_middleware(tokens):
+    # Attach the caller's claims (or None) to every request as request['auth']
+    @web.middleware
+    async def middleware(request, handler):
+        claims = None
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            claims = tokens.decode(header[7:].strip())
+        request['auth'] = claims
+        return await handler(request)
+    return middleware
+
+
+def login_required(handler):
+    async def wrapper(request):
+        if not request.get('auth'):
+            return json_response({'success': False, 'message': 'Authentication required'}, status=401)
+        return await handler(request)
+    return wrapper
+
+
+def admin_required(handler):
+    async def wrapper(request):
+        claims = request.get('auth')
+        if not claims:
+            return json_response({'success': False, 'message': 'Authentication required'}, status=401)
+        if claims.get('role') != 'admin':
+            return json_response({'success': False, 'message': 'Admin access required'}, status=403)
+        return await handler(request)
+    return wrapper
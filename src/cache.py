@@ -0,0 +1,72 @@
+import hashlib
+from collections import OrderedDict
+from aiohttp import web
+
+
+# Serialized read responses, keyed by request path and query plus the data
+# generation they were built from. A write moves on the generations of what
+# it changed, so stale entries are never hit again and age out of the LRU
+class ResponseCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (path_qs, generation) -> (etag, body, content_type)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, body, content_type):
+        etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        entry = (etag, body, content_type)
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        return {
+            'max_entries': self.max_entries,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+        }
+
+
+def etag_matches(header, etag):
+    # If-None-Match uses weak comparison: W/ prefixes are ignored
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+
+def cached(cache, generation):
+    # Wrap a JSON read handler: serve its body from the cache while
+    # generation(request) is unchanged, with an ETag, and answer
+    # If-None-Match with 304
+    def decorator(handler):
+        async def wrapper(request):
+            key = (request.path_qs, generation(request))
+            entry = cache.get(key)
+            if entry is None:
+                response = await handler(request)
+                if response.status != 200 or not isinstance(response.body, bytes):
+                    return response
+                entry = cache.put(key, response.body, response.content_type)
+
+            etag, body, content_type = entry
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                cache.not_modified += 1
+                return web.Response(status=304, headers={'ETag': etag})
+            return web.Response(body=body, content_type=content_type, headers={'ETag': etag})
+        return wrapper
+    return decorator
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import signal
+import struct
+from codec import dumps, loads
+
+
+# Multi-worker mode (--workers N): one writer process owns the storage and
+# the authoritative DataManager; N worker processes serve HTTP from replicas
+# of its resident state. Workers hand every write to the writer, which
+# applies it, persists it and streams the change back to all of them over a
+# Unix domain socket. Frames are a 4-byte length and a JSON body
+HEADER = struct.Struct('>I')
+
+
+def encode_frame(message):
+    body = dumps(message)
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return loads(await reader.readexactly(size))
+
+
+class WriterError(Exception):
+    # A forwarded call that raised in the writer process
+    pass
+
+
+# Writer side: accepts replica connections, runs their forwarded calls and
+# broadcasts every change, with the events recorded for it, in write order
+class WriterServer:
+    def __init__(self, data_manager, path):
+        self.data_manager = data_manager
+        self.path = path
+        self.server = None
+        self.replicas = set()  # StreamWriters of the connected workers
+        self.pending_events = []  # recorded since the last change went out
+        self.changes = 0
+        data_manager.listeners.append(self.pending_events.append)
+        data_manager.change_listeners.append(self.broadcast)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for replica in self.replicas:
+            replica.close()
+        self.replicas.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def broadcast(self, name, op, records):
+        # Called by DataManager before each write is persisted. Events are
+        # recorded before the write they describe, so they travel with it
+        change = {'change': [name, op, records], 'events': self.pending_events[:]}
+        if name == 'awards' and op == 'delete':
+            change['holders'] = self.data_manager.holders_of(records)
+        self.pending_events.clear()
+        self.changes += 1
+        frame = encode_frame(change)
+        for replica in self.replicas:
+            replica.write(frame)
+
+    async def _serve(self, reader, writer):
+        # The snapshot is taken and queued without awaiting, so the replica
+        # gets every change after it and none before
+        writer.write(encode_frame(self.data_manager.snapshot()))
+        self.replicas.add(writer)
+        tasks = set()
+        try:
+            while True:
+                message = await read_frame(reader)
+                task = asyncio.create_task(self._call(writer, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.replicas.discard(writer)
+            writer.close()
+
+    async def _call(self, writer, message):
+        name = message['call']
+        method = getattr(self.data_manager, name, None)
+        if not getattr(method, 'forwarded', False):
+            reply = {'id': message['id'], 'error': f"{name} is not a forwarded method"}
+        else:
+            try:
+                reply = {'id': message['id'], 'result': await method(*message['args'], **message['kwargs'])}
+            except Exception as e:
+                reply = {'id': message['id'], 'error': f"{type(e).__name__}: {e}"}
+        # Written after the call's changes, so the replica has applied them
+        # by the time the caller sees the result
+        if not writer.is_closing():
+            writer.write(encode_frame(reply))
+
+    def stats(self):
+        return {'replicas': len(self.replicas), 'changes': self.changes}
+
+
+# Worker side: loads the snapshot into the worker's DataManager, applies
+# the change stream and sends forwarded calls to the writer
+class WriterClient:
+    def __init__(self, data_manager, path):
+        self.data_manager = data_manager
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.calls = {}  # call id -> future of its result
+        self.next_id = 0
+
+    async def connect(self, attempts=50, delay=0.1):
+        # The writer may still be starting when the workers are
+        for attempt in range(attempts):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+        self.data_manager.load_snapshot(await read_frame(self.reader))
+        self.data_manager.writer = self
+        self.task = asyncio.create_task(self._receive())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+    async def call(self, name, *args, **kwargs):
+        if self.writer.is_closing():
+            raise ConnectionError("Lost the connection to the writer process")
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.calls[self.next_id] = future
+        self.writer.write(encode_frame({'id': self.next_id, 'call': name, 'args': args, 'kwargs': kwargs}))
+        await self.writer.drain()
+        return await future
+
+    async def _receive(self):
+        try:
+            while True:
+                message = await read_frame(self.reader)
+                if 'change' in message:
+                    self.data_manager.apply_change(*message['change'], message['events'],
+                                                   message.get('holders', ()))
+                    continue
+                future = self.calls.pop(message['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(WriterError(message['error']))
+                else:
+                    future.set_result(message['result'])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Without the writer this replica can only go stale; stop the
+            # worker rather than serve old data
+            print("Lost the connection to the writer process, stopping")
+            for future in self.calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the connection to the writer process"))
+            self.calls.clear()
+            self.writer.close()
+            os.kill(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,44 @@
+import json
+from aiohttp import web
+from metrics import phase
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder is used without it
+    orjson = None
+
+
+# One JSON codec for data files, journals, HTTP responses and WebSocket
+# messages. Output is compact UTF-8 either way, so files written with one
+# backend read back with the other
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def dumps(obj, pretty=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    BACKEND = 'json'
+
+    def dumps(obj, pretty=False):
+        if pretty:
+            return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_str(obj):
+    # For text-only sinks: WebSocket text frames and SQLite TEXT columns
+    return dumps(obj).decode('utf-8')
+
+
+def json_response(data, status=200, headers=None):
+    # Drop-in for web.json_response that encodes with the codec above
+    with phase('serialize'):
+        body = dumps(data)
+    return web.Response(body=body, status=status, headers=headers, content_type='application/json')
+
@@ -1,113 +1,829 @@
+import argparse
 import asyncio
+import functools
+import multiprocessing
 import os
+import secrets
+import signal
 import json
 import uuid
-import aiofiles
 import shutil
+import hashlib
+import mimetypes
+import tempfile
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from itertools import chain, islice
 from pathlib import Path
 from datetime import datetime, timezone
-from aiohttp import web
+from aiohttp import WSMsgType, web
 from aiohttp.web import Request
-from passlib.hash import pbkdf2_sha256
 import jinja2
 import aiohttp_jinja2
+from admission import Admission, admission_middleware
+from assets import StaticAssets
+from cache import ResponseCache, cached
+from codec import JSONDecodeError, dumps_str, json_response, loads
+from cluster import WriterClient, WriterServer
+from metrics import Exposition, Metrics, metrics_middleware, phase
+from profiling import Profiler, profiling_middleware
+from auth import TokenManager, auth_middleware, admin_required, login_required
+from search import SearchIndex, decode_cursor, encode_cursor
+from passwords import PasswordHasher, PasswordHasherBusy
+from storage import JsonStorage, SqliteStorage, award_month, migrate_json_to_sqlite
+
+def forwarded(method):
+    # Mark a DataManager method that a replica hands to the writer process
+    # in multi-worker mode; the writer streams the resulting changes back
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.writer is not None:
+            with phase('storage'):
+                return await self.writer.call(method.__name__, *args, **kwargs)
+        return await method(self, *args, **kwargs)
+    wrapper.forwarded = True
+    return wrapper
 
 # Data Management
 class DataManager:
-    def __init__(self, data_dir):
-        self.data_dir = data_dir
-        self.users_file = os.path.join(data_dir, 'users.json')
-        self.badges_file = os.path.join(data_dir, 'badges.json')
-        self.awards_file = os.path.join(data_dir, 'awards.json')
-        self.ensure_data_files()
-
-    def ensure_data_files(self):
-        # Initialize data files if they don't exist
-        for file_path in [self.users_file, self.badges_file, self.awards_file]:
-            if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    json.dump([], f)
-
-    async def read_json(self, file_path):
-        async with aiofiles.open(
-            file_path, mode='r', encoding='utf-8', errors='ignore'
-        ) as f:
-            content = await f.read()
-            return json.loads(content) if content else []
-
-    async def write_json(self, file_path, data):
-        async with aiofiles.open(file_path, mode='w', encoding='utf-8') as f:
-            await f.write(json.dumps(data, indent=2, ensure_ascii=False))
-        return True
+    # Collections each kind of event changes, for the per-collection generations
+    event_collections = {
+        'badge_awarded': ('awards',),
+        'badge_removed': ('awards',),
+        'badges_awarded': ('awards',),
+        'badges_removed': ('awards',),
+        'badge_created': ('badges',),
+        'badge_updated': ('badges',),
+        'badge_deleted': ('badges',),
+        'user_created': ('users',),
+        'user_updated': ('users',),
+        'user_deleted': ('users', 'awards'),
+    }
+
+    def __init__(self, storage, hasher, event_ring_size=10000):
+        # Persistence backend (JsonStorage or SqliteStorage); reads are
+        # served from the resident store below
+        self.storage = storage
+        # Password hashing runs on the hasher's process pool
+        self.hasher = hasher
+
+        # Resident store, populated once by load()
+        self.users = {}  # user id -> user
+        self.users_by_username = {}  # username -> user
+        self.badges = {}  # badge id -> badge
+        self.awards = {}  # award id -> award of the hot segment, in insertion order
+        # Sealed award segments, when the backend has them. Their awards are
+        # counted from the backend's history summary and only become
+        # resident, in sealed_awards, once a query needs the segment
+        self.sealed_months = set()
+        self.user_segments = {}  # user id -> months with awards to the user
+        self.loaded_segments = set()
+        self.sealed_awards = {}  # award id -> award, for loaded segments
+        self.segment_lock = asyncio.Lock()
+        # Both indexes cover resident awards: hot and loaded sealed ones
+        self.awards_by_user = {}  # user id -> {award id: award}
+        self.awards_by_badge = {}  # badge id -> {award id: award}
+        # Activity feed: (awarded_at, award id) for every resident award,
+        # oldest first. New awards land at the end, so keeping it sorted is
+        # nearly free
+        self.feed = []
+        # Materialized counts, kept in step with the award indexes
+        self.badge_award_counts = {}  # badge id -> awards of that badge
+        self.badge_holder_counts = {}  # badge id -> distinct users holding it
+        self.user_badge_counts = {}  # user id -> {badge id: times awarded}
+        # Holders of each badge with their earliest award of it, and the
+        # holders as sorted (username, user id) keys for paging
+        self.badge_holders = {}  # badge id -> {user id: award}
+        self.badge_holder_order = {}  # badge id -> [(username, user id)]
+        # Uploaded images are stored by content hash and may be shared
+        self.icon_refs = {}  # icon filename -> badges using it
+        # Listing orders for paginated endpoints: sorted (name, id) keys
+        self.user_order = []
+        self.badge_order = []
+        # Text search over users and badges, kept in step with the store
+        self.search_index = SearchIndex()
+
+        # Change log: every mutation gets the next sequence number and is kept
+        # in a bounded ring, so reconnecting clients can fetch just what they
+        # missed. The epoch changes on every start, invalidating old cursors
+        self.epoch = uuid.uuid4().hex
+        self.sequence = 0
+        self.events = deque(maxlen=event_ring_size)
+        self.listeners = []  # called with each event as it is recorded
+        # Called with (collection, 'put' or 'delete', records) for every write
+        self.change_listeners = []
+        # In multi-worker mode, a replica's link to the writer process that
+        # owns the storage (cluster.WriterClient); None in the writer itself
+        self.writer = None
+        # Bumped with every write to a collection; cached reads key on these
+        self.generations = {'users': 0, 'badges': 0, 'awards': 0}
+        # Bumped with every write that changes what is shown for one user
+        # ('user', id) or one badge ('badge', id), so cached per-user and
+        # per-badge reads survive writes to other users and badges. Entries
+        # are never dropped: a restarted count could match an old cache key
+        self.scoped_generations = {}
+
+    async def load(self):
+        # Load every collection from the backend once and build the indexes.
+        # The backend hands back live mappings that it may snapshot later,
+        # so they are adopted rather than copied
+        collections = await self.storage.load()
+        self.users = collections['users']
+        self.badges = collections['badges']
+        self.awards = collections['awards']
+        self._index_users_and_badges()
+        self.awards_by_user = {}
+        self.awards_by_badge = {}
+        self.badge_award_counts = {}
+        self.badge_holder_counts = {}
+        self.user_badge_counts = {}
+        self.badge_holders = {}
+        for award in self.awards.values():
+            self._index_award(award, bulk=True)
+        history = collections.get('history')
+        self.sealed_months = set(history['months']) if history else set()
+        self.user_segments = history['user_months'] if history else {}
+        self.loaded_segments = set()
+        self.sealed_awards = {}
+        if history:
+            self._count_summary(history)
+        # Sorted once here; afterwards maintained by _index_award/_unindex_award
+        self.feed = sorted(self._feed_key(award) for award in self.awards.values())
+        self._order_holders()
+
+    def _index_users_and_badges(self):
+        self.users_by_username = {user['username']: user for user in self.users.values()}
+        self.user_order = sorted(map(self._user_key, self.users.values()))
+        self.badge_order = sorted(map(self._badge_key, self.badges.values()))
+        self.icon_refs = {}
+        for badge in self.badges.values():
+            self._ref_icon(badge.get('icon'), 1)
+        self.search_index.rebuild(
+            [('user', user['id'], user['username'], self._user_search_fields(user)) for user in self.users.values()]
+            + [('badge', badge['id'], badge.get('name'), self._badge_search_fields(badge)) for badge in self.badges.values()]
+        )
+
+    def _order_holders(self):
+        self.badge_holder_order = {
+            badge_id: sorted(self._user_key(self.users[user_id]) for user_id in holders if user_id in self.users)
+            for badge_id, holders in self.badge_holders.items()
+        }
+
+    def snapshot(self):
+        # The resident state a replica starts from (see load_snapshot),
+        # taken without awaiting so no change falls between it and the next.
+        # Sealed awards are left out; the replica asks the writer for them
+        return {
+            'users': self.users,
+            'badges': self.badges,
+            'awards': self.awards,
+            'sealed_months': sorted(self.sealed_months),
+            'user_segments': self.user_segments,
+            'badge_award_counts': self.badge_award_counts,
+            'badge_holder_counts': self.badge_holder_counts,
+            'user_badge_counts': self.user_badge_counts,
+            'badge_holders': self.badge_holders,
+            'epoch': self.epoch,
+            'sequence': self.sequence,
+            'events': list(self.events),
+        }
+
+    def load_snapshot(self, snapshot):
+        # Replica counterpart of load(): adopt the writer's state, counters
+        # included, and continue its event sequence
+        self.users = snapshot['users']
+        self.badges = snapshot['badges']
+        self.awards = snapshot['awards']
+        self._index_users_and_badges()
+        self.awards_by_user = {}
+        self.awards_by_badge = {}
+        for award in self.awards.values():
+            self._index_resident(award)
+        self.feed = sorted(self._feed_key(award) for award in self.awards.values())
+        self.sealed_months = set(snapshot['sealed_months'])
+        self.user_segments = snapshot['user_segments']
+        self.loaded_segments = set()
+        self.sealed_awards = {}
+        self.badge_award_counts = snapshot['badge_award_counts']
+        self.badge_holder_counts = snapshot['badge_holder_counts']
+        self.user_badge_counts = snapshot['user_badge_counts']
+        self.badge_holders = snapshot['badge_holders']
+        self._order_holders()
+        self.epoch = snapshot['epoch']
+        self.sequence = snapshot['sequence']
+        self.events.extend(snapshot['events'])
+
+    def holders_of(self, awards):
+        # The first award each of the awards' users now holds of its badge,
+        # as [badge_id, user_id, award or None]. Sent along with revoked
+        # awards, which replicas cannot fall back from on their own when
+        # the earlier awards are in sealed segments
+        pairs = {(award.get('badge_id'), award.get('user_id')) for award in awards}
+        return [[badge_id, user_id, self.badge_holders.get(badge_id, {}).get(user_id)]
+                for badge_id, user_id in pairs]
+
+    def apply_change(self, name, op, records, events, holders=()):
+        # Replicas only: apply a write the writer made, with the events it
+        # recorded for it, in the writer's order. Records are whole, so
+        # replaying them reproduces the writer's resident state
+        if name == 'awards':
+            if op == 'put':
+                for award in records:
+                    if award['id'] not in self.awards:
+                        self._index_award(award)
+            else:
+                for award in records:
+                    self._unindex_award(self.awards.get(award['id'], award))
+                for badge_id, user_id, first in holders:
+                    self._touch(('badge', badge_id))
+                    badge_holders = self.badge_holders.setdefault(badge_id, {})
+                    if first is None:
+                        if not badge_holders:
+                            del self.badge_holders[badge_id]
+                        continue
+                    if user_id not in badge_holders and user_id in self.users:
+                        insort(self.badge_holder_order.setdefault(badge_id, []), self._user_key(self.users[user_id]))
+                    badge_holders[user_id] = first
+        elif name == 'users':
+            for record in records:
+                user = self.users.get(record['id'])
+                if op == 'delete':
+                    if user is not None:
+                        self._remove_user(user)
+                elif user is None:
+                    self._index_user(record)
+                else:
+                    self._apply_user_update(user, record)
+        elif name == 'badges':
+            for record in records:
+                badge = self.badges.get(record['id'])
+                if op == 'delete':
+                    if badge is not None:
+                        self._remove_badge(badge)
+                elif badge is None:
+                    self._add_badge(record)
+                else:
+                    self._apply_badge_update(badge, record)
+        # A mutation's events come with the first of its writes, so a
+        # response cached between two of them (delete_user's) would
+        # otherwise outlive the second
+        self.generations[name] += 1
+        for event in events:
+            # Keep the writer's sequence numbers, so event cursors are
+            # valid on every worker
+            self.sequence = event['seq'] - 1
+            self._record(event['type'], **{k: v for k, v in event.items() if k not in ('seq', 'type')})
+
+    async def close(self):
+        if self.storage is not None:
+            await self.storage.close()
+
+    @forwarded
+    async def storage_stats(self):
+        return self.storage.stats()
+
+    async def _put(self, name, *records):
+        self._changed(name, 'put', records)
+        with phase('storage'):
+            await self.storage.put(name, *records)
+
+    async def _delete(self, name, *records):
+        self._changed(name, 'delete', records)
+        with phase('storage'):
+            await self.storage.delete(name, *(record['id'] for record in records))
+
+    def _changed(self, name, op, records):
+        # Runs before the write is awaited, so listeners see writes in
+        # mutation order
+        for listener in self.change_listeners:
+            listener(name, op, records)
+
+    def _record(self, event_type, **payload):
+        # Called right after the in-memory change, so sequence order is
+        # mutation order
+        self.sequence += 1
+        for name in self.event_collections[event_type]:
+            self.generations[name] += 1
+        event = {'seq': self.sequence, 'type': event_type, **payload}
+        self.events.append(event)
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Error in event listener: {str(e)}")
+        return event
+
+    def generation(self, *names):
+        return tuple(self.generations[name] for name in names)
+
+    def _touch(self, *scopes):
+        for scope in scopes:
+            self.scoped_generations[scope] = self.scoped_generations.get(scope, 0) + 1
+
+    def badge_generation(self, *badge_ids):
+        return tuple(self.scoped_generations.get(('badge', badge_id), 0) for badge_id in badge_ids)
+
+    def user_badges_generation(self, user_id):
+        # A user's badge list shows each badge held with its holder count.
+        # The set of badges held only changes with the user's generation,
+        # so theirs and those of the badges held cover the list
+        return (self.scoped_generations.get(('user', user_id), 0),
+                *self.badge_generation(*self.user_badge_counts.get(user_id, ())))
+
+    def _touch_awarder(self, user_id):
+        # Badge details name who made each holder's first award
+        for badge_id, holders in self.badge_holders.items():
+            if any(award.get('awarded_by') == user_id for award in holders.values()):
+                self._touch(('badge', badge_id))
+
+    def events_since(self, since, epoch=None):
+        # Events after cursor `since`; resync is set when the cursor is from
+        # another epoch or older than the ring, and the client must reload
+        result = {'epoch': self.epoch, 'seq': self.sequence, 'resync': False, 'events': []}
+        if since is None:
+            return result
+        oldest = self.events[0]['seq'] if self.events else self.sequence + 1
+        if epoch != self.epoch or since > self.sequence or since < oldest - 1:
+            result['resync'] = True
+            return result
+        result['events'] = list(islice(self.events, since - oldest + 1, None))
+        return result
+
+    @staticmethod
+    def _public_user(user):
+        return {'id': user['id'], 'username': user['username'], 'display_name': user.get('display_name', user['username'])}
+
+    def _award_payload(self, award):
+        # Award joined with its badge and recipient, as pushed to clients
+        badge = self.badges.get(award['badge_id'], {})
+        user = self.users.get(award['user_id'], {})
+        return {
+            'id': award['badge_id'],
+            'name': badge.get('name', 'Unknown Badge'),
+            'description': badge.get('description', ''),
+            'icon': badge.get('icon', ''),
+            'award_id': award['id'],
+            'user': user.get('username', 'Unknown'),
+            'user_id': award['user_id'],
+            'awarded_by': award.get('awarded_by'),
+            'awarded_at': award.get('awarded_at')
+        }
+
+    def _index_user(self, user):
+        # Sorted first: comparing keys is the step that can fail, and then
+        # nothing else has been indexed
+        insort(self.user_order, self._user_key(user))
+        self._touch(('user', user['id']))
+        self.users[user['id']] = user
+        self.users_by_username[user['username']] = user
+        self._index_user_search(user)
+
+    def _unindex_user(self, user):
+        # Its awards are gone by now, and touched their badges as they went
+        self._touch(('user', user['id']))
+        self._touch_awarder(user['id'])
+        self.users.pop(user['id'], None)
+        if self.users_by_username.get(user['username']) is user:
+            del self.users_by_username[user['username']]
+        self._sorted_remove(self.user_order, self._user_key(user))
+        self.search_index.remove('user', user['id'])
+
+    @staticmethod
+    def _user_key(user):
+        return (user['username'], user['id'])
+
+    @staticmethod
+    def _badge_key(badge):
+        return (badge.get('name') or '', badge['id'])
+
+    @staticmethod
+    def _sorted_remove(order, key):
+        position = bisect_left(order, key)
+        if position < len(order) and order[position] == key:
+            del order[position]
+
+    @staticmethod
+    def _page(order, after, limit):
+        # Up to limit keys of a sorted list after the `after` key, plus the
+        # key to continue from when more remain
+        start = bisect_right(order, after) if after is not None else 0
+        keys = order[start:start + limit]
+        return keys, (keys[-1] if keys and start + limit < len(order) else None)
+
+    @staticmethod
+    def _user_search_fields(user):
+        return {'username': user['username'], 'display_name': user.get('display_name'), 'email': user.get('email')}
+
+    @staticmethod
+    def _badge_search_fields(badge):
+        return {'name': badge.get('name'), 'description': badge.get('description')}
+
+    def _index_user_search(self, user):
+        self.search_index.add('user', user['id'], user['username'], self._user_search_fields(user))
+
+    def _index_badge_search(self, badge):
+        self.search_index.add('badge', badge['id'], badge.get('name'), self._badge_search_fields(badge))
+
+    @staticmethod
+    def _feed_key(award):
+        return (award.get('awarded_at') or '', award['id'])
+
+    def _index_award(self, award, bulk=False):
+        # bulk skips the sorted lists, which load() builds in one go
+        self.awards[award['id']] = award
+        self._index_resident(award)
+        if not bulk:
+            insort(self.feed, self._feed_key(award))
+        self._count_award(award, bulk)
+
+    def _index_resident(self, award):
+        self.awards_by_user.setdefault(award.get('user_id'), {})[award['id']] = award
+        self.awards_by_badge.setdefault(award.get('badge_id'), {})[award['id']] = award
+
+    def _count_award(self, award, bulk=False):
+        user_id, badge_id = award.get('user_id'), award.get('badge_id')
+        if user_id is None or badge_id is None:
+            # Left out of the counters, as segment summaries leave it out:
+            # a None key would not survive the snapshot sent to replicas
+            return
+        if not bulk:
+            self._touch(('user', user_id), ('badge', badge_id))
+        self.badge_award_counts[badge_id] = self.badge_award_counts.get(badge_id, 0) + 1
+        held = self.user_badge_counts.setdefault(user_id, {})
+        held[badge_id] = held.get(badge_id, 0) + 1
+        if held[badge_id] == 1:
+            self.badge_holder_counts[badge_id] = self.badge_holder_counts.get(badge_id, 0) + 1
+
+        holders = self.badge_holders.setdefault(badge_id, {})
+        first = holders.get(user_id)
+        if first is None:
+            holders[user_id] = award
+            if not bulk and user_id in self.users:
+                insort(self.badge_holder_order.setdefault(badge_id, []), self._user_key(self.users[user_id]))
+        elif self._feed_key(award) < self._feed_key(first):
+            holders[user_id] = award
+
+    def _count_summary(self, summary):
+        # Fold the sealed segments' summary into the counters and holders,
+        # as if their awards had been indexed. Called by load() only
+        for badge_id, count in summary['badges'].items():
+            self.badge_award_counts[badge_id] = self.badge_award_counts.get(badge_id, 0) + count
+        for user_id, counts in summary['users'].items():
+            held = self.user_badge_counts.setdefault(user_id, {})
+            for badge_id, count in counts.items():
+                if badge_id not in held:
+                    self.badge_holder_counts[badge_id] = self.badge_holder_counts.get(badge_id, 0) + 1
+                held[badge_id] = held.get(badge_id, 0) + count
+        for badge_id, firsts in summary['first'].items():
+            holders = self.badge_holders.setdefault(badge_id, {})
+            for user_id, award in firsts.items():
+                first = holders.get(user_id)
+                if first is None or self._feed_key(award) < self._feed_key(first):
+                    holders[user_id] = award
+
+    async def _load_segments(self, months):
+        # Make the awards of sealed segments resident. Their counts are
+        # already in place from the summaries, so only the award indexes
+        # and the feed take them in
+        async with self.segment_lock:
+            for month in months:
+                if month in self.loaded_segments or month not in self.sealed_months:
+                    continue
+                with phase('storage'):
+                    awards = await self.storage.load_segment(month)
+                for award in awards.values():
+                    self.sealed_awards[award['id']] = award
+                    self._index_resident(award)
+                self.feed.extend(map(self._feed_key, awards.values()))
+                self.feed.sort()
+                self.loaded_segments.add(month)
+
+    def _segments_holding(self, user_id):
+        # Sealed segments with awards to the user that are not loaded yet
+        return [month for month in self.user_segments.get(user_id, ()) if month not in self.loaded_segments]
+
+    def _get_award(self, award_id):
+        award = self.awards.get(award_id)
+        return award if award is not None else self.sealed_awards[award_id]
+
+    def _unindex_award(self, award):
+        # Awards of sealed segments that are not loaded are still counted;
+        # this happens on replicas, which never load them
+        month = award_month(award)
+        present = (self.awards.pop(award['id'], None) is not None
+                   or self.sealed_awards.pop(award['id'], None) is not None
+                   or (month in self.sealed_months and month not in self.loaded_segments))
+        if present:
+            key = self._feed_key(award)
+            position = bisect_left(self.feed, key)
+            if position < len(self.feed) and self.feed[position] == key:
+                del self.feed[position]
+            self._uncount_award(award)
+        for index, key in ((self.awards_by_user, award.get('user_id')),
+                           (self.awards_by_badge, award.get('badge_id'))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(award['id'], None)
+                if not bucket:
+                    del index[key]
+        if present:
+            self._unindex_holder(award)
+
+    def _unindex_holder(self, award):
+        # Fall back to the user's next earliest award of the badge, or drop
+        # them as a holder when this was their last one
+        user_id, badge_id = award.get('user_id'), award.get('badge_id')
+        holders = self.badge_holders.get(badge_id, {})
+        first = holders.get(user_id)
+        # Compared by id: holders taken from segment summaries are copies
+        if first is None or first['id'] != award['id']:
+            return
+        remaining = [other for other in self.awards_by_user.get(user_id, {}).values()
+                     if other.get('badge_id') == badge_id]
+        if remaining:
+            holders[user_id] = min(remaining, key=self._feed_key)
+            return
+        del holders[user_id]
+        if not holders:
+            del self.badge_holders[badge_id]
+        order = self.badge_holder_order.get(badge_id)
+        if order is not None and user_id in self.users:
+            self._sorted_remove(order, self._user_key(self.users[user_id]))
+            if not order:
+                del self.badge_holder_order[badge_id]
+
+    def _uncount_award(self, award):
+        user_id, badge_id = award.get('user_id'), award.get('badge_id')
+        if user_id is None or badge_id is None:
+            return
+        self._touch(('user', user_id), ('badge', badge_id))
+        self._decrement(self.badge_award_counts, badge_id)
+        held = self.user_badge_counts.get(user_id, {})
+        if self._decrement(held, badge_id) == 0:
+            self._decrement(self.badge_holder_counts, badge_id)
+            if not held:
+                self.user_badge_counts.pop(user_id, None)
+
+    @staticmethod
+    def _decrement(counts, key):
+        # Returns the new count; keys that reach zero are dropped
+        count = counts.get(key, 0) - 1
+        if count > 0:
+            counts[key] = count
+        else:
+            counts.pop(key, None)
+        return count
+
+    def _count_awards(self):
+        # The counters recomputed from the raw resident awards
+        award_counts, holder_counts, user_counts = {}, {}, {}
+        for award in chain(self.awards.values(), self.sealed_awards.values()):
+            user_id, badge_id = award.get('user_id'), award.get('badge_id')
+            if user_id is None or badge_id is None:
+                continue
+            award_counts[badge_id] = award_counts.get(badge_id, 0) + 1
+            held = user_counts.setdefault(user_id, {})
+            held[badge_id] = held.get(badge_id, 0) + 1
+        for held in user_counts.values():
+            for badge_id in held:
+                holder_counts[badge_id] = holder_counts.get(badge_id, 0) + 1
+        return award_counts, holder_counts, user_counts
+
+    @forwarded
+    async def check_consistency(self, repair=True):
+        # Rebuild the counters from the raw awards and report where the
+        # maintained ones drifted, plus awards pointing at missing records.
+        # Loads every sealed segment
+        await self._load_segments(sorted(self.sealed_months))
+        award_counts, holder_counts, user_counts = self._count_awards()
+        drift = {}
+        for name, live, rebuilt in (('badge_award_counts', self.badge_award_counts, award_counts),
+                                    ('badge_holder_counts', self.badge_holder_counts, holder_counts),
+                                    ('user_badge_counts', self.user_badge_counts, user_counts)):
+            keys = [key for key in live.keys() | rebuilt.keys() if live.get(key) != rebuilt.get(key)]
+            if keys:
+                drift[name] = {str(key): {'maintained': live.get(key), 'rebuilt': rebuilt.get(key)} for key in keys}
+        if drift and repair:
+            self.badge_award_counts = award_counts
+            self.badge_holder_counts = holder_counts
+            self.user_badge_counts = user_counts
+            self.generations['awards'] += 1
+            for name, counts in drift.items():
+                kind = 'user' if name == 'user_badge_counts' else 'badge'
+                self._touch(*((kind, key) for key in counts))
+
+        return {
+            'awards': len(self.awards) + len(self.sealed_awards),
+            'drift': drift,
+            'repaired': bool(drift) and repair,
+            'orphaned_awards': [
+                award['id'] for award in chain(self.awards.values(), self.sealed_awards.values())
+                if award.get('user_id') not in self.users or award.get('badge_id') not in self.badges
+            ]
+        }
 
     async def create_default_admin(self):
-        users = await self.read_json(self.users_file)
-        if not any(user.get('role') == 'admin' for user in users):
+        if not any(user.get('role') == 'admin' for user in self.users.values()):
             admin_user = {
                 'id': str(uuid.uuid4()),
                 'username': 'admin',
-                'password': pbkdf2_sha256.hash('admin_password'),
+                'password': await self.hasher.hash('admin_password'),
                 'role': 'admin',
                 'display_name': 'Administrator',
                 'email': 'admin@fpgabadges.com'
             }
-            users.append(admin_user)
-            await self.write_json(self.users_file, users)
+            self._index_user(admin_user)
+            self._record('user_created', user=self._public_user(admin_user))
+            await self._put('users', admin_user)
 
     async def create_default_badge(self):
-        badges = await self.read_json(self.badges_file)
-        if not badges:
+        if not self.badges:
             default_badge = {
                 'id': str(uuid.uuid4()),
                 'name': 'First FPGA Design',
                 'description': 'Completed first FPGA design project',
                 'icon': 'chip.svg'
             }
-            badges.append(default_badge)
-            await self.write_json(self.badges_file, badges)
+            self._add_badge(default_badge)
+            self._record('badge_created', badge=dict(default_badge))
+            await self._put('badges', default_badge)
+
+    def get_badges(self):
+        return list(self.badges.values())
+
+    def get_badge(self, badge_id):
+        return self.badges.get(badge_id)
+
+    def list_badges(self, limit, after=None):
+        # A page of badges in name order: (badges, total, next key)
+        keys, next_key = self._page(self.badge_order, after, limit)
+        return [self.badges[badge_id] for _, badge_id in keys], len(self.badge_order), next_key
+
+    def _ref_icon(self, icon, delta):
+        # Returns the icon's remaining reference count
+        if not icon:
+            return 0
+        count = self.icon_refs.get(icon, 0) + delta
+        if count > 0:
+            self.icon_refs[icon] = count
+        else:
+            self.icon_refs.pop(icon, None)
+        return count
+
+    @staticmethod
+    def _remove_image(icon_filename):
+        image_path = os.path.join('src', 'static', 'images', icon_filename)
+        try:
+            if os.path.exists(image_path):
+                os.remove(image_path)
+                print(f"Deleted badge image: {image_path}")
+        except Exception as e:
+            print(f"Error deleting badge image: {str(e)}")
 
+    def _add_badge(self, badge):
+        # Sorted first, as in _index_user
+        insort(self.badge_order, self._badge_key(badge))
+        self._touch(('badge', badge['id']))
+        self.badges[badge['id']] = badge
+        self._index_badge_search(badge)
+        self._ref_icon(badge.get('icon'), 1)
+
+    def _apply_badge_update(self, badge, update_data):
+        update = {k: v for k, v in update_data.items() if k != 'id'}
+        # The new key goes in before anything else changes, as in _index_user
+        insort(self.badge_order, self._badge_key({**badge, **update}))
+        self._sorted_remove(self.badge_order, self._badge_key(badge))
+        self._touch(('badge', badge['id']))
+        self._ref_icon(badge.get('icon'), -1)
+        badge.update(update)
+        self._index_badge_search(badge)
+        self._ref_icon(badge.get('icon'), 1)
+
+    def _remove_badge(self, badge):
+        # Returns the number of badges still using its icon
+        self._touch(('badge', badge['id']))
+        del self.badges[badge['id']]
+        self._sorted_remove(self.badge_order, self._badge_key(badge))
+        self.search_index.remove('badge', badge['id'])
+        return self._ref_icon(badge.get('icon'), -1)
+
+    @forwarded
     async def create_badge(self, badge_data):
-        badges = await self.read_json(self.badges_file)
         badge_data['id'] = str(uuid.uuid4())
-        badges.append(badge_data)
-        await self.write_json(self.badges_file, badges)
+        self._add_badge(badge_data)
+        self._record('badge_created', badge=dict(badge_data))
+        await self._put('badges', badge_data)
         return badge_data
 
+    @forwarded
     async def update_badge(self, badge_id, update_data):
-        badges = await self.read_json(self.badges_file)
-        for i, badge in enumerate(badges):
-            if badge['id'] == badge_id:
-                badges[i].update(update_data)
-                await self.write_json(self.badges_file, badges)
-                return True
-        return False
+        badge = self.badges.get(badge_id)
+        if badge is None:
+            return False
+        self._apply_badge_update(badge, update_data)
+        self._record('badge_updated', badge=dict(badge))
+        await self._put('badges', badge)
+        return True
 
+    @forwarded
     async def delete_badge(self, badge_id):
-        badges = await self.read_json(self.badges_file)
-        
-        # Find the badge to be deleted to get its icon filename
-        badge_to_delete = next((badge for badge in badges if badge['id'] == badge_id), None)
-        
-        if badge_to_delete and 'icon' in badge_to_delete:
-            # Check if this is a custom uploaded icon (not a default icon)
-            icon_filename = badge_to_delete['icon']
-            if icon_filename and not icon_filename in ['chip.svg', 'star.svg', 'pencil.svg', 'trash.svg']:
-                # Delete the associated image file
-                image_path = os.path.join('src', 'static', 'images', icon_filename)
-                try:
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                        print(f"Deleted badge image: {image_path}")
-                except Exception as e:
-                    print(f"Error deleting badge image: {str(e)}")
-        
-        # Remove badge from list and save
-        badges = [badge for badge in badges if badge['id'] != badge_id]
-        await self.write_json(self.badges_file, badges)
+        # Remove badge from the store and save
+        badge_to_delete = self.badges.get(badge_id)
+        if badge_to_delete is None:
+            return True
+        icon_users = self._remove_badge(badge_to_delete)
+        self._record('badge_deleted', badge={'id': badge_id})
+        await self._delete('badges', badge_to_delete)
+
+        # Delete a custom uploaded icon (not a default icon) once no other
+        # badge uses it
+        icon_filename = badge_to_delete.get('icon')
+        if (icon_users == 0 and icon_filename
+                and icon_filename not in ['chip.svg', 'star.svg', 'pencil.svg', 'trash.svg']):
+            await asyncio.get_running_loop().run_in_executor(None, self._remove_image, icon_filename)
         return True
 
+    # Resident awards only: awards in sealed segments are included once
+    # their segment is loaded
+    def get_awards_for_user(self, user_id):
+        return list(self.awards_by_user.get(user_id, {}).values())
+
+    def get_awards_for_badge(self, badge_id):
+        return list(self.awards_by_badge.get(badge_id, {}).values())
+
+    @forwarded
+    async def history_feed(self, before, limit):
+        # Feed pages that reach into sealed segments, which replicas leave
+        # to the writer rather than load
+        return await self.get_activity_feed(before, limit)
+
+    async def get_activity_feed(self, before=None, limit=10):
+        # Newest awards first, strictly older than the `before` feed key.
+        # Sealed segments are loaded, newest first, while one of them could
+        # still hold part of the page; replicas ask the writer for such pages
+        if before is not None:
+            before = tuple(before)  # a list when it comes from a replica
+        while True:
+            end = bisect_left(self.feed, before) if before is not None else len(self.feed)
+            keys = self.feed[max(end - limit, 0):end]
+            oldest = keys[0][0][:7] if len(keys) == limit else ''
+            wanted = [month for month in self.sealed_months if month not in self.loaded_segments
+                      and month >= oldest and (before is None or month <= before[0][:7])]
+            if not wanted:
+                break
+            if self.writer is not None:
+                return await self.history_feed(before, limit)
+            await self._load_segments([max(wanted)])
+
+        page = []
+        with phase('join'):
+            for awarded_at, award_id in reversed(keys):
+                award = self._get_award(award_id)
+                user = self.users.get(award['user_id'], {'username': 'Unknown'})
+                badge = self.badges.get(award['badge_id'], {'name': 'Unknown Badge'})
+                page.append({
+                    'user': user['username'],
+                    'badge': badge['name'],
+                    'date': awarded_at or 'Unknown Date',
+                    'award_id': award_id,
+                    'user_id': award['user_id'],
+                    'badge_id': award['badge_id'],
+                    'icon': badge.get('icon', ''),
+                    'cursor': f'{awarded_at}|{award_id}'
+                })
+        return page
+
+    def search(self, query, kinds=('user', 'badge'), include_email=False, limit=10, cursor=None):
+        # Ranked matches as public records tagged with their type. Email
+        # addresses are only matched and returned for admins
+        fields = {}
+        if 'user' in kinds:
+            fields['user'] = ['username', 'display_name'] + (['email'] if include_email else [])
+        if 'badge' in kinds:
+            fields['badge'] = ['name', 'description']
+        matches, next_cursor = self.search_index.search(query, fields, limit, cursor)
+
+        results = []
+        for kind, doc_id in matches:
+            if kind == 'user':
+                user = self.users[doc_id]
+                result = {'type': 'user', **self._public_user(user)}
+                if include_email:
+                    result['email'] = user.get('email', '')
+            else:
+                badge = self.badges[doc_id]
+                result = {
+                    'type': 'badge',
+                    'id': doc_id,
+                    'name': badge.get('name', ''),
+                    'description': badge.get('description', ''),
+                    'icon': badge.get('icon', '')
+                }
+            results.append(result)
+        return results, next_cursor
+
+    @forwarded
     async def award_badge(self, user_id, badge_id, awarded_by=None):
-        awards = await self.read_json(self.awards_file)
         award = {
             'id': str(uuid.uuid4()),
             'user_id': user_id,
@@ -115,100 +831,337 @@ class DataManager:
             'awarded_at': datetime.now(timezone.utc).isoformat(),
             'awarded_by': awarded_by  # Store the ID of the user who awarded the badge
         }
-        awards.append(award)
-        await self.write_json(self.awards_file, awards)
+        self._index_award(award)
+        self._record('badge_awarded', badge=self._award_payload(award))
+        await self._put('awards', award)
         return award
 
+    @forwarded
+    async def award_badges(self, pairs, awarded_by=None):
+        # Award many (user_id, badge_id) pairs with one journal write and one
+        # event. Callers validate the pairs first
+        awarded_at = datetime.now(timezone.utc).isoformat()
+        awards = []
+        for user_id, badge_id in pairs:
+            award = {
+                'id': str(uuid.uuid4()),
+                'user_id': user_id,
+                'badge_id': badge_id,
+                'awarded_at': awarded_at,
+                'awarded_by': awarded_by
+            }
+            self._index_award(award)
+            awards.append(award)
+        if awards:
+            self._record('badges_awarded', badges=[self._award_payload(award) for award in awards])
+            await self._put('awards', *awards)
+        return awards
+
+    @forwarded
+    async def remove_badges_from_users(self, pairs):
+        # Revoke many (user_id, badge_id) pairs with one journal write and one
+        # event. Returns the revoked awards for each pair, in order
+        await self._load_segments({month for user_id, _ in pairs for month in self._segments_holding(user_id)})
+        results = []
+        removed = []
+        for user_id, badge_id in pairs:
+            revoked = [award for award in self.get_awards_for_user(user_id) if award['badge_id'] == badge_id]
+            for award in revoked:
+                self._unindex_award(award)
+            if revoked:
+                removed.append({'id': badge_id, 'user_id': user_id, 'count': len(revoked)})
+            results.append(revoked)
+        if removed:
+            self._record('badges_removed', badges=removed)
+            await self._delete('awards', *(award for revoked in results for award in revoked))
+        return results
+
+    @forwarded
     async def remove_badge_from_user(self, user_id, badge_id):
-        awards = await self.read_json(self.awards_file)
-        awards = [award for award in awards if not (award['user_id'] == user_id and award['badge_id'] == badge_id)]
-        await self.write_json(self.awards_file, awards)
-        return True
+        # Returns the revoked awards
+        await self._load_segments(self._segments_holding(user_id))
+        revoked = [award for award in self.get_awards_for_user(user_id) if award['badge_id'] == badge_id]
+        for award in revoked:
+            self._unindex_award(award)
+        if revoked:
+            self._record('badge_removed', badge={'id': badge_id, 'user_id': user_id, 'count': len(revoked)})
+            await self._delete('awards', *revoked)
+        return revoked
 
-    async def get_user_badges(self, user_id):
-        awards = await self.read_json(self.awards_file)
-        badges = await self.read_json(self.badges_file)
-        
-        # Count how many times each badge has been awarded to the user
-        badge_counts = {}
-        for award in awards:
-            if award['user_id'] == user_id:
-                badge_id = award['badge_id']
-                badge_counts[badge_id] = badge_counts.get(badge_id, 0) + 1
-        
-        # Get unique badge IDs awarded to this user
-        user_badge_ids = list(badge_counts.keys())
-        
-        # Create badges with count information
-        user_badges = []
-        for badge in badges:
-            if badge['id'] in user_badge_ids:
-                # Create a copy of the badge with count added
-                badge_with_count = badge.copy()
-                badge_with_count['count'] = badge_counts[badge['id']]
-                user_badges.append(badge_with_count)
-        
-        return user_badges
+    def list_user_badges(self, user_id, limit, after=None):
+        # A page of the user's badges in name order, as (badge, times
+        # awarded) pairs: (pairs, total, next key)
+        badge_counts = self.user_badge_counts.get(user_id, {})
+        order = sorted(self._badge_key(self.badges[badge_id]) for badge_id in badge_counts if badge_id in self.badges)
+        keys, next_key = self._page(order, after, limit)
+        return [(self.badges[badge_id], badge_counts[badge_id]) for _, badge_id in keys], len(order), next_key
+
+    def list_badge_holders(self, badge_id, limit, after=None):
+        # A page of the badge's holders in username order, as (user, their
+        # first award of the badge) pairs: (pairs, total, next key)
+        order = self.badge_holder_order.get(badge_id, [])
+        keys, next_key = self._page(order, after, limit)
+        holders = self.badge_holders.get(badge_id, {})
+        return [(self.users[user_id], holders[user_id]) for _, user_id in keys], len(order), next_key
 
     async def authenticate_user(self, username, password):
-        users = await self.read_json(self.users_file)
-        for user in users:
-            if user['username'] == username and pbkdf2_sha256.verify(password, user['password']):
-                return user
+        user = self.users_by_username.get(username)
+        if user and await self.hasher.verify(password, user['password']):
+            return user
         return None
 
+    def get_users(self):
+        return list(self.users.values())
+
+    def list_users(self, limit, after=None):
+        # A page of users in username order: (users, total, next key)
+        keys, next_key = self._page(self.user_order, after, limit)
+        return [self.users[user_id] for _, user_id in keys], len(self.user_order), next_key
+
     async def get_user_by_id(self, user_id):
-        users = await self.read_json(self.users_file)
-        return next((user for user in users if user['id'] == user_id), None)
+        return self.users.get(user_id)
+
+    def get_user_by_username(self, username):
+        return self.users_by_username.get(username)
+
+    @forwarded
+    async def create_user(self, user_data):
+        # Returns None when the username is taken. Checked here, on the
+        # writer, because callers check before awaiting the password hash
+        if user_data['username'] in self.users_by_username:
+            return None
+        user_data['id'] = str(uuid.uuid4())
+        self._index_user(user_data)
+        self._record('user_created', user=self._public_user(user_data))
+        await self._put('users', user_data)
+        return user_data
 
+    @forwarded
     async def update_user(self, user_id, update_data):
-        users = await self.read_json(self.users_file)
-        for i, user in enumerate(users):
-            if user['id'] == user_id:
-                users[i].update(update_data)
-                await self.write_json(self.users_file, users)
-                return True
-        return False
+        user = self.users.get(user_id)
+        if user is None:
+            return False
+        self._apply_user_update(user, update_data)
+        self._record('user_updated', user=self._public_user(user))
+        await self._put('users', user)
+        return True
+
+    def _apply_user_update(self, user, update_data):
+        user_id = user['id']
+        old_username = user['username']
+        old_display_name = user.get('display_name')
+        user.update({k: v for k, v in update_data.items() if k != 'id'})
+        self._touch(('user', user_id))
+        if user['username'] != old_username or user.get('display_name') != old_display_name:
+            # Badge details list holders and awarders by name
+            self._touch(*(('badge', badge_id) for badge_id in self.user_badge_counts.get(user_id, ())))
+            self._touch_awarder(user_id)
+        if user['username'] != old_username:
+            # Keep the username index and listing order pointing at the renamed user
+            if self.users_by_username.get(old_username) is user:
+                del self.users_by_username[old_username]
+            self.users_by_username[user['username']] = user
+            self._sorted_remove(self.user_order, (old_username, user['id']))
+            insort(self.user_order, self._user_key(user))
+            for badge_id in self.user_badge_counts.get(user_id, {}):
+                order = self.badge_holder_order.get(badge_id)
+                if order is not None:
+                    self._sorted_remove(order, (old_username, user['id']))
+                    insort(order, self._user_key(user))
+        self._index_user_search(user)
+
+    @forwarded
+    async def delete_user(self, user_id):
+        await self._load_segments(self._segments_holding(user_id))
+        user = self.users.get(user_id)
+        if user is None:
+            return False
+        awards = self._remove_user(user)
+        self._record('user_deleted', user={'id': user_id})
+
+        # Awards first, so that nothing is left pointing at a deleted user
+        if awards:
+            await self._delete('awards', *awards)
+        await self._delete('users', user)
+        return True
+
+    def _remove_user(self, user):
+        # Also remove user's badge awards, before the user, whose name
+        # locates them in the holder lists. Returns the removed awards
+        awards = self.get_awards_for_user(user['id'])
+        for award in awards:
+            self._unindex_award(award)
+        self._unindex_user(user)
+        return awards
 
 # WebSocket Manager for Real-time Updates
+class ClientConnection:
+    def __init__(self, ws, queue_size):
+        self.ws = ws
+        # Pre-encoded messages waiting for this client's writer task
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.writer = None
+        self.dropped = 0
+        self.topics = set()
+
+    async def write_messages(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                await self.ws.send_str(data)
+        except (ConnectionResetError, RuntimeError) as e:
+            # RuntimeError is raised when sending on a closing socket
+            print(f'WebSocket send failed: {e}')
+            await self.ws.close()
+
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections = set()
+    # Clients subscribe to 'feed' (every award), 'user:{id}' (awards to one
+    # user) or 'badge:{id}' (awards of one badge)
+    topic_prefixes = ('user:', 'badge:')
+    max_topics_per_connection = 100
+
+    def __init__(self, queue_size=100, slow_consumer='drop_oldest', event_log=None):
+        self.active_connections = {}  # ws -> ClientConnection
+        # Anything with events_since(since, epoch), used to answer 'resume'
+        self.event_log = event_log
+        self.subscribers = {}  # topic -> set of ClientConnection
+        self.queue_size = queue_size
+        # What to do when a client's queue is full: 'drop_oldest' discards
+        # its oldest pending message, 'disconnect' closes the socket
+        if slow_consumer not in ('drop_oldest', 'disconnect'):
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer}")
+        self.slow_consumer = slow_consumer
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.slow_disconnects = 0
 
     async def websocket_handler(self, request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
 
-        self.active_connections.add(ws)
+        connection = ClientConnection(ws, self.queue_size)
+        connection.writer = asyncio.create_task(connection.write_messages())
+        self.active_connections[ws] = connection
 
         try:
             async for msg in ws:
-                if msg.type == aiohttp.WSMsgType.TEXT:
+                if msg.type == WSMsgType.TEXT:
                     # Handle incoming WebSocket messages
                     try:
-                        data = json.loads(msg.data)
-                        # Implement message handling logic here
-                        print(f'Received WebSocket message: {data}')
-                    except json.JSONDecodeError:
+                        data = loads(msg.data)
+                    except JSONDecodeError:
                         print('Invalid JSON received')
-                elif msg.type == aiohttp.WSMsgType.ERROR:
+                        continue
+                    self.handle_message(connection, data)
+                elif msg.type == WSMsgType.ERROR:
                     print('WebSocket connection closed with exception %s' % ws.exception())
                     break
         except Exception as e:
             print(f'WebSocket error: {e}')
         finally:
-            if ws in self.active_connections:
-                self.active_connections.remove(ws)
+            self._drop(connection)
             await ws.close()
 
         return ws
 
+    def handle_message(self, connection, data):
+        if not isinstance(data, dict):
+            return
+        message_type = data.get('type')
+        if message_type == 'resume' and self.event_log is not None:
+            since = data.get('since')
+            if not isinstance(since, int):
+                since = -1  # No usable cursor, so force a resync
+            self._reply(connection, {'type': 'events', **self.event_log.events_since(since, data.get('epoch'))})
+            return
+
+        topics = data.get('topics')
+        if message_type not in ('subscribe', 'unsubscribe') or not isinstance(topics, list):
+            self._reply(connection, {'type': 'error', 'message': 'Unknown message'})
+            return
+
+        topics = [topic for topic in topics if self.valid_topic(topic)]
+        if message_type == 'subscribe':
+            room = self.max_topics_per_connection - len(connection.topics)
+            for topic in [t for t in topics if t not in connection.topics][:max(room, 0)]:
+                connection.topics.add(topic)
+                self.subscribers.setdefault(topic, set()).add(connection)
+        else:
+            for topic in topics:
+                self._unsubscribe(connection, topic)
+        self._reply(connection, {'type': 'subscriptions', 'topics': sorted(connection.topics)})
+
+    def valid_topic(self, topic):
+        if not isinstance(topic, str):
+            return False
+        return topic == 'feed' or any(
+            topic.startswith(prefix) and len(topic) > len(prefix) for prefix in self.topic_prefixes
+        )
+
+    def _unsubscribe(self, connection, topic):
+        connection.topics.discard(topic)
+        subscribers = self.subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.subscribers[topic]
+
+    def _drop(self, connection):
+        self.active_connections.pop(connection.ws, None)
+        for topic in list(connection.topics):
+            self._unsubscribe(connection, topic)
+        connection.writer.cancel()
+
+    def _reply(self, connection, message):
+        self._enqueue(connection, dumps_str(message))
+
+    def publish(self, message, topics):
+        # Encode once, then hand the same string to the queue of every client
+        # subscribed to any of the topics. Never awaits, so one slow client
+        # cannot hold up the others
+        targets = set()
+        for topic in topics:
+            targets.update(self.subscribers.get(topic, ()))
+        if not targets:
+            return
+        data = dumps_str(message)
+        for connection in targets:
+            self._enqueue(connection, data)
+        self.messages_sent += 1
+
+    def _enqueue(self, connection, data):
+        try:
+            connection.queue.put_nowait(data)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.slow_consumer == 'disconnect':
+            self.slow_disconnects += 1
+            self._drop(connection)
+            asyncio.create_task(connection.ws.close(message=b'Client too slow'))
+        else:
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(data)
+        connection.dropped += 1
+        self.messages_dropped += 1
+
     async def broadcast(self, message):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f'Error broadcasting message: {e}')
+        self.publish(message, ['feed'])
+
+    def stats(self):
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {
+            'connections': len(depths),
+            'topics': len(self.subscribers),
+            'queue_size': self.queue_size,
+            'slow_consumer': self.slow_consumer,
+            'max_queue_depth': max(depths, default=0),
+            'queued_messages': sum(depths),
+            'messages_sent': self.messages_sent,
+            'messages_dropped': self.messages_dropped,
+            'slow_disconnects': self.slow_disconnects,
+        }
 
 # Main Application
 class BadgeTrackingApp:
@@ -247,407 +1200,957 @@ async def main():
 
     return app
 
-async def init_app():
-    app = web.Application()
-    aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader('src/templates'))
+def create_storage(data_dir):
+    # Pick the persistence backend from the environment
+    backend = os.environ.get('BADGE_STORAGE', 'json')
+    if backend == 'sqlite':
+        return SqliteStorage(os.environ.get('BADGE_SQLITE_PATH', os.path.join(data_dir, 'badges.db')))
+    if backend != 'json':
+        raise ValueError(f"Unknown BADGE_STORAGE backend: {backend}")
+    return JsonStorage(
+        data_dir,
+        commit_window=float(os.environ.get('BADGE_COMMIT_WINDOW_MS', '2')) / 1000,
+        pretty=os.environ.get('BADGE_PRETTY_JSON') == '1'
+    )
+
+def create_admission(hash_workers):
+    # Limits for the routes that cost the most per request, by group. Groups
+    # in BADGE_ADMISSION (JSON) override these setting by setting, null
+    # turns a group off, and BADGE_ADMISSION=off turns them all off
+    groups = {
+        # pbkdf2 on the password hasher pool
+        'passwords': {
+            'routes': ['POST /login', 'POST /register', 'POST /admin/users/{user_id}/reset-password'],
+            'rate': hash_workers * 25, 'burst': hash_workers * 50,
+            'client_rate': 1, 'client_burst': 10,
+            'concurrency': hash_workers * 2, 'queue': hash_workers * 8, 'queue_timeout': 2.0,
+        },
+        # Streamed to disk, but each holds a file open until it completes
+        'uploads': {
+            'routes': ['POST /upload/badge-image'],
+            'rate': 10, 'burst': 20,
+            'client_rate': 0.5, 'client_burst': 5,
+            'concurrency': 4, 'queue': 8,
+        },
+        # Journal writes and WebSocket broadcasts
+        'awards': {
+            'routes': ['POST /badges/award', 'POST /badges/award/bulk',
+                       'POST /badges/remove', 'POST /badges/remove/bulk'],
+            'rate': 500, 'burst': 1000,
+            'client_rate': 20, 'client_burst': 100,
+            'concurrency': 32, 'queue': 128,
+        },
+    }
+    setting = os.environ.get('BADGE_ADMISSION')
+    if setting == 'off':
+        return Admission({})
+    for name, overrides in (loads(setting) if setting else {}).items():
+        if overrides is None or name not in groups:
+            groups[name] = overrides
+        elif groups[name] is not None:
+            groups[name].update(overrides)
+    return Admission(groups)
+
+async def init_app(writer_socket=None):
+    # With writer_socket, this is a worker of --workers mode: its data is a
+    # replica of the writer process's, and writes go to the writer
+    # Session tokens; set BADGE_SECRET_KEY so sessions survive restarts
+    tokens = TokenManager(
+        secret=os.environ.get('BADGE_SECRET_KEY'),
+        ttl=int(os.environ.get('BADGE_TOKEN_TTL', '3600'))
+    )
+
+    # Request, latency and event-loop lag metrics, exposed at /metrics
+    metrics = Metrics(lag_interval=float(os.environ.get('BADGE_LOOP_LAG_INTERVAL_MS', '500')) / 1000)
+
+    # Opt-in profiling (X-Profile from admins, or a sampled share of
+    # requests) and the slow-request log, both written to BADGE_PROFILE_DIR
+    profiler = Profiler(
+        os.environ.get('BADGE_PROFILE_DIR', os.path.join('src', 'data', 'profiles')),
+        sample_rate=float(os.environ.get('BADGE_PROFILE_SAMPLE_RATE', '0')),
+        keep=int(os.environ.get('BADGE_PROFILE_KEEP', '50')),
+        slow_threshold=float(os.environ.get('BADGE_SLOW_REQUEST_MS', '500')) / 1000,
+        trace_memory=os.environ.get('BADGE_SLOW_REQUEST_TRACEMALLOC') == '1'
+    )
+
+    hasher = PasswordHasher(
+        workers=int(os.environ.get('BADGE_HASH_WORKERS', '0')) or None,
+        max_pending=int(os.environ.get('BADGE_HASH_MAX_PENDING', '64'))
+    )
+
+    # Rate and concurrency limits on the expensive routes; requests over
+    # them get 429 with Retry-After, so reads keep their latency
+    admission = create_admission(hasher.workers)
+
+    app = web.Application(middlewares=[
+        metrics_middleware(metrics), auth_middleware(tokens),
+        admission_middleware(admission), profiling_middleware(profiler)
+    ])
+    app.on_startup.append(metrics.start)
+    app.on_cleanup.append(metrics.stop)
+    app.on_startup.append(profiler.start)
+    app.on_cleanup.append(profiler.stop)
 
     # Initialize data manager
-    data_manager = DataManager('src/data')
-    await data_manager.create_default_admin()
-    await data_manager.create_default_badge()
+    data_manager = DataManager(
+        create_storage('src/data') if writer_socket is None else None, hasher,
+        event_ring_size=int(os.environ.get('BADGE_EVENT_RING_SIZE', '10000'))
+    )
+    if writer_socket is None:
+        writer_client = None
+        await data_manager.load()
+        await data_manager.create_default_admin()
+        await data_manager.create_default_badge()
+    else:
+        writer_client = WriterClient(data_manager, writer_socket)
+        await writer_client.connect()
+
+    async def close_data_manager(app):
+        if writer_client is not None:
+            await writer_client.close()
+        await data_manager.close()
+        hasher.close()
+    app.on_cleanup.append(close_data_manager)
 
     # WebSocket Manager
-    ws_manager = WebSocketManager()
+    ws_manager = WebSocketManager(
+        queue_size=int(os.environ.get('BADGE_WS_QUEUE_SIZE', '100')),
+        slow_consumer=os.environ.get('BADGE_WS_SLOW_CONSUMER', 'drop_oldest'),
+        event_log=data_manager
+    )
 
-    # Static routes
-    app.router.add_static('/static/', path='src/static', name='static')
+    def publish_event(event):
+        # Push award changes to the sockets subscribed to their topics. A bulk
+        # change goes out once, to everyone subscribed to any of its topics
+        if event['type'] in ('badge_awarded', 'badge_removed'):
+            badges = [event['badge']]
+        elif event['type'] in ('badges_awarded', 'badges_removed'):
+            badges = event['badges']
+        else:
+            return
+        topics = {'feed'}
+        for badge in badges:
+            topics.update((f"user:{badge['user_id']}", f"badge:{badge['id']}"))
+        ws_manager.publish(event, topics)
+    data_manager.listeners.append(publish_event)
+
+    # Cached bodies for the public read routes, invalidated by generation
+    response_cache = ResponseCache(max_entries=int(os.environ.get('BADGE_RESPONSE_CACHE_SIZE', '512')))
+
+    # Static routes - pages and assets served from memory
+    static_assets = StaticAssets('src/static', 'src/templates', dev=os.environ.get('BADGE_DEV') == '1')
+    await static_assets.load()
+    app.router.add_get('/static/{path:.+}', static_assets.handle_static, name='static')
 
     # WebSocket route
     app.router.add_get('/ws', ws_manager.websocket_handler)
 
-    # Home route
-    async def home(request):
-        return aiohttp_jinja2.render_template('index.html', request, {})
-    app.router.add_get('/', home)
+    # Storage stats route - journal group-commit batch sizes and latencies
+    async def get_storage_stats(request):
+        return json_response(await data_manager.storage_stats())
+    app.router.add_get('/admin/storage-stats', admin_required(get_storage_stats))
+
+    # Password hasher stats route - pool size, queue depth and rejections
+    async def get_hasher_stats(request):
+        return json_response(hasher.stats())
+    app.router.add_get('/admin/hasher-stats', admin_required(get_hasher_stats))
+
+    # Consistency check route - rebuilds the award counters and reports drift
+    async def get_consistency_check(request):
+        return json_response(await data_manager.check_consistency())
+    app.router.add_get('/admin/consistency-check', admin_required(get_consistency_check))
+
+    # Response cache stats route - entries, hits, misses and 304s
+    async def get_cache_stats(request):
+        return json_response(response_cache.stats())
+    app.router.add_get('/admin/cache-stats', admin_required(get_cache_stats))
+
+    # WebSocket stats route - connections, queue depths and dropped messages
+    async def get_ws_stats(request):
+        return json_response(ws_manager.stats())
+    app.router.add_get('/admin/ws-stats', admin_required(get_ws_stats))
+
+    # Admission stats route - requests admitted, queued and turned away per
+    # group of limited routes
+    async def get_admission_stats(request):
+        return json_response(admission.stats())
+    app.router.add_get('/admin/admission-stats', admin_required(get_admission_stats))
+
+    # Slow-request log route - the latest requests over BADGE_SLOW_REQUEST_MS
+    # with their phase breakdown, newest first, and profiling settings
+    async def get_slow_requests(request):
+        return json_response(profiler.stats())
+    app.router.add_get('/admin/slow-requests', admin_required(get_slow_requests))
+
+    # Prometheus metrics route - the counters above plus request latencies,
+    # event-loop lag and storage and password hashing timings. Not behind a
+    # login, so scrapers need no token; nothing in it identifies a user
+    async def get_metrics(request):
+        out = Exposition()
+        metrics.expose(out)
+
+        storage = await data_manager.storage_stats()
+        out.histogram('storage_io_duration_seconds', 'Storage file and database operation latency',
+                      [({'op': op}, timing) for op, timing in storage['io'].items()])
+        out.counter('storage_io_bytes_total', 'Bytes read and written by storage operation',
+                    [({'op': op}, timing['bytes']) for op, timing in storage['io'].items()])
+        journals = [(name, stats) for name, stats in storage.items() if name in ('users', 'badges', 'awards')]
+        if journals:
+            out.counter('journal_batches_total', 'Journal group commits',
+                        [({'collection': name}, stats['batches']) for name, stats in journals])
+            out.counter('journal_events_total', 'Mutations written to the journal',
+                        [({'collection': name}, stats['events']) for name, stats in journals])
+            out.gauge('journal_bytes', 'Journal size since the last compaction',
+                      [({'collection': name}, stats['journal_bytes']) for name, stats in journals])
+        if 'segments' in storage:
+            out.gauge('award_segments', 'Sealed monthly award segments',
+                      [({'state': state}, count) for state, count in storage['segments'].items()])
+        out.gauge('records', 'Resident records',
+                  [({'collection': 'users'}, len(data_manager.users)),
+                   ({'collection': 'badges'}, len(data_manager.badges)),
+                   ({'collection': 'awards'}, len(data_manager.awards) + len(data_manager.sealed_awards))])
+
+        hashing = hasher.stats()
+        out.histogram('password_duration_seconds', 'Password hash and verify latency, queueing included',
+                      [({'op': op}, timing) for op, timing in hashing['timings'].items()])
+        out.gauge('password_pending', 'Password operations queued or running', [({}, hashing['pending'])])
+        out.counter('password_rejected_total', 'Password operations turned away as busy', [({}, hashing['rejected'])])
+
+        ws = ws_manager.stats()
+        out.gauge('ws_connections', 'Open WebSocket connections', [({}, ws['connections'])])
+        out.gauge('ws_queued_messages', 'Messages queued across all WebSocket connections',
+                  [({}, ws['queued_messages'])])
+        out.gauge('ws_max_queue_depth', 'Deepest WebSocket send queue', [({}, ws['max_queue_depth'])])
+        out.counter('ws_messages_sent_total', 'WebSocket messages sent', [({}, ws['messages_sent'])])
+        out.counter('ws_messages_dropped_total', 'WebSocket messages dropped for slow consumers',
+                    [({}, ws['messages_dropped'])])
+        out.counter('ws_slow_disconnects_total', 'WebSocket connections closed as too slow',
+                    [({}, ws['slow_disconnects'])])
+
+        groups = admission.stats().items()
+        out.counter('admission_admitted_total', 'Requests admitted to limited routes',
+                    [({'group': name}, stats['admitted']) for name, stats in groups])
+        out.counter('admission_rejected_total', 'Requests turned away with 429 by limit',
+                    [({'group': name, 'reason': reason}, count)
+                     for name, stats in groups for reason, count in stats['rejected'].items()])
+        out.gauge('admission_active', 'Requests running on limited routes',
+                  [({'group': name}, stats['active']) for name, stats in groups])
+        out.gauge('admission_waiting', 'Requests queued for a slot on limited routes',
+                  [({'group': name}, stats['waiting']) for name, stats in groups])
+
+        cache = response_cache.stats()
+        out.gauge('response_cache_entries', 'Cached responses', [({}, cache['entries'])])
+        out.counter('response_cache_hits_total', 'Cacheable requests served from the cache', [({}, cache['hits'])])
+        out.counter('response_cache_misses_total', 'Cacheable requests that built a response',
+                    [({}, cache['misses'])])
+        out.counter('response_cache_not_modified_total', 'Cacheable requests answered 304 Not Modified',
+                    [({}, cache['not_modified'])])
+        return web.Response(body=out.render().encode('utf-8'), headers={'Content-Type': Exposition.content_type})
+    app.router.add_get('/metrics', get_metrics)
+
+    async def read_json(request):
+        # The decoded body, or None when it is not valid JSON. Both codec
+        # backends raise ValueError subclasses; JSONDecodeError is the
+        # codec's own, named for clarity
+        try:
+            return await request.json(loads=loads)
+        except (ValueError, JSONDecodeError):
+            return None
+
+    def json_object_required():
+        return json_response({'success': False, 'message': 'JSON object required'}, status=400)
+
+    # List routes share one contract: ?limit=N (default 100, max 1000),
+    # ?cursor=<next_cursor from the previous page> and ?fields=a,b to pick
+    # fields ('id' is always included). Responses are
+    # {items, total, next_cursor}; only the requested page and fields are built
+    def read_list_params(request, getters):
+        # Returns (limit, after key, field getters) or raises ValueError
+        with phase('parse'):
+            try:
+                limit = min(max(int(request.query.get('limit', '100')), 1), 1000)
+            except ValueError:
+                raise ValueError('limit must be an integer')
+            cursor = request.query.get('cursor')
+            after = decode_cursor(cursor, (str, str)) if cursor else None
+            fields = request.query.get('fields')
+            if fields is None:
+                return limit, after, getters
+            names = ['id'] + [name for name in fields.split(',') if name and name != 'id']
+            unknown = [name for name in names if name not in getters]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+            return limit, after, {name: getters[name] for name in names}
+
+    def list_response(request, getters, fetch):
+        # fetch(limit, after) -> (records, total, next key)
+        try:
+            limit, after, getters = read_list_params(request, getters)
+        except ValueError as e:
+            return json_response({'success': False, 'message': str(e)}, status=400)
+        with phase('join'):
+            records, total, next_key = fetch(limit, after)
+            page = {
+                'items': [{name: get(record) for name, get in getters.items()} for record in records],
+                'total': total,
+                'next_cursor': encode_cursor(next_key) if next_key else None
+            }
+        return json_response(page)
+
+    # Public user fields; passwords and emails are never listed here
+    user_fields = {
+        'id': lambda user: user['id'],
+        'username': lambda user: user['username'],
+        'display_name': lambda user: user.get('display_name', user['username'])
+    }
+    admin_user_fields = {
+        **user_fields,
+        'email': lambda user: user.get('email', ''),
+        'role': lambda user: user.get('role', 'user')
+    }
+    badge_fields = {
+        'id': lambda badge: badge['id'],
+        'name': lambda badge: badge.get('name', ''),
+        'description': lambda badge: badge.get('description', ''),
+        'icon': lambda badge: badge.get('icon', ''),
+        'count': lambda badge: data_manager.badge_award_counts.get(badge['id'], 0),
+        'holder_count': lambda badge: data_manager.badge_holder_counts.get(badge['id'], 0)
+    }
+    # Same fields for a (badge, times awarded to the user) pair
+    user_badge_fields = {name: (lambda pair, get=get: get(pair[0])) for name, get in badge_fields.items()}
+    user_badge_fields['count'] = lambda pair: pair[1]
 
     # Users route
     async def get_users(request):
-        users = await data_manager.read_json(data_manager.users_file)
-        # Remove sensitive information like passwords
-        sanitized_users = [{'id': user['id'], 'username': user['username'], 'display_name': user.get('display_name', user['username'])} for user in users]
-        return web.json_response(sanitized_users)
-    app.router.add_get('/users', get_users)
+        return list_response(request, user_fields, data_manager.list_users)
+    app.router.add_get('/users', cached(response_cache, lambda request: data_manager.generation('users'))(get_users))
     
     # Admin users route - returns all user details including roles
     async def get_admin_users(request):
-        users = await data_manager.read_json(data_manager.users_file)
         # Remove passwords but include other admin fields
-        admin_users = [{
-            'id': user['id'], 
-            'username': user['username'],
-            'display_name': user.get('display_name', user['username']),
-            'email': user.get('email', ''),
-            'role': user.get('role', 'user')
-        } for user in users]
-        return web.json_response(admin_users)
-    app.router.add_get('/admin/users', get_admin_users)
+        return list_response(request, admin_user_fields, data_manager.list_users)
+    app.router.add_get('/admin/users', admin_required(get_admin_users))
     
     # Admin reset user password
     async def reset_user_password(request):
         user_id = request.match_info['user_id']
         try:
-            data = await request.json()
+            data = await read_json(request)
+            if not isinstance(data, dict):
+                return json_object_required()
             new_password = data.get('password')
             if not new_password:
-                return web.json_response({'success': False, 'message': 'Password is required'}, status=400)
+                return json_response({'success': False, 'message': 'Password is required'}, status=400)
+            if not isinstance(new_password, str):
+                return json_response({'success': False, 'message': 'Password must be a string'}, status=400)
                 
-            users = await data_manager.read_json(data_manager.users_file)
-            user_index = next((i for i, u in enumerate(users) if u['id'] == user_id), None)
-            
-            if user_index is None:
-                return web.json_response({'success': False, 'message': 'User not found'}, status=404)
+            if await data_manager.get_user_by_id(user_id) is None:
+                return json_response({'success': False, 'message': 'User not found'}, status=404)
                 
             # Update user's password
-            users[user_index]['password'] = pbkdf2_sha256.hash(new_password)
-            await data_manager.write_json(data_manager.users_file, users)
+            await data_manager.update_user(user_id, {'password': await hasher.hash(new_password)})
             
-            return web.json_response({'success': True, 'message': 'Password updated successfully'})
+            return json_response({'success': True, 'message': 'Password updated successfully'})
+        except PasswordHasherBusy:
+            return json_response({'success': False, 'message': 'Server busy, please retry'}, status=503, headers={'Retry-After': '1'})
         except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
-    app.router.add_post('/admin/users/{user_id}/reset-password', reset_user_password)
+            return json_response({'success': False, 'message': str(e)}, status=500)
+    app.router.add_post('/admin/users/{user_id}/reset-password', admin_required(reset_user_password))
     
     # Admin remove user
     async def remove_user(request):
         user_id = request.match_info['user_id']
         try:
-            users = await data_manager.read_json(data_manager.users_file)
-            
             # Check if user is admin, don't allow removing admins
-            user = next((u for u in users if u['id'] == user_id), None)
+            user = await data_manager.get_user_by_id(user_id)
             if not user:
-                return web.json_response({'success': False, 'message': 'User not found'}, status=404)
+                return json_response({'success': False, 'message': 'User not found'}, status=404)
                 
             if user.get('role') == 'admin':
-                return web.json_response({'success': False, 'message': 'Cannot remove administrator accounts'}, status=400)
+                return json_response({'success': False, 'message': 'Cannot remove administrator accounts'}, status=400)
             
-            # Remove user from the users list
-            users = [u for u in users if u['id'] != user_id]
-            await data_manager.write_json(data_manager.users_file, users)
+            # Remove user and their badge awards
+            await data_manager.delete_user(user_id)
             
-            # Also remove user's badge awards
-            awards = await data_manager.read_json(data_manager.awards_file)
-            awards = [a for a in awards if a.get('user_id') != user_id]
-            await data_manager.write_json(data_manager.awards_file, awards)
-            
-            return web.json_response({'success': True, 'message': 'User removed successfully'})
+            return json_response({'success': True, 'message': 'User removed successfully'})
         except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
-    app.router.add_delete('/admin/users/{user_id}', remove_user)
+            return json_response({'success': False, 'message': str(e)}, status=500)
+    app.router.add_delete('/admin/users/{user_id}', admin_required(remove_user))
 
     # User badges route
     async def get_user_badges_route(request):
         user_id = request.match_info['user_id']
-        try:
-            badges = await data_manager.get_user_badges(user_id)
-            return web.json_response(badges)
-        except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
-    app.router.add_get('/users/{user_id}/badges', get_user_badges_route)
+        return list_response(
+            request, user_badge_fields,
+            lambda limit, after: data_manager.list_user_badges(user_id, limit, after)
+        )
+    app.router.add_get('/users/{user_id}/badges', cached(
+        response_cache, lambda request: data_manager.user_badges_generation(request.match_info['user_id'])
+    )(get_user_badges_route))
 
     # Login route
     async def login(request):
         try:
-            data = await request.json()
+            data = await read_json(request)
+            if not isinstance(data, dict):
+                return json_object_required()
             username = data.get('username')
             password = data.get('password')
-            users = await data_manager.read_json(data_manager.users_file)
-            user = next((u for u in users if u['username'] == username and pbkdf2_sha256.verify(password, u['password'])), None)
+            if not isinstance(username, str) or not isinstance(password, str):
+                return json_response({'success': False, 'message': 'Username and password must be strings'}, status=400)
+            user = await data_manager.authenticate_user(username, password)
             if user:
-                return web.json_response({
+                return json_response({
                     'success': True, 
                     'user_id': user['id'],
                     'username': user['username'],
                     'display_name': user.get('display_name', user['username']),
-                    'role': user.get('role', 'user')
+                    'role': user.get('role', 'user'),
+                    'token': tokens.issue(user),
+                    'expires_in': tokens.ttl
                 })
-            return web.json_response({'success': False, 'message': 'Invalid credentials'}, status=401)
+            return json_response({'success': False, 'message': 'Invalid credentials'}, status=401)
+        except PasswordHasherBusy:
+            return json_response({'success': False, 'message': 'Server busy, please retry'}, status=503, headers={'Retry-After': '1'})
         except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
+            return json_response({'success': False, 'message': str(e)}, status=500)
     app.router.add_post('/login', login)
 
+    # Session refresh route - swaps a still-valid token for a fresh one,
+    # picking up role changes without re-checking the password
+    async def refresh_token(request):
+        user = await data_manager.get_user_by_id(request['auth']['sub'])
+        if user is None:
+            return json_response({'success': False, 'message': 'User not found'}, status=401)
+        return json_response({
+            'success': True,
+            'role': user.get('role', 'user'),
+            'token': tokens.issue(user),
+            'expires_in': tokens.ttl
+        })
+    app.router.add_post('/auth/refresh', login_required(refresh_token))
+
     # Register route
     async def register(request):
         try:
-            data = await request.json()
+            data = await read_json(request)
+            if not isinstance(data, dict):
+                return json_object_required()
             username = data.get('username')
             password = data.get('password')
-            email = data.get('email', '')
-            display_name = data.get('display_name', username)
+            # Optional; null is taken as not given
+            email = data.get('email')
+            email = '' if email is None else email
+            display_name = data.get('display_name')
+            display_name = username if display_name is None else display_name
 
             # Validate required fields
             if not username or not password:
-                return web.json_response({'success': False, 'message': 'Username and password are required'}, status=400)
+                return json_response({'success': False, 'message': 'Username and password are required'}, status=400)
+            if not isinstance(username, str) or not isinstance(password, str):
+                return json_response({'success': False, 'message': 'Username and password must be strings'}, status=400)
+            if not isinstance(email, str) or not isinstance(display_name, str):
+                return json_response({'success': False, 'message': 'Email and display name must be strings'}, status=400)
 
-            users = await data_manager.read_json(data_manager.users_file)
-            if any(u['username'] == username for u in users):
-                return web.json_response({'success': False, 'message': 'Username already exists'}, status=400)
+            if data_manager.get_user_by_username(username) is not None:
+                return json_response({'success': False, 'message': 'Username already exists'}, status=400)
 
-            new_user = {
-                'id': str(uuid.uuid4()),
+            new_user = await data_manager.create_user({
                 'username': username,
-                'password': pbkdf2_sha256.hash(password),
+                'password': await hasher.hash(password),
                 'email': email,
                 'display_name': display_name,
                 'role': 'user'  # Default role for new users
-            }
-            users.append(new_user)
-            await data_manager.write_json(data_manager.users_file, users)
-            return web.json_response({'success': True, 'user_id': new_user['id']})
+            })
+            if new_user is None:
+                # Taken by a registration that finished while this one hashed
+                return json_response({'success': False, 'message': 'Username already exists'}, status=400)
+            return json_response({'success': True, 'user_id': new_user['id']})
+        except PasswordHasherBusy:
+            return json_response({'success': False, 'message': 'Server busy, please retry'}, status=503, headers={'Retry-After': '1'})
         except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
+            return json_response({'success': False, 'message': str(e)}, status=500)
     app.router.add_post('/register', register)
 
     # Badge endpoints
-    async def index(request):
-        index_html = os.path.join('src', 'templates', 'index.html')
-        with open(index_html, 'rb') as f:
-            return web.Response(body=f.read(), content_type='text/html')
-    app.router.add_get('/', index)
-    
-    async def badge_management(request):
-        badge_mgmt_html = os.path.join('src', 'templates', 'badge-management.html')
-        with open(badge_mgmt_html, 'rb') as f:
-            return web.Response(body=f.read(), content_type='text/html')
-    app.router.add_get('/badge-management', badge_management)
-    
-    async def user_management_page(request):
-        user_mgmt_html = os.path.join('src', 'templates', 'user-management.html')
-        with open(user_mgmt_html, 'rb') as f:
-            return web.Response(body=f.read(), content_type='text/html')
-    app.router.add_get('/user-management', user_management_page)
-    
-    async def badge_details_page(request):
-        badge_details_html = os.path.join('src', 'templates', 'badge-details.html')
-        with open(badge_details_html, 'rb') as f:
-            return web.Response(body=f.read(), content_type='text/html')
-    app.router.add_get('/badge-details/{badge_id}', badge_details_page)
+    app.router.add_get('/', static_assets.page('index.html'))
+    app.router.add_get('/badge-management', static_assets.page('badge-management.html'))
+    app.router.add_get('/user-management', static_assets.page('user-management.html'))
+    app.router.add_get('/badge-details/{badge_id}', static_assets.page('badge-details.html'))
 
     async def get_badges(request):
-        badges = await data_manager.read_json(data_manager.badges_file)
-        
-        # Get award counts for each badge
-        awards = await data_manager.read_json(data_manager.awards_file)
-        badge_counts = {}
-        for award in awards:
-            badge_id = award.get('badge_id')
-            if badge_id:
-                badge_counts[badge_id] = badge_counts.get(badge_id, 0) + 1
-        
-        # Add count to each badge
-        for badge in badges:
-            badge['count'] = badge_counts.get(badge['id'], 0)
-            
-        return web.json_response(badges)
-    app.router.add_get('/badges', get_badges)
+        # Badges with their award and holder counts
+        return list_response(request, badge_fields, data_manager.list_badges)
+    app.router.add_get('/badges', cached(
+        response_cache, lambda request: data_manager.generation('badges', 'awards')
+    )(get_badges))
     
+    def awarded_by(award):
+        awarder = data_manager.users.get(award.get('awarded_by'))
+        if awarder is None:
+            return None
+        return {
+            'id': awarder['id'],
+            'username': awarder['username'],
+            'display_name': awarder.get('display_name', '')
+        }
+
+    # Fields for a (holder, their first award of the badge) pair
+    holder_fields = {
+        'id': lambda holder: holder[0]['id'],
+        'username': lambda holder: holder[0]['username'],
+        'display_name': lambda holder: holder[0].get('display_name', ''),
+        'award_date': lambda holder: holder[1].get('awarded_at', ''),
+        'awarded_by': lambda holder: awarded_by(holder[1])
+    }
+
+    def badge_details(badge, limit, after, getters):
+        with phase('join'):
+            holders, total, next_key = data_manager.list_badge_holders(badge['id'], limit, after)
+            return {
+                'badge': badge,
+                'award_count': data_manager.badge_award_counts.get(badge['id'], 0),
+                'unique_user_count': total,
+                'users': [{name: get(holder) for name, get in getters.items()} for holder in holders],
+                'next_cursor': encode_cursor(next_key) if next_key else None
+            }
+
+    # Badge details route - the badge, its counts and a page of its holders
+    # (same limit/cursor/fields contract as the list routes)
     async def get_badge_details(request):
         badge_id = request.match_info['badge_id']
         
         # Get badge details
-        badges = await data_manager.read_json(data_manager.badges_file)
-        badge = next((b for b in badges if b['id'] == badge_id), None)
+        badge = data_manager.get_badge(badge_id)
         
         if not badge:
-            return web.json_response({'error': 'Badge not found'}, status=404)
-        
-        # Get awards for this badge
-        awards = await data_manager.read_json(data_manager.awards_file)
-        badge_awards = [a for a in awards if a['badge_id'] == badge_id]
-        
-        # Get user details for the awards
-        users = await data_manager.read_json(data_manager.users_file)
-        award_users = []
-        unique_user_ids = set()
-        
-        for award in badge_awards:
-            user_id = award.get('user_id')
-            awarded_by_id = award.get('awarded_by')
-            
-            if user_id and user_id not in unique_user_ids:
-                user = next((u for u in users if u['id'] == user_id), None)
-                awarded_by_user = None
-                
-                # Find the user who awarded this badge
-                if awarded_by_id:
-                    awarded_by_user = next((u for u in users if u['id'] == awarded_by_id), None)
-                
-                if user:
-                    award_info = {
-                        'id': user['id'],
-                        'username': user['username'],
-                        'display_name': user.get('display_name', ''),
-                        'award_date': award.get('awarded_at', '')
-                    }
-                    
-                    # Add information about who awarded the badge
-                    if awarded_by_user:
-                        award_info['awarded_by'] = {
-                            'id': awarded_by_user['id'],
-                            'username': awarded_by_user['username'],
-                            'display_name': awarded_by_user.get('display_name', '')
-                        }
-                    
-                    award_users.append(award_info)
-                    unique_user_ids.add(user_id)
-        
-        # Sort users by username
-        award_users.sort(key=lambda x: x['username'])
-        
-        result = {
-            'badge': badge,
-            'award_count': len(badge_awards),
-            'unique_user_count': len(award_users),
-            'users': award_users
-        }
-        
-        return web.json_response(result)
-    app.router.add_get('/badge-details-api/{badge_id}', get_badge_details)
+            return json_response({'error': 'Badge not found'}, status=404)
+
+        try:
+            limit, after, getters = read_list_params(request, holder_fields)
+        except ValueError as e:
+            return json_response({'success': False, 'message': str(e)}, status=400)
+        return json_response(badge_details(badge, limit, after, getters))
+
+    # Batch badge details route - ?ids=a,b,c returns the details of up to 100
+    # badges in one round trip, each with the first page of its holders.
+    # Unknown ids are listed under missing
+    def batch_badge_ids(request):
+        return [badge_id for badge_id in request.query.get('ids', '').split(',') if badge_id]
+
+    async def get_badge_details_batch(request):
+        badge_ids = batch_badge_ids(request)
+        if not badge_ids:
+            return json_response({'success': False, 'message': 'ids required'}, status=400)
+        if len(badge_ids) > 100:
+            return json_response({'success': False, 'message': 'At most 100 ids per request'}, status=400)
+        if 'cursor' in request.query:
+            return json_response({'success': False, 'message': 'cursor applies to a single badge'}, status=400)
+        try:
+            limit, _, getters = read_list_params(request, holder_fields)
+        except ValueError as e:
+            return json_response({'success': False, 'message': str(e)}, status=400)
+
+        items, missing = [], []
+        for badge_id in badge_ids:
+            badge = data_manager.get_badge(badge_id)
+            if badge is None:
+                missing.append(badge_id)
+            else:
+                items.append(badge_details(badge, limit, None, getters))
+        return json_response({'items': items, 'missing': missing})
+    app.router.add_get('/badge-details-api', cached(
+        response_cache, lambda request: data_manager.badge_generation(*batch_badge_ids(request)[:100])
+    )(get_badge_details_batch))
+    app.router.add_get('/badge-details-api/{badge_id}', cached(
+        response_cache, lambda request: data_manager.badge_generation(request.match_info['badge_id'])
+    )(get_badge_details))
     
-    # Badge image upload endpoint
+    # Badge image upload endpoint - streams the file to disk and stores it
+    # under its content hash, so identical images share one file
+    max_upload_bytes = int(os.environ.get('BADGE_MAX_UPLOAD_BYTES', str(5 * 1024 * 1024)))
+    image_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp'}
+
     async def upload_badge_image(request):
+        loop = asyncio.get_running_loop()
+        image_dir = os.path.join('src', 'static', 'images')
+        temp_file = None
         try:
-            # Make sure image directory exists
-            image_dir = os.path.join('src', 'static', 'images')
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-                print(f"Created image directory during upload: {image_dir}")
-            
-            print("Processing file upload...")
-            data = await request.post()
-            
-            # Check if the image file is in the request
-            if 'image' not in data:
-                print("No image file found in request")
-                return web.json_response({'success': False, 'message': 'No image file found'}, status=400)
-            
-            # Get the file and filename
-            file_field = data['image']
-            filename = data.get('filename')
-            
-            # Debug log the file info
-            print(f"Received file: {file_field.filename}, Content-Type: {file_field.content_type}")
-            
-            # Ensure filename is safe
-            if not filename or '..' in filename or '/' in filename:
-                filename = file_field.filename
-                if not filename or '..' in filename or '/' in filename:
-                    filename = f'badge_{uuid.uuid4()}.jpg'
-            
-            print(f"Using filename: {filename}")
-            
-            # Save file to images directory
+            await loop.run_in_executor(None, lambda: os.makedirs(image_dir, exist_ok=True))
+
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                if part.name == 'image':
+                    break
+                await part.release()
+            else:
+                return json_response({'success': False, 'message': 'No image file found'}, status=400)
+
+            extension = os.path.splitext(part.filename or '')[1].lower()
+            if extension not in image_extensions:
+                extension = mimetypes.guess_extension(part.headers.get('Content-Type', '')) or '.jpg'
+                if extension not in image_extensions:
+                    return json_response({'success': False, 'message': 'Unsupported image type'}, status=400)
+
+            # Hash while streaming; writes go through the executor
+            temp_file = await loop.run_in_executor(
+                None, lambda: tempfile.NamedTemporaryFile(dir=image_dir, suffix='.part', delete=False)
+            )
+            digest = hashlib.sha256()
+            file_size = 0
+            while chunk := await part.read_chunk(64 * 1024):
+                file_size += len(chunk)
+                if file_size > max_upload_bytes:
+                    return json_response({
+                        'success': False,
+                        'message': f'Image exceeds the {max_upload_bytes} byte limit'
+                    }, status=413)
+                digest.update(chunk)
+                await loop.run_in_executor(None, temp_file.write, chunk)
+            await loop.run_in_executor(None, temp_file.close)
+
+            filename = f'{digest.hexdigest()[:32]}{extension}'
             file_path = os.path.join(image_dir, filename)
-            
-            # Get the content as bytes and save to file
-            file_content = file_field.file.read()
-            file_size = len(file_content)
-            
-            print(f"Writing {file_size} bytes to {file_path}")
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            
-            return web.json_response({
+            if await loop.run_in_executor(None, os.path.exists, file_path):
+                # Same image uploaded before; keep the existing file
+                await loop.run_in_executor(None, os.remove, temp_file.name)
+            else:
+                await loop.run_in_executor(None, os.replace, temp_file.name, file_path)
+            temp_file = None
+
+            return json_response({
                 'success': True,
                 'filename': filename,
                 'size': file_size
             })
         except Exception as e:
             print(f"Error uploading file: {str(e)}")
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
+            return json_response({'success': False, 'message': str(e)}, status=500)
+        finally:
+            if temp_file is not None:
+                # Rejected or failed upload; drop the partial file
+                def discard_partial():
+                    temp_file.close()
+                    os.remove(temp_file.name)
+                await loop.run_in_executor(None, discard_partial)
     app.router.add_post('/upload/badge-image', upload_badge_image)
 
+    def check_badge_data(data):
+        # Error message for a badge body that is not an object, or whose
+        # text fields are not strings
+        if not isinstance(data, dict):
+            return 'JSON object required'
+        for field in ('name', 'description', 'icon'):
+            if data.get(field) is not None and not isinstance(data[field], str):
+                return f'{field} must be a string'
+        return None
+
     async def create_badge(request):
-        data = await request.json()
+        data = await read_json(request)
+        message = check_badge_data(data)
+        if message:
+            return json_response({'success': False, 'message': message}, status=400)
         badge = await data_manager.create_badge(data)
-        return web.json_response(badge)
-    app.router.add_post('/badges', create_badge)
+        return json_response(badge)
+    app.router.add_post('/badges', admin_required(create_badge))
 
     async def update_badge(request):
         badge_id = request.match_info['badge_id']
-        data = await request.json()
+        data = await read_json(request)
+        message = check_badge_data(data)
+        if message:
+            return json_response({'success': False, 'message': message}, status=400)
         success = await data_manager.update_badge(badge_id, data)
-        return web.json_response({'success': success})
-    app.router.add_put('/badges/{badge_id}', update_badge)
+        return json_response({'success': success})
+    app.router.add_put('/badges/{badge_id}', admin_required(update_badge))
 
     async def delete_badge(request):
         badge_id = request.match_info['badge_id']
         success = await data_manager.delete_badge(badge_id)
-        return web.json_response({'success': success})
-    app.router.add_delete('/badges/{badge_id}', delete_badge)
+        return json_response({'success': success})
+    app.router.add_delete('/badges/{badge_id}', admin_required(delete_badge))
+
+    # Search route - ranked, paginated matches over users and badges.
+    # ?q=<text>&type=user|badge&limit=N&cursor=<next_cursor>
+    async def search(request):
+        kind = request.query.get('type')
+        if kind not in (None, 'user', 'badge'):
+            return json_response({'success': False, 'message': 'type must be user or badge'}, status=400)
+        try:
+            limit = min(max(int(request.query.get('limit', '10')), 1), 50)
+        except ValueError:
+            return json_response({'success': False, 'message': 'limit must be an integer'}, status=400)
+        try:
+            cursor = request.query.get('cursor')
+            cursor = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return json_response({'success': False, 'message': str(e)}, status=400)
+
+        auth = request.get('auth') or {}
+        results, next_cursor = data_manager.search(
+            request.query.get('q', ''),
+            kinds=(kind,) if kind else ('user', 'badge'),
+            include_email=auth.get('role') == 'admin',
+            limit=limit,
+            cursor=cursor
+        )
+        return json_response({'results': results, 'next_cursor': next_cursor})
+    app.router.add_get('/search', search)
+
+    # Event log route - changes after a cursor, for clients catching up
+    async def get_events(request):
+        since = request.query.get('since')
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            return json_response({'success': False, 'message': 'since must be an integer'}, status=400)
+        return json_response(data_manager.events_since(since, request.query.get('epoch')))
+    app.router.add_get('/events', get_events)
+
+    # Activity Feed route - newest awards first, 10 per page by default.
+    # Pass the last item's cursor as ?before= to page back through history
+    def read_feed_params(request):
+        # Returns (before key, limit) or raises ValueError
+        before = request.query.get('before')
+        if before is not None:
+            awarded_at, separator, award_id = before.rpartition('|')
+            if not separator:
+                raise ValueError('Invalid cursor')
+            before = (awarded_at, award_id)
+        try:
+            limit = min(max(int(request.query.get('limit', '10')), 1), 100)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        return before, limit
 
-    # Activity Feed route - limited to 10 most recent awards
     async def get_activity_feed(request):
-        awards = await data_manager.read_json(data_manager.awards_file)
-        badges = await data_manager.read_json(data_manager.badges_file)
-        users = await data_manager.read_json(data_manager.users_file)
-        
-        # Sort awards by date (most recent first)
         try:
-            awards = sorted(awards, key=lambda x: x.get('awarded_at', ''), reverse=True)
-        except Exception as e:
-            print(f"Error sorting awards: {str(e)}")
-        
-        # Limit to 10 most recent
-        recent_awards = awards[:10]
-        
-        feed = []
-        for award in recent_awards:
-            user = next((u for u in users if u['id'] == award['user_id']), {'username': 'Unknown'})
-            badge = next((b for b in badges if b['id'] == award['badge_id']), {'name': 'Unknown Badge'})
-            feed.append({
-                'user': user['username'],
-                'badge': badge['name'],
-                'date': award.get('awarded_at', 'Unknown Date')
-            })
-        
-        return web.json_response(feed)
-    app.router.add_get('/activity-feed', get_activity_feed)
+            with phase('parse'):
+                before, limit = read_feed_params(request)
+        except ValueError as e:
+            return json_response({'success': False, 'message': str(e)}, status=400)
+
+        return json_response(await data_manager.get_activity_feed(before, limit))
+    app.router.add_get('/activity-feed', cached(
+        response_cache, lambda request: data_manager.generation('users', 'badges', 'awards')
+    )(get_activity_feed))
+
+    def check_pair(user_id, badge_id):
+        # Error message for a pair that is not two ids, or names a missing
+        # user or badge
+        if not isinstance(user_id, str) or not isinstance(badge_id, str):
+            return 'user_id and badge_id must be strings'
+        if data_manager.users.get(user_id) is None:
+            return 'User not found'
+        if data_manager.get_badge(badge_id) is None:
+            return 'Badge not found'
+        return None
 
     # Badge Award route
     async def award_badge(request):
-        data = await request.json()
+        data = await read_json(request)
+        if not isinstance(data, dict):
+            return json_object_required()
         user_id = data.get('user_id')
         badge_id = data.get('badge_id')
-        awarded_by = data.get('awarded_by')
+        # The awarder is whoever the session token belongs to
+        awarded_by = request['auth']['sub']
         
+        message = check_pair(user_id, badge_id)
+        if message:
+            return json_response({'success': False, 'message': message}, status=400)
+
         # Prevent users from awarding badges to themselves
         if awarded_by and awarded_by == user_id:
-            return web.json_response({
+            return json_response({
                 'success': False, 
                 'message': 'You cannot award badges to yourself'
             }, status=400)
         
         award = await data_manager.award_badge(user_id, badge_id, awarded_by)
-        return web.json_response({'success': True, 'award': award})
-    app.router.add_post('/badges/award', award_badge)
+        return json_response({'success': True, 'award': award})
+    app.router.add_post('/badges/award', login_required(award_badge))
+
+    # Bulk award/revoke routes. The body is either {"items": [{"user_id",
+    # "badge_id"}, ...]} or {"badge_id", "user_ids": [...]}; each item gets
+    # its own result and the valid ones are applied in one write
+    max_bulk_items = int(os.environ.get('BADGE_MAX_BULK_ITEMS', '1000'))
+
+    async def read_bulk_pairs(request):
+        # Returns (pairs, None) or (None, error response)
+        data = await read_json(request)
+        if not isinstance(data, dict):
+            return None, json_object_required()
+        if 'items' in data:
+            items = data['items']
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                return None, json_response({'success': False, 'message': 'items must be a list of objects'}, status=400)
+            pairs = [(item.get('user_id'), item.get('badge_id')) for item in items]
+        else:
+            user_ids = data.get('user_ids')
+            if not isinstance(user_ids, list):
+                return None, json_response({'success': False, 'message': 'items or badge_id and user_ids required'}, status=400)
+            pairs = [(user_id, data.get('badge_id')) for user_id in user_ids]
+        if len(pairs) > max_bulk_items:
+            return None, json_response({
+                'success': False,
+                'message': f'At most {max_bulk_items} items per request'
+            }, status=400)
+        return pairs, None
+
+    async def award_badges_bulk(request):
+        pairs, error = await read_bulk_pairs(request)
+        if error is not None:
+            return error
+        awarded_by = request['auth']['sub']
+
+        results, valid = [], []
+        for user_id, badge_id in pairs:
+            result = {'user_id': user_id, 'badge_id': badge_id}
+            message = check_pair(user_id, badge_id)
+            if message is None and user_id == awarded_by:
+                message = 'You cannot award badges to yourself'
+            if message:
+                result.update(success=False, message=message)
+            else:
+                valid.append(result)
+            results.append(result)
+
+        awards = await data_manager.award_badges([(r['user_id'], r['badge_id']) for r in valid], awarded_by)
+        for result, award in zip(valid, awards):
+            result.update(success=True, award_id=award['id'])
+        return json_response({'success': True, 'awarded': len(awards), 'results': results})
+    app.router.add_post('/badges/award/bulk', login_required(award_badges_bulk))
+
+    async def remove_badges_bulk(request):
+        pairs, error = await read_bulk_pairs(request)
+        if error is not None:
+            return error
+
+        results, valid = [], []
+        for user_id, badge_id in pairs:
+            result = {'user_id': user_id, 'badge_id': badge_id}
+            message = check_pair(user_id, badge_id)
+            if message:
+                result.update(success=False, message=message)
+            else:
+                valid.append(result)
+            results.append(result)
+
+        revoked = await data_manager.remove_badges_from_users([(r['user_id'], r['badge_id']) for r in valid])
+        for result, awards in zip(valid, revoked):
+            result.update(success=True, removed=len(awards))
+        return json_response({'success': True, 'removed': sum(map(len, revoked)), 'results': results})
+    app.router.add_post('/badges/remove/bulk', login_required(remove_badges_bulk))
 
     # Remove Badge from User route
     async def remove_badge_from_user(request):
         try:
-            data = await request.json()
+            data = await read_json(request)
+            if not isinstance(data, dict):
+                return json_object_required()
             user_id = data.get('user_id')
             badge_id = data.get('badge_id')
             if not user_id or not badge_id:
-                return web.json_response({'success': False, 'message': 'user_id and badge_id required'}, status=400)
-            success = await data_manager.remove_badge_from_user(user_id, badge_id)
-            return web.json_response({'success': success})
+                return json_response({'success': False, 'message': 'user_id and badge_id required'}, status=400)
+            message = check_pair(user_id, badge_id)
+            if message:
+                return json_response({'success': False, 'message': message}, status=400)
+            await data_manager.remove_badge_from_user(user_id, badge_id)
+            return json_response({'success': True})
         except Exception as e:
-            return web.json_response({'success': False, 'message': str(e)}, status=500)
-    app.router.add_post('/badges/remove', remove_badge_from_user)
+            return json_response({'success': False, 'message': str(e)}, status=500)
+    app.router.add_post('/badges/remove', login_required(remove_badge_from_user))
+
+    routes = {f'{route.method} {route.resource.canonical}' for route in app.router.routes()}
+    for route in admission.routes:
+        if route not in routes:
+            print(f"Admission limits set for unknown route {route}")
 
     return app
 
+async def run_writer(socket_path, workers):
+    # --workers mode: this process owns the storage and runs every write;
+    # the workers serve HTTP on the shared port and stay in sync through
+    # the socket. Returns when the first worker exits
+    hasher = PasswordHasher(workers=1)
+    data_manager = DataManager(
+        create_storage('src/data'), hasher,
+        event_ring_size=int(os.environ.get('BADGE_EVENT_RING_SIZE', '10000'))
+    )
+    await data_manager.load()
+    await data_manager.create_default_admin()
+    await data_manager.create_default_badge()
+    server = WriterServer(data_manager, socket_path)
+    await server.start()
+    print(f"Writer listening on {socket_path}, starting {workers} workers")
+
+    # Not daemonic: workers run their own password hashing pools. They stop
+    # on their own if this process dies, when the socket closes
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(socket_path,)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        waits = [loop.run_in_executor(None, process.join) for process in processes]
+        await asyncio.wait([asyncio.ensure_future(stopped.wait()), *waits],
+                           return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        await asyncio.gather(*(loop.run_in_executor(None, process.join) for process in processes))
+        await server.close()
+        await data_manager.close()
+        hasher.close()
+
+def run_worker(socket_path):
+    # Entry point of a --workers process. SO_REUSEPORT lets every worker
+    # bind port 8080; the kernel spreads connections across them
+    web.run_app(init_app(writer_socket=socket_path), port=8080, reuse_port=True)
+
+async def check_consistency():
+    data_manager = DataManager(create_storage('src/data'), hasher=None)
+    await data_manager.load()
+    try:
+        return await data_manager.check_consistency(repair=False)
+    finally:
+        await data_manager.close()
+
 def main():
+    parser = argparse.ArgumentParser(description="Trig's Triumph Trophy Tracker")
+    parser.add_argument('--migrate-sqlite', action='store_true',
+                        help='import the JSON data files into the SQLite database and exit')
+    parser.add_argument('--check-consistency', action='store_true',
+                        help='rebuild the award counters from the stored awards, report drift and exit')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='serve from N processes sharing port 8080, with one writer process owning the data')
+    args = parser.parse_args()
+
+    if args.migrate_sqlite:
+        db_path = os.environ.get('BADGE_SQLITE_PATH', os.path.join('src', 'data', 'badges.db'))
+        counts = asyncio.run(migrate_json_to_sqlite('src/data', db_path))
+        print(f"Imported {counts['users']} users, {counts['badges']} badges and "
+              f"{counts['awards']} awards into {db_path}")
+        return
+
+    if args.check_consistency:
+        print(json.dumps(asyncio.run(check_consistency()), indent=2))
+        return
+
+    if args.workers > 1:
+        # Shared by all workers, so a session token from one is valid on all
+        os.environ.setdefault('BADGE_SECRET_KEY', secrets.token_urlsafe(32))
+        # Split the cores between the workers' password hashing pools
+        os.environ.setdefault('BADGE_HASH_WORKERS', str(max((os.cpu_count() or 1) // args.workers, 1)))
+        socket_path = os.environ.get('BADGE_WRITER_SOCKET', os.path.join(tempfile.gettempdir(), f'badge-writer-{os.getpid()}.sock'))
+        asyncio.run(run_writer(socket_path, args.workers))
+        return
+
     app = asyncio.run(init_app())
     web.run_app(app, port=8080)
 
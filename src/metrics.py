@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import time
+from bisect import bisect_left
+from aiohttp import web
+
+# Upper bounds in seconds; every histogram also has an implicit +Inf bucket
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# Fixed-bucket histogram. observe() bumps one bucket; the counts are made
+# cumulative only when rendered, so recording is a bisect and two adds
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        # Plain data, for stats() dicts and for the writer process in
+        # multi-worker mode
+        return {'bounds': list(self.bounds), 'counts': list(self.counts), 'sum': self.sum}
+
+
+# Latency histogram and byte count per I/O operation
+class OpTimings:
+    def __init__(self):
+        self.ops = {}  # op -> [Histogram, bytes]
+
+    def observe(self, op, seconds, nbytes=0):
+        entry = self.ops.get(op)
+        if entry is None:
+            entry = self.ops[op] = [Histogram(), 0]
+        entry[0].observe(seconds)
+        entry[1] += nbytes
+
+    def snapshot(self):
+        return {op: {**histogram.snapshot(), 'bytes': nbytes} for op, (histogram, nbytes) in self.ops.items()}
+
+
+# Request counts and latencies per route, and event-loop lag. Everything
+# else exposed at /metrics is read from the components' stats() when
+# scraped, so it costs nothing between scrapes
+class Metrics:
+    def __init__(self, lag_interval=0.5):
+        self.requests = {}  # (method, route, status) -> count
+        self.latency = {}  # (method, route) -> Histogram
+        self.lag_interval = lag_interval
+        self.lag = Histogram(LAG_BUCKETS)
+        self.max_lag = 0.0
+        self.lag_task = None
+
+    def observe_request(self, method, route, status, seconds):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if status == 101:
+            return  # A WebSocket's duration is its whole session
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram()
+        histogram.observe(seconds)
+
+    async def _sample_lag(self):
+        # How late a sleep wakes up is how long something held the loop
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(loop.time() - start - self.lag_interval, 0.0)
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    async def start(self, app):
+        self.lag_task = asyncio.create_task(self._sample_lag())
+
+    async def stop(self, app):
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+
+    def expose(self, out):
+        out.counter('http_requests_total', 'HTTP requests by route, method and status',
+                    [({'method': method, 'route': route, 'status': status}, count)
+                     for (method, route, status), count in self.requests.items()])
+        out.histogram('http_request_duration_seconds', 'HTTP request latency by route and method',
+                      [({'method': method, 'route': route}, histogram.snapshot())
+                       for (method, route), histogram in self.latency.items()])
+        out.histogram('event_loop_lag_seconds', f'Event loop lag, sampled every {self.lag_interval} s',
+                      [({}, self.lag.snapshot())])
+        out.gauge('event_loop_lag_max_seconds', 'Largest event loop lag seen', [({}, self.max_lag)])
+
+
+# Per-request phase timings (parse, storage, join, serialize) for the
+# slow-request log. A trace is only set while a request is traced, so a
+# phase costs one context variable lookup otherwise
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class phase:
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace[self.name] = self.trace.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def metrics_middleware(metrics):
+    # Outermost middleware, so the time includes authentication. Routes are
+    # labelled by their pattern, never the concrete path, to keep the
+    # number of series bounded
+    @web.middleware
+    async def middleware(request, handler):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            resource = request.match_info.route.resource
+            metrics.observe_request(request.method, resource.canonical if resource is not None else 'unmatched',
+                                    status, time.perf_counter() - start)
+    return middleware
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+# Prometheus text exposition format (version 0.0.4)
+class Exposition:
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix='badge_'):
+        self.prefix = prefix
+        self.lines = []
+
+    def _family(self, name, kind, help_text):
+        name = self.prefix + name
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        return name
+
+    def _samples(self, name, kind, help_text, samples):
+        name = self._family(name, kind, help_text)
+        for labels, value in samples:
+            self.lines.append(f'{name}{format_labels(labels)} {value}')
+
+    def counter(self, name, help_text, samples):
+        self._samples(name, 'counter', help_text, samples)
+
+    def gauge(self, name, help_text, samples):
+        self._samples(name, 'gauge', help_text, samples)
+
+    def histogram(self, name, help_text, series):
+        # series: (labels, Histogram.snapshot()) pairs
+        name = self._family(name, 'histogram', help_text)
+        for labels, snapshot in series:
+            # The series' labels are formatted once and shared by its buckets
+            formatted = format_labels(labels)
+            bucket = f'{name}_bucket{formatted[:-1]},le="' if labels else f'{name}_bucket{{le="'
+            total = 0
+            for bound, count in zip([*snapshot['bounds'], '+Inf'], snapshot['counts']):
+                total += count
+                self.lines.append(f'{bucket}{bound}"}} {total}')
+            self.lines.append(f'{name}_sum{formatted} {snapshot["sum"]}')
+            self.lines.append(f'{name}_count{formatted} {total}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
@@ -0,0 +1,71 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from passlib.hash import pbkdf2_sha256
+from metrics import Histogram
+
+
+def _hash(password):
+    return pbkdf2_sha256.hash(password)
+
+
+def _verify(password, hashed):
+    return pbkdf2_sha256.verify(password, hashed)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# pbkdf2 hashing and verification on a process pool, so a burst of logins
+# never pins the event loop. At most max_pending calls may be queued or
+# running; beyond that callers are turned away with PasswordHasherBusy
+class PasswordHasher:
+    def __init__(self, workers=None, max_pending=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        # spawn rather than fork: the parent runs executor threads and an
+        # event loop that a forked child must not inherit
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # Queue wait plus hashing time, as callers see it
+        self.timings = {'hash': Histogram(), 'verify': Histogram()}
+
+    async def _run(self, op, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy('Too many password operations in progress')
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+        self.timings[op].observe(time.perf_counter() - start)
+        self.completed += 1
+        return result
+
+    async def hash(self, password):
+        return await self._run('hash', _hash, password)
+
+    async def verify(self, password, hashed):
+        return await self._run('verify', _verify, password, hashed)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timings': {op: histogram.snapshot() for op, histogram in self.timings.items()},
+        }
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
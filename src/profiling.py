@@ -0,0 +1,238 @@
+import asyncio
+import cProfile
+import os
+import random
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime, timezone
+from aiohttp import web
+from codec import dumps
+from metrics import current_trace
+
+PHASES = ('parse', 'storage', 'join', 'serialize')
+SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024  # rotated to slow-requests.log.1 past this
+WRITE_QUEUE_SIZE = 1000  # files waiting to be written; more are dropped
+
+
+# Opt-in request profiling and the slow-request log.
+#
+# An admin request with `X-Profile: cpu` (or `memory`, which adds
+# tracemalloc) runs under cProfile, as does a random sample_rate share of
+# all requests. Each profile is written to the directory as a .prof file for
+# pstats or snakeviz, keeping the newest `keep`. cProfile profiles the whole
+# thread, so one profile runs at a time and includes whatever else the
+# event loop ran meanwhile; a request that finds the profiler busy runs
+# unprofiled.
+#
+# Any request slower than slow_threshold is logged with its route, params,
+# phase breakdown and, while tracemalloc is tracing, allocation peak: kept
+# in memory for /admin/slow-requests and appended to slow-requests.log.
+#
+# Files are written by one background task through the executor, in order,
+# so the event loop does no disk I/O for them. When the disk falls behind
+# and the queue is full, further writes are dropped and counted
+class Profiler:
+    def __init__(self, directory, sample_rate=0.0, keep=50, slow_threshold=0.5, trace_memory=False,
+                 recent_size=100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.slow_threshold = slow_threshold
+        self.trace_memory = trace_memory
+        self.recent = deque(maxlen=recent_size)  # newest slow requests
+        self.profiling = False
+        self.in_flight = 0  # traced requests; they share one allocation peak
+        self.profiles_written = 0
+        self.slow_requests = 0
+        self.pending = None  # (write, args) for the writer task
+        self.writer = None
+        self.dropped_writes = 0
+
+    async def start(self, app):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.pending = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.writer = asyncio.create_task(self._write_pending())
+
+    async def stop(self, app):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.writer is not None:
+            await self.pending.join()
+            self.writer.cancel()
+            self.writer = None
+
+    async def _write_pending(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            write, args = await self.pending.get()
+            try:
+                await loop.run_in_executor(None, write, *args)
+            except Exception as e:
+                print(f"Could not write to {self.directory}: {e}")
+            finally:
+                self.pending.task_done()
+
+    def _queue(self, write, *args):
+        # Returns whether the write was queued
+        try:
+            self.pending.put_nowait((write, args))
+        except asyncio.QueueFull:
+            self.dropped_writes += 1
+            return False
+        return True
+
+    def wanted(self, request):
+        # 'cpu', 'memory' or None; WebSocket sessions are never profiled
+        if self.profiling or request.headers.get('Upgrade', '').lower() == 'websocket':
+            return None
+        mode = request.headers.get('X-Profile')
+        if mode in ('cpu', 'memory') and (request.get('auth') or {}).get('role') == 'admin':
+            return mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'cpu'
+        return None
+
+    def _path(self, request, elapsed, suffix):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        slug = ''.join(c if c.isalnum() else '_' for c in route).strip('_') or 'root'
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%f')
+        return os.path.join(self.directory,
+                            f'{stamp}-{os.getpid()}-{request.method}-{slug}-{elapsed * 1000:.0f}ms{suffix}')
+
+    def write_profile(self, request, elapsed, profile, allocations):
+        # Queues the profile and returns its .prof file name, or None when
+        # the queue is full. allocations: tracemalloc differences over the
+        # request, if any
+        path = self._path(request, elapsed, '.prof')
+        if not self._queue(self._write_profile, path, profile, allocations[:50] if allocations is not None else None):
+            return None
+        self.profiles_written += 1
+        return os.path.basename(path)
+
+    def _write_profile(self, path, profile, allocations):
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(path)
+        if allocations is not None:
+            with open(path[:-len('.prof')] + '.mem.txt', 'w') as f:
+                f.writelines(f'{stat}\n' for stat in allocations)
+        self._rotate()
+
+    def _rotate(self):
+        # Names start with a UTC timestamp, so they sort oldest first
+        profiles = sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+        for name in profiles[:max(len(profiles) - self.keep, 0)]:
+            stem = os.path.join(self.directory, name[:-len('.prof')])
+            for path in (stem + '.prof', stem + '.mem.txt'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def log_slow(self, request, status, elapsed, trace, alloc_peak, profile_name):
+        resource = request.match_info.route.resource
+        phases = {name: round(trace.get(name, 0.0) * 1000, 3) for name in PHASES}
+        phases['other'] = round(max(elapsed * 1000 - sum(phases.values()), 0.0), 3)
+        entry = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'method': request.method,
+            'route': resource.canonical if resource is not None else 'unmatched',
+            'path': request.path,
+            'match': dict(request.match_info),
+            'query': dict(request.query),
+            'status': status,
+            'ms': round(elapsed * 1000, 3),
+            'phases_ms': phases,
+        }
+        if alloc_peak is not None:
+            entry['alloc_peak_bytes'] = alloc_peak
+        if profile_name is not None:
+            entry['profile'] = profile_name
+        self.slow_requests += 1
+        self.recent.append(entry)
+        self._queue(self._append_slow, dumps(entry) + b'\n')
+
+    def _append_slow(self, line):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, 'slow-requests.log')
+        if os.path.exists(path) and os.path.getsize(path) > SLOW_LOG_MAX_BYTES:
+            os.replace(path, path + '.1')
+        with open(path, 'ab') as f:
+            f.write(line)
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'sample_rate': self.sample_rate,
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'tracing_memory': tracemalloc.is_tracing(),
+            'profiles_written': self.profiles_written,
+            'slow_requests': self.slow_requests,
+            'pending_writes': self.pending.qsize() if self.pending is not None else 0,
+            'dropped_writes': self.dropped_writes,
+            'recent': list(reversed(self.recent)),
+        }
+
+
+def profiling_middleware(profiler):
+    # Runs after auth_middleware, so X-Profile can be limited to admins
+    @web.middleware
+    async def middleware(request, handler):
+        mode = profiler.wanted(request)
+        if mode is None and not profiler.slow_threshold:
+            return await handler(request)
+
+        trace = {}
+        token = current_trace.set(trace)
+        profile = None
+        started_tracemalloc = False
+        memory_before = None
+        if mode is not None:
+            profiler.profiling = True
+            if mode == 'memory':
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    started_tracemalloc = True
+                memory_before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+        memory_start = None
+        if tracemalloc.is_tracing():
+            if not profiler.in_flight:
+                tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        profiler.in_flight += 1
+        status = 500
+        response = None
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            response = await handler(request)
+            status = response.status
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            profiler.in_flight -= 1
+            current_trace.reset(token)
+            alloc_peak = None
+            if memory_start is not None and tracemalloc.is_tracing():
+                alloc_peak = max(tracemalloc.get_traced_memory()[1] - memory_start, 0)
+            profile_name = None
+            if profile is not None:
+                allocations = None
+                if memory_before is not None and tracemalloc.is_tracing():
+                    allocations = tracemalloc.take_snapshot().compare_to(memory_before, 'lineno')
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                profiler.profiling = False
+                profile_name = profiler.write_profile(request, elapsed, profile, allocations)
+            if profiler.slow_threshold and elapsed >= profiler.slow_threshold and status != 101:
+                profiler.log_slow(request, status, elapsed, trace, alloc_peak, profile_name)
+        if profile_name is not None and not response.prepared:
+            response.headers['X-Profile'] = profile_name
+        return response
+    return middleware
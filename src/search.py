@@ -0,0 +1,138 @@
+import base64
+import heapq
+import json
+from bisect import bisect_left, insort
+
+
+def normalize(text):
+    return ' '.join(str(text or '').lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, types=(int, int, str, str, str)):
+    # Raises ValueError for anything that is not a cursor with parts of the
+    # given types; the default matches search result positions
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception as e:
+        raise ValueError('Invalid cursor') from e
+    if (not isinstance(position, list) or len(position) != len(types)
+            or not all(type(part) is kind for part, kind in zip(position, types))):
+        raise ValueError('Invalid cursor')
+    return tuple(position)
+
+
+# In-memory text index over named fields of documents keyed by (kind, id).
+# A sorted term list answers prefix queries and a trigram map answers
+# substring queries, so a lookup costs O(log n + matches) rather than a
+# scan over every document
+class SearchIndex:
+    # How a document matched, best first
+    EXACT, PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+
+    def __init__(self):
+        self.documents = {}  # (kind, id) -> (label, {field: normalized value})
+        self.terms = []  # sorted (term, kind, id, field); a term is a value or a word of it
+        self.trigrams = {}  # trigram -> {(kind, id, field)}
+
+    def add(self, kind, doc_id, label, fields):
+        self.remove(kind, doc_id)
+        for entry in self._add(kind, doc_id, label, fields):
+            insort(self.terms, entry)
+
+    def rebuild(self, documents):
+        # Index (kind, id, label, fields) tuples from scratch, sorting the
+        # term list once instead of inserting into it one by one
+        self.documents, self.terms, self.trigrams = {}, [], {}
+        for document in documents:
+            self.terms.extend(self._add(*document))
+        self.terms.sort()
+
+    def _add(self, kind, doc_id, label, fields):
+        # Records the document and its trigrams; returns its term entries
+        values = {field: normalize(value) for field, value in fields.items()}
+        self.documents[(kind, doc_id)] = (normalize(label), values)
+        entries = []
+        for field, value in values.items():
+            if not value:
+                continue
+            entries.extend((term, kind, doc_id, field) for term in set(value.split()) | {value})
+            for trigram in trigrams(value):
+                self.trigrams.setdefault(trigram, set()).add((kind, doc_id, field))
+        return entries
+
+    def remove(self, kind, doc_id):
+        document = self.documents.pop((kind, doc_id), None)
+        if document is None:
+            return
+        for field, value in document[1].items():
+            if not value:
+                continue
+            for term in set(value.split()) | {value}:
+                entry = (term, kind, doc_id, field)
+                position = bisect_left(self.terms, entry)
+                if position < len(self.terms) and self.terms[position] == entry:
+                    del self.terms[position]
+            for trigram in trigrams(value):
+                postings = self.trigrams.get(trigram)
+                if postings is not None:
+                    postings.discard((kind, doc_id, field))
+                    if not postings:
+                        del self.trigrams[trigram]
+
+    def search(self, query, fields, limit=10, cursor=None):
+        # fields maps each kind to search to its searchable fields, most
+        # important first. Returns ([(kind, id)], next cursor or None)
+        query = normalize(query)
+        if not query:
+            return [], None
+        field_order = {kind: {field: i for i, field in enumerate(names)} for kind, names in fields.items()}
+        best = {}  # (kind, id) -> sort position
+
+        def consider(rank, kind, doc_id, order, label):
+            position = (rank, order, label, kind, doc_id)
+            current = best.get((kind, doc_id))
+            if current is None or position < current:
+                best[(kind, doc_id)] = position
+
+        # Prefix matches: a contiguous run of the sorted term list
+        position = bisect_left(self.terms, (query,))
+        while position < len(self.terms) and self.terms[position][0].startswith(query):
+            term, kind, doc_id, field = self.terms[position]
+            position += 1
+            order = field_order.get(kind, {}).get(field)
+            if order is None:
+                continue
+            label, values = self.documents[(kind, doc_id)]
+            if term != values[field]:
+                rank = self.WORD_PREFIX
+            else:
+                rank = self.EXACT if term == query else self.PREFIX
+            consider(rank, kind, doc_id, order, label)
+
+        # Substring matches: values holding every trigram of the query
+        if len(query) >= 3:
+            postings = sorted((self.trigrams.get(t, set()) for t in trigrams(query)), key=len)
+            if postings[0]:
+                for kind, doc_id, field in postings[0].intersection(*postings[1:]):
+                    order = field_order.get(kind, {}).get(field)
+                    if order is None or (kind, doc_id) in best:
+                        continue
+                    label, values = self.documents[(kind, doc_id)]
+                    if query in values[field]:
+                        consider(self.SUBSTRING, kind, doc_id, order, label)
+
+        positions = best.values()
+        if cursor is not None:
+            positions = [position for position in positions if position > cursor]
+        # One extra result tells us whether there is another page
+        page = heapq.nsmallest(limit + 1, positions)
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return [(kind, doc_id) for *_, kind, doc_id in page[:limit]], next_cursor
@@ -1,6 +1,7 @@
 class BadgeTrackingApp {
     constructor() {
         this.currentUser = null;
+        this.feedPageSize = 10;
         this.handleLogin = this.handleLogin.bind(this);
         this.handleRegister = this.handleRegister.bind(this);
         this.handleLogout = this.handleLogout.bind(this);
@@ -31,6 +32,8 @@ class BadgeTrackingApp {
         if (savedUser) {
             try {
                 this.currentUser = JSON.parse(savedUser);
+                // Extend the stored session before it expires
+                this.refreshSession();
                 // Load user's badges if they're logged in
                 setTimeout(() => {
                     this.loadUserBadges();
@@ -42,6 +45,44 @@ class BadgeTrackingApp {
         }
     }
 
+    authHeaders(headers = {}) {
+        // Attach the session token issued by /login, if any
+        if (this.currentUser && this.currentUser.token) {
+            return { ...headers, 'Authorization': `Bearer ${this.currentUser.token}` };
+        }
+        return headers;
+    }
+
+    async refreshSession() {
+        if (!this.currentUser || !this.currentUser.token) return;
+        try {
+            const response = await fetch('/auth/refresh', {
+                method: 'POST',
+                headers: this.authHeaders()
+            });
+            if (response.status === 401) {
+                // Token expired or user removed; log in again
+                this.handleLogout();
+                return;
+            }
+            const data = await response.json();
+            if (data.success) {
+                this.currentUser.token = data.token;
+                this.currentUser.role = data.role;
+                localStorage.setItem('currentUser', JSON.stringify(this.currentUser));
+                this.scheduleSessionRefresh(data.expires_in);
+            }
+        } catch (error) {
+            console.error('Session refresh error:', error);
+        }
+    }
+
+    scheduleSessionRefresh(expiresIn) {
+        clearTimeout(this.sessionRefreshTimer);
+        // Refresh halfway through the token's lifetime
+        this.sessionRefreshTimer = setTimeout(() => this.refreshSession(), expiresIn * 500);
+    }
+
     initThemeToggle() {
         // Load saved theme from localStorage
         const savedTheme = localStorage.getItem('theme') || 'light';
@@ -54,24 +95,101 @@ class BadgeTrackingApp {
 
         this.ws.onopen = () => {
             console.log('WebSocket connection established');
+            this.wsRetryDelay = 1000;
+            this.wsTopics = null;
+            this.syncSubscriptions();
+            // Catch up on anything missed while disconnected
+            if (this.eventCursor) {
+                this.ws.send(JSON.stringify({ type: 'resume', ...this.eventCursor }));
+            }
         };
 
         this.ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
             this.handleWebSocketMessage(data);
         };
+
+        this.ws.onclose = () => {
+            // Reconnect with backoff, capped at 30s
+            const delay = this.wsRetryDelay || 1000;
+            this.wsRetryDelay = Math.min(delay * 2, 30000);
+            setTimeout(() => this.initWebSocket(), delay);
+        };
+    }
+
+    advanceEventCursor(seq) {
+        if (this.eventCursor && typeof seq === 'number' && seq > this.eventCursor.since) {
+            this.eventCursor.since = seq;
+        }
+    }
+
+    handleMissedEvents(data) {
+        // Replay small gaps; reload everything if the server could not
+        if (this.eventCursor && data.epoch !== this.eventCursor.epoch) {
+            // The server restarted and its sequence numbers started over
+            this.eventCursor = { since: 0, epoch: data.epoch };
+        }
+        const events = data.events || [];
+        const awardEvents = ['badge_awarded', 'badge_removed', 'badges_awarded', 'badges_removed'];
+        const awardsOnly = events.every(event => awardEvents.includes(event.type));
+        if (data.resync || !awardsOnly) {
+            this.loadInitialData();
+            return;
+        }
+        events.forEach(event => this.handleWebSocketMessage(event));
+        this.advanceEventCursor(data.seq);
+    }
+
+    syncSubscriptions() {
+        // Only ask for events this page shows: the feed and the current user's badges
+        if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+        const topics = [];
+        if (this.feedContainer) topics.push('feed');
+        if (this.currentUser) topics.push(`user:${this.currentUser.id}`);
+
+        const stale = [...(this.wsTopics || [])].filter(topic => !topics.includes(topic));
+        if (stale.length) {
+            this.ws.send(JSON.stringify({ type: 'unsubscribe', topics: stale }));
+        }
+        if (topics.length) {
+            this.ws.send(JSON.stringify({ type: 'subscribe', topics }));
+        }
+        this.wsTopics = new Set(topics);
+    }
+
+    async fetchAllPages(path) {
+        // Follow next_cursor through a paginated list endpoint
+        const items = [];
+        let cursor = null;
+        do {
+            const params = new URLSearchParams({ limit: 1000 });
+            if (cursor) params.set('cursor', cursor);
+            const response = await fetch(`${path}?${params}`);
+            const page = await response.json();
+            items.push(...(page.items || []));
+            cursor = page.next_cursor;
+        } while (cursor);
+        return items;
     }
 
     async loadInitialData() {
         try {
+            // Take the event cursor before the data, so nothing falls in between
+            try {
+                const cursor = await (await fetch('/events')).json();
+                this.eventCursor = { since: cursor.seq, epoch: cursor.epoch };
+            } catch (error) {
+                console.error('Failed to fetch event cursor:', error);
+            }
+
             // Determine which page we're on
             const isBadgeManagementPage = document.querySelector('.badge-management-page') !== null;
             const isHomePage = !isBadgeManagementPage;
             
             // Always fetch badges for both pages
-            const badgesPromise = fetch('/badges').catch(error => {
+            const badgesPromise = this.fetchAllPages('/badges').catch(error => {
                 console.error('Failed to fetch badges:', error);
-                return { json: () => [] };
+                return [];
             });
             
             // Only fetch activity feed on home page
@@ -82,18 +200,10 @@ class BadgeTrackingApp {
                 }) : 
                 Promise.resolve({ json: () => [] });
             
-            // Fetch users for both pages (needed for login info)
-            const usersPromise = fetch('/users').catch(error => {
-                console.error('Failed to fetch users:', error);
-                return { json: () => [] };
-            });
-            
-            const [badgesResponse, activityFeedResponse, usersResponse] = 
-                await Promise.all([badgesPromise, activityFeedPromise, usersPromise]);
+            const [badges, activityFeedResponse] = 
+                await Promise.all([badgesPromise, activityFeedPromise]);
 
-            const badges = await this.safeJsonParse(badgesResponse);
             const activityFeed = await this.safeJsonParse(activityFeedResponse);
-            const users = await this.safeJsonParse(usersResponse);
 
             // Render badge management list if the element exists
             const badgeListElement = document.getElementById('badge-list');
@@ -109,8 +219,9 @@ class BadgeTrackingApp {
             // Initialize user and badge selects if they exist
             const userSelectElement = document.getElementById('select-user');
             const badgeSelectElement = document.getElementById('select-badge');
-            if (users && userSelectElement && badgeSelectElement) {
-                this.populateUserSelect(users);
+            if (userSelectElement && badgeSelectElement) {
+                // Users are looked up as the awarder types, not listed in full
+                this.initUserSearch();
                 this.populateBadgeSelect(badges || []);
             }
             
@@ -300,10 +411,13 @@ class BadgeTrackingApp {
                     id: data.user_id,
                     username: data.username,
                     display_name: data.role === 'admin' ? 'Admin' : data.display_name,
-                    role: data.role || 'user'
+                    role: data.role || 'user',
+                    token: data.token
                 };
                 
                 localStorage.setItem('currentUser', JSON.stringify(this.currentUser));
+                this.scheduleSessionRefresh(data.expires_in);
+                this.syncSubscriptions();
                 this.updateAuthUI();
                 
                 // Check if admin and show admin features
@@ -425,7 +539,7 @@ class BadgeTrackingApp {
             // Then create the badge
             const response = await fetch('/badges', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ 
                     name, 
                     description,
@@ -574,7 +688,7 @@ class BadgeTrackingApp {
             // Then update the badge data
             const response = await fetch(`/badges/${badgeId}`, {
                 method: 'PUT',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ 
                     name, 
                     description,
@@ -608,7 +722,7 @@ class BadgeTrackingApp {
         try {
             const response = await fetch(`/badges/${badgeId}`, {
                 method: 'DELETE',
-                headers: { 'Content-Type': 'application/json' }
+                headers: this.authHeaders({ 'Content-Type': 'application/json' })
             });
             
             const result = await response.json();
@@ -657,7 +771,7 @@ class BadgeTrackingApp {
         try {
             const response = await fetch('/badges/award', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ 
                     user_id: userId, 
                     badge_id: badgeId,
@@ -689,8 +803,10 @@ class BadgeTrackingApp {
 
     handleLogout() {
         this.currentUser = null;
+        clearTimeout(this.sessionRefreshTimer);
         // Clear user from localStorage on logout
         localStorage.removeItem('currentUser');
+        this.syncSubscriptions();
         this.updateAuthUI();
         if (this.profileBadgesContainer) {
             this.profileBadgesContainer.innerHTML = '<p>No badges</p>';
@@ -796,13 +912,11 @@ class BadgeTrackingApp {
     async loadUserBadges() {
         if (!this.currentUser) return;
         try {
-            // Fetch user's awarded badges
-            const userBadgesResponse = await fetch(`/users/${this.currentUser.id}/badges`);
-            const userBadges = await userBadgesResponse.json();
-            
-            // Fetch all available badges
-            const allBadgesResponse = await fetch('/badges');
-            const allBadges = await allBadgesResponse.json();
+            // Fetch user's awarded badges and all available badges
+            const [userBadges, allBadges] = await Promise.all([
+                this.fetchAllPages(`/users/${this.currentUser.id}/badges`),
+                this.fetchAllPages('/badges')
+            ]);
             
             // Render user's awarded badges
             this.renderBadges(userBadges);
@@ -828,6 +942,31 @@ class BadgeTrackingApp {
         localStorage.setItem('theme', newTheme);
     }
 
+    initUserSearch() {
+        const searchInput = document.getElementById('select-user-search');
+        if (!searchInput || searchInput.dataset.bound) return;
+        searchInput.dataset.bound = 'true';
+        searchInput.addEventListener('input', () => {
+            clearTimeout(this.userSearchTimer);
+            this.userSearchTimer = setTimeout(() => this.searchUsers(searchInput.value), 200);
+        });
+    }
+
+    async searchUsers(query) {
+        if (!query.trim()) {
+            this.populateUserSelect([]);
+            return;
+        }
+        try {
+            const params = new URLSearchParams({ q: query, type: 'user', limit: 20 });
+            const response = await fetch(`/search?${params}`);
+            const data = await response.json();
+            this.populateUserSelect(data.results || []);
+        } catch (error) {
+            console.error('User search failed:', error);
+        }
+    }
+
     populateUserSelect(users) {
         const userSelect = document.getElementById('select-user');
         userSelect.innerHTML = '<option value="">Select User</option>';
@@ -1023,11 +1162,13 @@ renderBadges(badges) {
             badgeList.appendChild(badgeRow);
         });
     }
-    renderActivityFeed(activities) {
+    renderActivityFeed(activities, append = false) {
         const feedContainer = document.getElementById('feed-container');
         if (!feedContainer) return; // Skip if container doesn't exist (e.g., on badge management page)
         
-        feedContainer.innerHTML = '';
+        if (!append) {
+            feedContainer.innerHTML = '';
+        }
 
         activities.forEach(activity => {
             const activityItem = document.createElement('div');
@@ -1035,6 +1176,39 @@ renderBadges(badges) {
             activityItem.textContent = `${activity.user} earned ${activity.badge}`;
             feedContainer.appendChild(activityItem);
         });
+
+        // Remember where this page ended; a short page means we hit the start
+        this.feedCursor = activities.length ? activities[activities.length - 1].cursor : null;
+        this.feedExhausted = activities.length < this.feedPageSize;
+        this.initFeedScroll(feedContainer);
+    }
+
+    initFeedScroll(feedContainer) {
+        // Fetch older awards when the end of the feed scrolls into view
+        if (this.feedObserver || !('IntersectionObserver' in window)) return;
+        const sentinel = document.createElement('div');
+        sentinel.id = 'feed-sentinel';
+        feedContainer.after(sentinel);
+        this.feedObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadMoreActivity();
+            }
+        });
+        this.feedObserver.observe(sentinel);
+    }
+
+    async loadMoreActivity() {
+        if (this.feedLoading || this.feedExhausted || !this.feedCursor) return;
+        this.feedLoading = true;
+        try {
+            const params = new URLSearchParams({ before: this.feedCursor, limit: this.feedPageSize });
+            const response = await fetch(`/activity-feed?${params}`);
+            this.renderActivityFeed(await response.json(), true);
+        } catch (error) {
+            console.error('Failed to load older activity:', error);
+        } finally {
+            this.feedLoading = false;
+        }
     }
 
     async removeBadge(badgeId) {
@@ -1050,7 +1224,7 @@ renderBadges(badges) {
             }
             const response = await fetch('/badges/remove', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ user_id: userId, badge_id: badgeId })
             });
 
@@ -1070,6 +1244,16 @@ renderBadges(badges) {
     }
 
     handleWebSocketMessage(data) {
+        if (data.type === 'events') {
+            // The resume reply: the cursor reaches its seq only once the
+            // events in it have replayed through here
+            this.handleMissedEvents(data);
+            return;
+        }
+        if (data.seq) {
+            if (this.eventCursor && data.seq <= this.eventCursor.since) return;  // Already seen
+            this.advanceEventCursor(data.seq);
+        }
         switch(data.type) {
             case 'badge_awarded':
                 this.handleBadgeAwarded(data.badge);
@@ -1077,6 +1261,14 @@ renderBadges(badges) {
             case 'badge_removed':
                 this.handleBadgeRemoved(data.badge);
                 break;
+            case 'badges_awarded':
+                data.badges.forEach(badge => this.handleBadgeAwarded(badge));
+                break;
+            case 'badges_removed':
+                data.badges.forEach(badge => this.handleBadgeRemoved(badge));
+                break;
+            case 'subscriptions':
+                break;
             default:
                 console.log('Unhandled message type:', data.type);
         }
@@ -1091,7 +1283,9 @@ renderBadges(badges) {
             this.feedContainer.prepend(newActivityItem);
         }
 
-        if (this.profileBadgesContainer) {
+        // Only the recipient's own profile gets the new badge card
+        const isOwnBadge = this.currentUser && badge.user_id === this.currentUser.id;
+        if (this.profileBadgesContainer && isOwnBadge) {
             const newBadgeCard = document.createElement('div');
             newBadgeCard.classList.add('badge-card');
             newBadgeCard.innerHTML = `
@@ -1104,8 +1298,9 @@ renderBadges(badges) {
     }
 
     handleBadgeRemoved(badge) {
-        // Remove badge from UI
-        if (this.profileBadgesContainer) {
+        // Remove badge from UI if it was taken from the current user
+        const isOwnBadge = this.currentUser && badge.user_id === this.currentUser.id;
+        if (this.profileBadgesContainer && isOwnBadge) {
             const badgeToRemove = this.profileBadgesContainer.querySelector(`[data-badge-id="${badge.id}"]`);
             if (badgeToRemove) {
                 badgeToRemove.closest('.badge-card').remove();
@@ -6,6 +6,28 @@ class BadgeDetailsPage {
         this.loadInitialData();
         this.initTheme();
         this.setupEventListeners();
+        this.initWebSocket();
+    }
+
+    initWebSocket() {
+        // Live updates for this badge only, instead of polling the details API
+        this.ws = new WebSocket(`ws://${window.location.host}/ws`);
+
+        this.ws.onopen = () => {
+            this.ws.send(JSON.stringify({ type: 'subscribe', topics: [`badge:${this.badgeId}`] }));
+        };
+
+        this.ws.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'badge_awarded' || data.type === 'badge_removed') {
+                this.loadInitialData();
+            } else if (data.type === 'badges_awarded' || data.type === 'badges_removed') {
+                // Bulk changes go to every topic they touch; only reload for ours
+                if (data.badges.some(badge => badge.id === this.badgeId)) {
+                    this.loadInitialData();
+                }
+            }
+        };
     }
 
     async loadInitialData() {
@@ -23,6 +45,7 @@ class BadgeDetailsPage {
             this.currentBadge = data.badge;
             this.renderBadgeDetails(data);
             this.renderUsersList(data.users);
+            this.updateShowMoreHolders(data.next_cursor);
             
             // Check if user is logged in
             this.loadUserFromStorage();
@@ -63,11 +86,31 @@ class BadgeDetailsPage {
         }
     }
     
-    renderUsersList(users) {
+    updateShowMoreHolders(cursor) {
+        // Holders come a page at a time; offer the next page, if any
+        const showMore = document.getElementById('badge-users-more');
+        if (!showMore) return;
+        showMore.hidden = !cursor;
+        showMore.onclick = async () => {
+            try {
+                const params = new URLSearchParams({ cursor });
+                const response = await fetch(`/badge-details-api/${this.badgeId}?${params}`);
+                const data = await response.json();
+                this.renderUsersList(data.users, true);
+                this.updateShowMoreHolders(data.next_cursor);
+            } catch (error) {
+                console.error('Error loading more holders:', error);
+            }
+        };
+    }
+
+    renderUsersList(users, append = false) {
         const usersList = document.getElementById('badge-users');
-        usersList.innerHTML = '';
+        if (!append) {
+            usersList.innerHTML = '';
+        }
         
-        if (!users || users.length === 0) {
+        if (!append && (!users || users.length === 0)) {
             usersList.innerHTML = '<p>No users have been awarded this badge yet.</p>';
             return;
         }
@@ -204,6 +247,14 @@ class BadgeDetailsPage {
         });
     }
     
+    authHeaders(headers = {}) {
+        // Attach the session token issued by /login, if any
+        if (this.currentUser && this.currentUser.token) {
+            return { ...headers, 'Authorization': `Bearer ${this.currentUser.token}` };
+        }
+        return headers;
+    }
+
     openModal(modalId) {
         const modal = document.getElementById(modalId);
         if (modal) modal.style.display = 'block';
@@ -234,7 +285,13 @@ class BadgeDetailsPage {
             
             const result = await response.json();
             if (result.success) {
-                this.currentUser = { id: result.user_id, username: username };
+                this.currentUser = {
+                    id: result.user_id,
+                    username: username,
+                    display_name: result.display_name,
+                    role: result.role || 'user',
+                    token: result.token
+                };
                 localStorage.setItem('currentUser', JSON.stringify(this.currentUser));
                 this.updateAuthUI();
                 this.closeModal(document.getElementById('login-modal'));
@@ -446,7 +503,7 @@ class BadgeDetailsPage {
             // Then update the badge data
             const response = await fetch(`/badges/${badgeId}`, {
                 method: 'PUT',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ 
                     name, 
                     description,
@@ -479,31 +536,50 @@ class BadgeDetailsPage {
             return;
         }
         
-        try {
-            // Fetch all users to populate the dropdown
-            const response = await fetch('/users');
-            const users = await response.json();
-            
-            const userSelect = document.getElementById('award-user-select');
-            userSelect.innerHTML = '<option value="">Select User</option>';
-            
-            // Add all users except the current user
-            users.forEach(user => {
-                // Skip the current user to prevent self-awarding
-                if (user.id === this.currentUser.id) return;
-                
-                const option = document.createElement('option');
-                option.value = user.id;
-                option.textContent = user.display_name || user.username;
-                userSelect.appendChild(option);
+        // Users are looked up as the awarder types, not listed in full
+        const searchInput = document.getElementById('award-user-search');
+        searchInput.value = '';
+        this.populateUserSelect([]);
+        if (!searchInput.dataset.bound) {
+            searchInput.dataset.bound = 'true';
+            searchInput.addEventListener('input', () => {
+                clearTimeout(this.userSearchTimer);
+                this.userSearchTimer = setTimeout(() => this.searchUsers(searchInput.value), 200);
             });
-            
-            this.openModal('award-badge-modal');
+        }
+        this.openModal('award-badge-modal');
+    }
+
+    async searchUsers(query) {
+        if (!query.trim()) {
+            this.populateUserSelect([]);
+            return;
+        }
+        try {
+            const params = new URLSearchParams({ q: query, type: 'user', limit: 20 });
+            const response = await fetch(`/search?${params}`);
+            const data = await response.json();
+            this.populateUserSelect(data.results || []);
         } catch (error) {
             console.error('Error loading users:', error);
-            alert('Failed to load users');
         }
     }
+
+    populateUserSelect(users) {
+        const userSelect = document.getElementById('award-user-select');
+        userSelect.innerHTML = '<option value="">Select User</option>';
+        
+        // Add matching users except the current user
+        users.forEach(user => {
+            // Skip the current user to prevent self-awarding
+            if (user.id === this.currentUser.id) return;
+            
+            const option = document.createElement('option');
+            option.value = user.id;
+            option.textContent = user.display_name || user.username;
+            userSelect.appendChild(option);
+        });
+    }
     
     async handleAwardBadge() {
         if (!this.currentUser) {
@@ -528,7 +604,7 @@ class BadgeDetailsPage {
         try {
             const response = await fetch('/badges/award', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ 
                     user_id: userId, 
                     badge_id: badgeId,
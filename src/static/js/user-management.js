@@ -39,6 +39,14 @@ class UserManagementPage {
         }
     }
 
+    authHeaders(headers = {}) {
+        // Attach the session token issued by /login, if any
+        if (this.currentUser && this.currentUser.token) {
+            return { ...headers, 'Authorization': `Bearer ${this.currentUser.token}` };
+        }
+        return headers;
+    }
+
     initTheme() {
         const savedTheme = localStorage.getItem('theme') || 'light';
         document.documentElement.setAttribute('data-theme', savedTheme);
@@ -83,24 +91,35 @@ class UserManagementPage {
         }
     }
     
-    async loadUsers() {
+    async loadUsers(cursor = null) {
         try {
-            // API call to get all users with their roles
-            const response = await fetch('/admin/users');
-            const users = await response.json();
-            this.users = users;
-            this.renderUsers(users);
+            // API call to get a page of users with their roles
+            const params = new URLSearchParams({ limit: 100 });
+            if (cursor) params.set('cursor', cursor);
+            const response = await fetch(`/admin/users?${params}`, { headers: this.authHeaders() });
+            const page = await response.json();
+            this.users = cursor ? [...(this.users || []), ...page.items] : page.items;
+            this.renderUsers(page.items, Boolean(cursor));
+
+            // Offer the next page, if any
+            const loadMore = document.getElementById('load-more-users');
+            if (loadMore) {
+                loadMore.hidden = !page.next_cursor;
+                loadMore.onclick = () => this.loadUsers(page.next_cursor);
+            }
         } catch (error) {
             console.error('Failed to load users:', error);
             document.getElementById('users-list').innerHTML = '<tr><td colspan="4">Error loading users</td></tr>';
         }
     }
     
-    renderUsers(users) {
+    renderUsers(users, append = false) {
         const usersList = document.getElementById('users-list');
-        usersList.innerHTML = '';
+        if (!append) {
+            usersList.innerHTML = '';
+        }
         
-        if (!users || users.length === 0) {
+        if (!append && (!users || users.length === 0)) {
             usersList.innerHTML = '<tr><td colspan="4">No users found</td></tr>';
             return;
         }
@@ -119,25 +138,21 @@ class UserManagementPage {
                 </td>
             `;
             
-            usersList.appendChild(userRow);
-        });
-        
-        // Add event listeners to buttons
-        const resetPasswordButtons = document.querySelectorAll('.reset-password-btn');
-        resetPasswordButtons.forEach(button => {
-            button.addEventListener('click', (e) => {
+            // Add event listeners to this row's buttons
+            userRow.querySelector('.reset-password-btn').addEventListener('click', (e) => {
                 const userId = e.target.getAttribute('data-user-id');
                 const username = e.target.getAttribute('data-username');
                 this.openResetPasswordModal(userId, username);
             });
-        });
-        
-        const removeUserButtons = document.querySelectorAll('.remove-user-btn');
-        removeUserButtons.forEach(button => {
-            button.addEventListener('click', (e) => {
-                const userId = e.target.getAttribute('data-user-id');
-                this.handleRemoveUser(userId);
-            });
+            const removeUserButton = userRow.querySelector('.remove-user-btn');
+            if (removeUserButton) {
+                removeUserButton.addEventListener('click', (e) => {
+                    const userId = e.target.getAttribute('data-user-id');
+                    this.handleRemoveUser(userId);
+                });
+            }
+            
+            usersList.appendChild(userRow);
         });
     }
     
@@ -162,7 +177,7 @@ class UserManagementPage {
         try {
             const response = await fetch(`/admin/users/${userId}/reset-password`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: this.authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ password: newPassword })
             });
             
@@ -186,7 +201,8 @@ class UserManagementPage {
         
         try {
             const response = await fetch(`/admin/users/${userId}`, {
-                method: 'DELETE'
+                method: 'DELETE',
+                headers: this.authHeaders()
             });
             
             const result = await response.json();
@@ -0,0 +1,681 @@
+import asyncio
+import os
+import re
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import aiofiles
+from codec import dumps, dumps_str, loads
+from metrics import OpTimings
+
+COLLECTIONS = ('users', 'badges', 'awards')
+MONTH = re.compile(r'^\d{4}-\d{2}')
+
+
+def fsync_dir(path):
+    # Make a create or rename inside the directory durable (POSIX only)
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(file_path, content):
+    # Write to a temp file, fsync it and rename it over the target, so
+    # readers see either the old or the new file and never a partial one
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    fsync_dir(os.path.dirname(os.path.abspath(file_path)))
+
+
+# Append-only journal of mutation events for one data file
+class AppendLog:
+    def __init__(self, path, commit_window=0.002, io=None):
+        self.path = path
+        self.io = io or OpTimings()  # shared with the owning storage
+        # While a compaction is writing a new snapshot, the journal it is
+        # folding in lives here and new events go to a fresh journal
+        self.rotated_path = path + '.compacting'
+        self.lock = asyncio.Lock()
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # Group commit: a single writer task drains everything queued within
+        # commit_window seconds and makes it durable with one write + fsync
+        self.commit_window = commit_window
+        self.queue = None
+        self.writer = None
+        self.batches = 0
+        self.events = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+
+    async def replay(self):
+        events = []
+        for path in (self.rotated_path, self.path):
+            if os.path.exists(path):
+                events.extend(await self._read_events(path))
+        return events
+
+    async def _read_events(self, path):
+        start = time.perf_counter()
+        async with aiofiles.open(path, mode='rb') as f:
+            content = await f.read()
+        self.io.observe('journal_read', time.perf_counter() - start, len(content))
+
+        lines = content.split(b'\n')
+        tail = lines.pop()  # Empty when the file ends with a newline
+        events = [loads(line) for line in lines if line.strip()]
+
+        if tail.strip():
+            try:
+                events.append(loads(tail))
+            except ValueError:
+                # A crash mid-append leaves a partial last line; drop it so
+                # the next append starts on a clean line
+                print(f"Discarding truncated journal entry in {path}")
+                with open(path, 'r+b') as f:
+                    f.truncate(len(content) - len(tail))
+                if path == self.path:
+                    self.size = len(content) - len(tail)
+        return events
+
+    def submit(self, events):
+        # Queue events for the writer; the returned future resolves once
+        # they are fsync'd to the journal
+        data = b''.join(dumps(event) + b'\n' for event in events)
+        if self.writer is None:
+            self.queue = asyncio.Queue()
+            self.writer = asyncio.create_task(self._write_batches())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((data, len(events), time.perf_counter(), future))
+        return future
+
+    async def append(self, events):
+        await self.submit(events)
+
+    async def _write_batches(self):
+        while True:
+            first = await self.queue.get()
+            if first is None:
+                return
+            if self.commit_window:
+                await asyncio.sleep(self.commit_window)
+
+            batch = [first]
+            stopping = False
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            data = b''.join(item[0] for item in batch)
+            try:
+                async with self.lock:
+                    start = time.perf_counter()
+                    await asyncio.to_thread(self._write_durably, data)
+                    self.io.observe('journal_append', time.perf_counter() - start, len(data))
+                    self.size += len(data)
+            except Exception as e:
+                print(f"Error writing journal {self.path}: {str(e)}")
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+            else:
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_result(None)
+                self._record_commit(batch)
+
+            if stopping:
+                return
+
+    def _write_durably(self, data):
+        created = not os.path.exists(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+
+    def _record_commit(self, batch):
+        # Commit latency runs from the oldest queued mutation to durability
+        commit_ms = (time.perf_counter() - batch[0][2]) * 1000
+        batch_size = sum(item[1] for item in batch)
+        self.batches += 1
+        self.events += batch_size
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.last_commit_ms = commit_ms
+        self.max_commit_ms = max(self.max_commit_ms, commit_ms)
+        self.total_commit_ms += commit_ms
+
+    def stats(self):
+        return {
+            'commit_window_ms': self.commit_window * 1000,
+            'journal_bytes': self.size,
+            'batches': self.batches,
+            'events': self.events,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'avg_batch_size': self.events / self.batches if self.batches else 0,
+            'last_commit_ms': self.last_commit_ms,
+            'max_commit_ms': self.max_commit_ms,
+            'avg_commit_ms': self.total_commit_ms / self.batches if self.batches else 0,
+        }
+
+    async def close(self):
+        # Flush whatever is still queued and stop the writer
+        if self.writer is not None:
+            self.queue.put_nowait(None)
+            await self.writer
+            self.writer = None
+
+    def rotate(self):
+        # Callers hold self.lock so no append lands between rename and reset.
+        # A rotated journal left by a failed compaction holds events that
+        # never reached a snapshot, so the live one is appended to it
+        # rather than replacing it
+        if os.path.exists(self.path):
+            if os.path.exists(self.rotated_path):
+                with open(self.path, 'rb') as live, open(self.rotated_path, 'ab') as rotated:
+                    shutil.copyfileobj(live, rotated)
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+        self.size = 0
+
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def clear(self):
+        for path in (self.rotated_path, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.size = 0
+
+
+def award_month(award):
+    # The YYYY-MM segment an award belongs to, or None when it has no
+    # usable date (such awards stay in the hot collection)
+    awarded_at = award.get('awarded_at') or ''
+    return awarded_at[:7] if MONTH.match(awarded_at) else None
+
+
+def award_key(award):
+    return (award.get('awarded_at') or '', award['id'])
+
+
+def summarize_segment(month, awards):
+    # Everything the resident indexes need from a sealed segment without
+    # loading it: award counts per badge and per (user, badge), and each
+    # user's earliest award of each badge
+    summary = {'month': month, 'awards': 0, 'badges': {}, 'users': {}, 'first': {}}
+    for award in awards:
+        summary['awards'] += 1
+        user_id, badge_id = award.get('user_id'), award.get('badge_id')
+        if user_id is None or badge_id is None:
+            continue
+        summary['badges'][badge_id] = summary['badges'].get(badge_id, 0) + 1
+        held = summary['users'].setdefault(user_id, {})
+        held[badge_id] = held.get(badge_id, 0) + 1
+        firsts = summary['first'].setdefault(badge_id, {})
+        first = firsts.get(user_id)
+        if first is None or award_key(award) < award_key(first):
+            firsts[user_id] = award
+    return summary
+
+
+def empty_history():
+    return {'months': [], 'awards': 0, 'badges': {}, 'users': {}, 'first': {}, 'user_months': {}}
+
+
+def merge_summary(history, summary):
+    # Fold one segment summary into the history: the same counts and
+    # earliest awards over every sealed segment, plus the months in which
+    # each user has awards. Its size depends on users and badges, not on
+    # how many months have been sealed
+    month = summary['month']
+    history['months'].append(month)
+    history['awards'] += summary['awards']
+    for badge_id, count in summary['badges'].items():
+        history['badges'][badge_id] = history['badges'].get(badge_id, 0) + count
+    for user_id, counts in summary['users'].items():
+        held = history['users'].setdefault(user_id, {})
+        for badge_id, count in counts.items():
+            held[badge_id] = held.get(badge_id, 0) + count
+        history['user_months'].setdefault(user_id, []).append(month)
+    for badge_id, firsts in summary['first'].items():
+        earliest = history['first'].setdefault(badge_id, {})
+        for user_id, award in firsts.items():
+            first = earliest.get(user_id)
+            if first is None or award_key(award) < award_key(first):
+                earliest[user_id] = award
+    return history
+
+
+def apply_events(records, events):
+    # Fold journal events into an id -> record mapping, in journal order
+    for event in events:
+        if event['op'] == 'put':
+            record = event['record']
+            records[record['id']] = record
+        elif event['op'] == 'delete':
+            records.pop(event['id'], None)
+    return records
+
+
+# Storage backends. Both expose the same interface to DataManager:
+#   load()                 -> {'users': {...}, 'badges': {...}, 'awards': {...}}
+#                             each an id -> record mapping in a stable order
+#   put(name, *records)    -> insert or replace records, durable on return
+#   delete(name, *ids)     -> remove records, durable on return
+#   stats(), close()
+# load() may also return 'history', the merged summary of sealed award
+# segments (see merge_summary) whose awards are not part of 'awards';
+# load_segment(month) reads one of them on demand
+
+# JSON snapshots plus an append-only journal per collection. Awards from
+# before the current month are sealed into monthly segment files under
+# awards/, each with a summary, so startup reads only the current month and
+# the rolled-up history of the sealed ones
+class JsonStorage:
+    def __init__(self, data_dir, compact_threshold=1024 * 1024, commit_window=0.002, pretty=False):
+        self.data_dir = data_dir
+        # Indented snapshots are easier to read by hand but slower to write
+        # and several times larger; off unless asked for
+        self.pretty = pretty
+        self.files = {name: os.path.join(data_dir, f'{name}.json') for name in COLLECTIONS}
+        self.ensure_data_files()
+
+        # Mutations are appended to a journal per data file; the .json files
+        # are snapshots that the journal is folded into once it grows past
+        # compact_threshold bytes
+        self.compact_threshold = compact_threshold
+        # Time and bytes of every file read and write, by operation
+        self.io = OpTimings()
+        self.journals = {
+            name: AppendLog(os.path.join(data_dir, f'{name}.jsonl'), commit_window, self.io)
+            for name in COLLECTIONS
+        }
+        self.compactions = {}  # collection name -> running compaction task
+        self.collections = {}  # live mappings handed out by load()
+
+        # Sealed award segments: awards/YYYY-MM.json plus YYYY-MM.summary.json,
+        # and awards/history.json merging all the summaries. Nothing new is
+        # written into a sealed segment; revoking one of its awards rewrites
+        # the segment and its summary and drops the history, which the next
+        # start rebuilds from the summaries
+        self.segments_dir = os.path.join(data_dir, 'awards')
+        self.history_path = os.path.join(self.segments_dir, 'history.json')
+        self.sealed_months = set()
+        self.segment_records = {}  # month -> {award id: award}, once loaded
+        self.sealed_ids = {}  # award id -> month, for the loaded segments
+        self.segment_lock = asyncio.Lock()
+
+    def ensure_data_files(self):
+        # Initialize data files if they don't exist
+        for file_path in self.files.values():
+            if not os.path.exists(file_path):
+                with open(file_path, 'wb') as f:
+                    f.write(dumps([]))
+
+    async def read_json(self, file_path):
+        start = time.perf_counter()
+        async with aiofiles.open(file_path, mode='rb') as f:
+            content = await f.read()
+        data = loads(content) if content.strip() else []
+        self.io.observe('snapshot_read', time.perf_counter() - start, len(content))
+        return data
+
+    async def write_json(self, file_path, data):
+        start = time.perf_counter()
+        content = dumps(data, pretty=self.pretty)
+        await asyncio.to_thread(write_atomic, file_path, content)
+        self.io.observe('snapshot_write', time.perf_counter() - start, len(content))
+        return True
+
+    async def load(self):
+        # Replay snapshot plus journal for every collection. The mappings are
+        # kept so that compaction can snapshot whatever state the caller has
+        # mutated them into
+        for name in COLLECTIONS:
+            self.collections[name] = await self._replay(name)
+        history = await self._seal(await self._read_history())
+        return {**self.collections, 'history': history}
+
+    def _segment_path(self, month, kind=''):
+        return os.path.join(self.segments_dir, f'{month}{kind}.json')
+
+    async def _read_history(self):
+        # The history is trusted only if it covers exactly the segments on
+        # disk; otherwise it is rebuilt from their summaries
+        self.sealed_months = set()
+        if os.path.isdir(self.segments_dir):
+            self.sealed_months = {filename[:-len('.summary.json')] for filename in os.listdir(self.segments_dir)
+                                  if filename.endswith('.summary.json')}
+        if os.path.exists(self.history_path):
+            history = await self.read_json(self.history_path)
+            if set(history['months']) == self.sealed_months:
+                return history
+
+        history = empty_history()
+        for month in sorted(self.sealed_months):
+            merge_summary(history, await self.read_json(self._segment_path(month, '.summary')))
+        if self.sealed_months:
+            await self.write_json(self.history_path, history)
+        return history
+
+    def _discard_history(self):
+        try:
+            os.remove(self.history_path)
+        except FileNotFoundError:
+            pass
+
+    async def _seal(self, history):
+        # Move awards from before the current month out of the hot
+        # collection into their sealed segments and return the updated
+        # history. Segments are written before the hot snapshot drops the
+        # awards, and merged by id, so a crash in between only repeats the
+        # work on the next start
+        current = datetime.now(timezone.utc).strftime('%Y-%m')
+        awards = self.collections['awards']
+        by_month = {}
+        for award in awards.values():
+            month = award_month(award)
+            if month is not None and month < current:
+                by_month.setdefault(month, []).append(award)
+        if not by_month:
+            return history
+
+        os.makedirs(self.segments_dir, exist_ok=True)
+        resealed = False
+        for month, sealed in sorted(by_month.items()):
+            # Late awards for a month that is already sealed are merged in
+            resealed |= month in self.sealed_months
+            records = await self.load_segment(month) if month in self.sealed_months else {}
+            for award in sealed:
+                records[award['id']] = award
+            summary = await self._write_segment(month, records)
+            if not resealed:
+                merge_summary(history, summary)
+            print(f"Sealed {len(sealed)} awards into segment {month}")
+        if resealed:
+            self._discard_history()
+            history = await self._read_history()
+        else:
+            await self.write_json(self.history_path, history)
+
+        for sealed in by_month.values():
+            for award in sealed:
+                del awards[award['id']]
+        journal = self.journals['awards']
+        async with journal.lock:
+            await self.write_json(self.files['awards'], list(awards.values()))
+            journal.clear()
+        return history
+
+    async def _write_segment(self, month, records):
+        async with self.segment_lock:
+            await self.write_json(self._segment_path(month), list(records.values()))
+            summary = summarize_segment(month, records.values())
+            await self.write_json(self._segment_path(month, '.summary'), summary)
+            self.sealed_months.add(month)
+            return summary
+
+    async def load_segment(self, month):
+        # The awards of a sealed segment as an id -> award mapping, read
+        # from disk on first use and kept afterwards
+        records = self.segment_records.get(month)
+        if records is None:
+            records = {award['id']: award for award in await self.read_json(self._segment_path(month))}
+            self.segment_records[month] = records
+            for award_id in records:
+                self.sealed_ids[award_id] = month
+        return records
+
+    async def _replay(self, name):
+        file_path = self.files[name]
+        journal = self.journals[name]
+        records = {record['id']: record for record in await self.read_json(file_path)}
+        events = await journal.replay()
+        if not events:
+            return records
+
+        apply_events(records, events)
+        if os.path.exists(journal.rotated_path) or journal.size > self.compact_threshold:
+            # Fold leftovers of an interrupted compaction (or an oversized
+            # journal) into the snapshot before serving anything
+            await self.write_json(file_path, list(records.values()))
+            journal.clear()
+        return records
+
+    async def put(self, name, *records):
+        await self._journal(name, [{'op': 'put', 'record': record} for record in records])
+
+    async def delete(self, name, *record_ids):
+        if name == 'awards':
+            # Awards of loaded sealed segments are removed by rewriting the
+            # segment; the rest go through the journal
+            hot_ids, sealed = [], set()
+            for record_id in record_ids:
+                month = self.sealed_ids.pop(record_id, None)
+                if month is None:
+                    hot_ids.append(record_id)
+                else:
+                    self.segment_records[month].pop(record_id, None)
+                    sealed.add(month)
+            if sealed:
+                self._discard_history()
+            for month in sealed:
+                await self._write_segment(month, self.segment_records[month])
+            if not hot_ids:
+                return
+            record_ids = hot_ids
+        await self._journal(name, [{'op': 'delete', 'id': record_id} for record_id in record_ids])
+
+    async def _journal(self, name, events):
+        journal = self.journals[name]
+        await journal.append(events)
+        if journal.size > self.compact_threshold and name not in self.compactions:
+            task = asyncio.create_task(self._compact(name))
+            self.compactions[name] = task
+            task.add_done_callback(lambda _: self.compactions.pop(name, None))
+
+    async def _compact(self, name):
+        journal = self.journals[name]
+        try:
+            async with journal.lock:
+                await asyncio.to_thread(journal.rotate)
+                # Capture the state that the rotated journal leads up to;
+                # later events land in the fresh journal
+                records = list(self.collections[name].values())
+            await self.write_json(self.files[name], records)
+            journal.discard_rotated()
+        except Exception as e:
+            print(f"Error compacting {name} journal: {str(e)}")
+
+    def stats(self):
+        stats = {name: journal.stats() for name, journal in self.journals.items()}
+        stats['segments'] = {'sealed': len(self.sealed_months), 'loaded': len(self.segment_records)}
+        stats['io'] = self.io.snapshot()
+        return stats
+
+    async def close(self):
+        # Flush queued journal writes and let running compactions finish
+        for journal in self.journals.values():
+            await journal.close()
+        if self.compactions:
+            await asyncio.gather(*self.compactions.values())
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_username ON users(username);
+
+CREATE TABLE IF NOT EXISTS badges (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS awards (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    badge_id TEXT,
+    awarded_at TEXT,
+    awarded_by TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS awards_user_id ON awards(user_id);
+CREATE INDEX IF NOT EXISTS awards_badge_id ON awards(badge_id);
+CREATE INDEX IF NOT EXISTS awards_awarded_at ON awards(awarded_at);
+"""
+
+SQLITE_UPSERT = {
+    'users': (
+        'INSERT INTO users (id, username, data) VALUES (?, ?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET username = excluded.username, data = excluded.data'
+    ),
+    'badges': (
+        'INSERT INTO badges (id, data) VALUES (?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET data = excluded.data'
+    ),
+    'awards': (
+        'INSERT INTO awards (id, user_id, badge_id, awarded_at, awarded_by, data) '
+        'VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET user_id = excluded.user_id, badge_id = excluded.badge_id, '
+        'awarded_at = excluded.awarded_at, awarded_by = excluded.awarded_by, data = excluded.data'
+    ),
+}
+
+
+# SQLite database in WAL mode. Every call runs on one dedicated thread that
+# owns the connection, so the event loop never blocks on the database
+class SqliteStorage:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.conn = None
+        self.transactions = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.io = OpTimings()
+
+    async def _run(self, op, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.io.observe(op, elapsed)
+            self.transactions += 1
+            self.total_ms += elapsed * 1000
+            self.max_ms = max(self.max_ms, elapsed * 1000)
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=FULL')
+            self.conn.executescript(SQLITE_SCHEMA)
+        return self.conn
+
+    def _load(self):
+        conn = self._connect()
+        return {
+            'users': {row[0]: loads(row[1]) for row in
+                      conn.execute('SELECT id, data FROM users ORDER BY rowid')},
+            'badges': {row[0]: loads(row[1]) for row in
+                       conn.execute('SELECT id, data FROM badges ORDER BY rowid')},
+            'awards': {row[0]: loads(row[1]) for row in
+                       conn.execute('SELECT id, data FROM awards ORDER BY awarded_at, rowid')},
+        }
+
+    async def load(self):
+        return await self._run('sqlite_read', self._load)
+
+    @staticmethod
+    def _row(name, record):
+        data = dumps_str(record)
+        if name == 'users':
+            return (record['id'], record['username'], data)
+        if name == 'awards':
+            return (record['id'], record.get('user_id'), record.get('badge_id'),
+                    record.get('awarded_at'), record.get('awarded_by'), data)
+        return (record['id'], data)
+
+    def _execute(self, sql, rows):
+        conn = self._connect()
+        with conn:
+            conn.executemany(sql, rows)
+
+    async def put(self, name, *records):
+        # Serialize on the loop so the rows capture the records as they are now
+        rows = [self._row(name, record) for record in records]
+        await self._run('sqlite_write', self._execute, SQLITE_UPSERT[name], rows)
+
+    async def delete(self, name, *record_ids):
+        if name not in COLLECTIONS:
+            raise ValueError(f"Unknown collection: {name}")
+        await self._run('sqlite_write', self._execute, f'DELETE FROM {name} WHERE id = ?',
+                        [(record_id,) for record_id in record_ids])
+
+    def stats(self):
+        return {
+            'backend': 'sqlite',
+            'path': self.db_path,
+            'transactions': self.transactions,
+            'avg_ms': self.total_ms / self.transactions if self.transactions else 0,
+            'max_ms': self.max_ms,
+            'io': self.io.snapshot(),
+        }
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    async def close(self):
+        await self._run('sqlite_close', self._close)
+        self.executor.shutdown()
+
+
+async def migrate_json_to_sqlite(data_dir, db_path):
+    # One-shot import of the JSON snapshots and journals into SQLite.
+    # Records are upserted by id, so re-running the import is harmless
+    source = JsonStorage(data_dir)
+    target = SqliteStorage(db_path)
+    try:
+        collections = await source.load()
+        for name in COLLECTIONS:
+            await target.put(name, *collections[name].values())
+        counts = {name: len(collections[name]) for name in COLLECTIONS}
+        for month in collections['history']['months']:
+            awards = await source.load_segment(month)
+            await target.put('awards', *awards.values())
+            counts['awards'] += len(awards)
+        return counts
+    finally:
+        await source.close()
+        await target.close()